@@ -0,0 +1,336 @@
+"""
+Agenda de los asesores: reglas semanales, calendario público (JSON cacheado) y versionado.
+
+Los bloques de un asesor salen de dos fuentes:
+- Reglas semanales (AvailabilityRule, Modo Automático): se generan al vuelo para la ventana
+  pedida, sin filas en la BD. Las excepciones (AvailabilityException) y vacaciones los quitan.
+- Filas Availability: bloques manuales, o bloques de regla que se "materializaron" al reservarse.
+  Una fila siempre manda sobre el bloque virtual de la misma fecha y hora.
+
+Cada asesor tiene una "versión de disponibilidad" en el caché. Cualquier cambio en sus
+horarios (reserva, liberación, reglas, creación o borrado de bloques) la sube, y con eso
+quedan obsoletos su calendario cacheado y los ETag que tengan los navegadores.
+"""
+import hashlib
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils.http import parse_etags
+from django.utils.timezone import localtime, now, get_current_timezone
+
+from .models import Availability, AvailabilityRule, AvailabilityException, Vacation
+from .estadisticas import actualizar_proxima_hora
+
+# Hasta cuántos días hacia adelante puede reservar un cliente
+DIAS_VISIBLES = 60
+TTL_CALENDARIO = 60 * 10
+
+
+# ==========================================
+# VERSIONES
+# ==========================================
+def _clave_version(asesor_id):
+    return f"disponibilidad:version:{asesor_id}"
+
+
+def version_disponibilidad(asesor_id):
+    clave = _clave_version(asesor_id)
+    version = cache.get(clave)
+    if version is None:
+        cache.add(clave, int(time.time()), None)
+        version = cache.get(clave)
+    return version
+
+
+def agenda_modificada(asesor_id):
+    """
+    Llamar cada vez que cambian los horarios de un asesor (reserva, liberación, alta o baja de bloques).
+    Invalida su calendario cacheado y recalcula su próxima hora libre.
+    """
+    try:
+        cache.incr(_clave_version(asesor_id))
+    except ValueError:
+        version_disponibilidad(asesor_id)
+    actualizar_proxima_hora(asesor_id)
+
+
+# ==========================================
+# CALENDARIO
+# ==========================================
+def ventana_valida(desde, hasta):
+    """Recorta la ventana pedida a [hoy, hoy + DIAS_VISIBLES]."""
+    hoy = localtime(now()).date()
+    limite = hoy + timedelta(days=DIAS_VISIBLES)
+    desde = max(desde or hoy, hoy)
+    hasta = min(hasta or limite, limite)
+    return desde, hasta
+
+
+def _corte_actual():
+    """
+    Hora local redondeada hacia arriba a 15 min: las horas de HOY anteriores al corte se ocultan.
+    Redondear deja la misma clave de caché (y el mismo ETag) durante 15 minutos.
+    """
+    ahora = localtime(now()).replace(second=0, microsecond=0)
+    if ahora.minute % 15:
+        ahora += timedelta(minutes=15 - ahora.minute % 15)
+    return ahora
+
+
+def calendario(asesor_id, desde, hasta):
+    """
+    Retorna (etag, disponibilidad) para la ventana [desde, hasta].
+    disponibilidad = {"YYYY-MM-DD": [{"id", "hora", "disponible"}, ...]}
+    ("id" es None en los bloques de regla que todavía no se reservan)
+
+    Las retenciones de checkout no suben la versión (expiran solas), así que se consultan
+    aparte en cada request (un get_many) y entran en el ETag.
+    """
+    from .retenciones import bloques_retenidos
+    corte = _corte_actual()
+    clave = f"disponibilidad:{asesor_id}:v{version_disponibilidad(asesor_id)}:{desde}:{hasta}:{corte:%Y%m%d%H%M}"
+    etag = '"%s"' % hashlib.sha1(clave.encode()).hexdigest()[:20]
+
+    disponibilidad = cache.get(clave)
+    if disponibilidad is None:
+        disponibilidad = {}
+        for bloque in bloques_en_ventana(asesor_id, desde, hasta):
+            # Si la fecha es HOY y la hora del bloque ya pasó, no se muestra
+            if bloque.date == corte.date() and bloque.start_time < corte.time():
+                continue
+            disponibilidad.setdefault(bloque.date.strftime("%Y-%m-%d"), []).append({
+                'id': bloque.id,
+                'hora': bloque.start_time.strftime("%H:%M"),
+                'disponible': not bloque.is_booked,
+            })
+        cache.set(clave, disponibilidad, TTL_CALENDARIO)
+
+    libres = [
+        (datetime.strptime(dia, "%Y-%m-%d").date(), datetime.strptime(b['hora'], "%H:%M").time())
+        for dia, bloques in disponibilidad.items() for b in bloques if b['disponible']
+    ]
+    retenidos = {(f"{fecha:%Y-%m-%d}", f"{hora:%H:%M}") for fecha, hora in bloques_retenidos(asesor_id, libres)}
+    if retenidos:
+        disponibilidad = {
+            dia: [
+                {**b, 'disponible': False} if (dia, b['hora']) in retenidos else b
+                for b in bloques
+            ]
+            for dia, bloques in disponibilidad.items()
+        }
+        huella = ",".join(f"{dia} {hora}" for dia, hora in sorted(retenidos))
+        etag = '"%s"' % hashlib.sha1(f"{clave}|{huella}".encode()).hexdigest()[:20]
+
+    return etag, disponibilidad
+
+
+def etag_vigente(if_none_match, etag):
+    """
+    ¿El navegador ya tiene `etag`? Compara contra cada etiqueta de If-None-Match por separado
+    (comparación débil: W/"x" vale como "x"; "*" vale por cualquiera).
+    """
+    etiquetas = parse_etags(if_none_match or '')
+    return '*' in etiquetas or etag in {e.removeprefix('W/') for e in etiquetas}
+
+
+# ==========================================
+# BLOQUES (REGLAS + FILAS)
+# ==========================================
+@dataclass
+class Bloque:
+    date: object
+    start_time: object
+    end_time: object
+    id: int = None          # None = bloque virtual (de regla, sin fila)
+    is_booked: bool = False
+
+
+def _zona(nombre):
+    try:
+        return ZoneInfo(nombre)
+    except (ZoneInfoNotFoundError, ValueError):
+        return get_current_timezone()
+
+
+def _bloques_de_reglas(reglas, desde, hasta):
+    """Expande las reglas en (fecha, inicio, fin) en hora local del sitio, dentro de [desde, hasta]."""
+    zona_sitio = get_current_timezone()
+    por_dia = {}
+    for regla in reglas:
+        por_dia.setdefault(regla.weekday, []).append(regla)
+
+    # Un día de margen a cada lado: la zona de la regla puede correr la fecha
+    fecha = desde - timedelta(days=1)
+    while fecha <= hasta + timedelta(days=1):
+        for regla in por_dia.get(fecha.weekday(), []):
+            if fecha < regla.valid_from or (regla.valid_until and fecha > regla.valid_until):
+                continue
+            inicio = datetime.combine(fecha, regla.start_time, tzinfo=_zona(regla.timezone)).astimezone(zona_sitio)
+            if desde <= inicio.date() <= hasta:
+                fin = inicio + timedelta(minutes=regla.duration_minutes)
+                yield inicio.date(), inicio.time(), fin.time()
+        fecha += timedelta(days=1)
+
+
+def bloques_en_ventana(asesor_id, desde, hasta):
+    """Todos los bloques (virtuales y guardados) del asesor entre `desde` y `hasta`, en orden."""
+    filas = {
+        (f.date, f.start_time): Bloque(f.date, f.start_time, f.end_time, f.id, f.is_booked)
+        for f in Availability.objects.filter(asesor_id=asesor_id, date__gte=desde, date__lte=hasta)
+    }
+
+    reglas = list(AvailabilityRule.objects.filter(
+        Q(valid_until__isnull=True) | Q(valid_until__gte=desde - timedelta(days=1)),
+        asesor_id=asesor_id,
+        valid_from__lte=hasta + timedelta(days=1),
+    ))
+
+    virtuales = {}
+    if reglas:
+        excepciones = set(
+            AvailabilityException.objects.filter(asesor_id=asesor_id, date__gte=desde, date__lte=hasta)
+            .values_list('date', 'start_time')
+        )
+        dias_bloqueados = {fecha for fecha, hora in excepciones if hora is None}
+        vacaciones = list(
+            Vacation.objects.filter(asesor_id=asesor_id, start_date__lte=hasta, end_date__gte=desde)
+            .values_list('start_date', 'end_date')
+        )
+
+        for fecha, inicio, fin in _bloques_de_reglas(reglas, desde, hasta):
+            if (fecha, inicio) in filas or (fecha, inicio) in excepciones or fecha in dias_bloqueados:
+                continue
+            if any(v_inicio <= fecha <= v_fin for v_inicio, v_fin in vacaciones):
+                continue
+            virtuales[(fecha, inicio)] = Bloque(fecha, inicio, fin)
+
+    todos = {**virtuales, **filas}
+    return [todos[k] for k in sorted(todos)]
+
+
+def proximo_bloque_libre(asesor_id):
+    """Fecha/hora (aware) del próximo bloque libre del asesor, o None si no tiene en los próximos días visibles."""
+    ahora = localtime(now())
+    desde = ahora.date()
+    limite = desde + timedelta(days=DIAS_VISIBLES)
+
+    # Buscamos de a una semana: casi siempre basta con la primera
+    while desde <= limite:
+        hasta = min(desde + timedelta(days=6), limite)
+        for bloque in bloques_en_ventana(asesor_id, desde, hasta):
+            if bloque.is_booked or (bloque.date == ahora.date() and bloque.start_time < ahora.time()):
+                continue
+            return datetime.combine(bloque.date, bloque.start_time, tzinfo=get_current_timezone())
+        desde = hasta + timedelta(days=1)
+    return None
+
+
+def materializar_bloque(asesor, fecha, hora):
+    """
+    Devuelve la fila Availability de ese bloque, creándola si es un bloque virtual válido.
+    Retorna None si el asesor no tiene ese bloque.
+    """
+    fila = Availability.objects.filter(asesor=asesor, date=fecha, start_time=hora).first()
+    if fila:
+        return fila
+
+    for bloque in bloques_en_ventana(asesor.id, fecha, fecha):
+        if bloque.start_time == hora:
+            fila, _ = Availability.objects.get_or_create(
+                asesor=asesor, date=fecha, start_time=hora,
+                defaults={'end_time': bloque.end_time},
+            )
+            return fila
+    return None
+
+
+def quitar_bloque(asesor, fecha, hora):
+    """Borra un bloque: la fila si existe y, si lo genera una regla, deja una excepción para que no vuelva."""
+    Availability.objects.filter(asesor=asesor, date=fecha, start_time=hora).delete()
+
+    generado_por_regla = any(
+        inicio == hora for _, inicio, _ in _bloques_de_reglas(asesor.availability_rules.all(), fecha, fecha)
+    )
+    if generado_por_regla:
+        AvailabilityException.objects.get_or_create(asesor=asesor, date=fecha, start_time=hora)
+    agenda_modificada(asesor.id)
+
+
+# ==========================================
+# REGLAS (MODO AUTOMÁTICO)
+# ==========================================
+def guardar_reglas(asesor, desde, dias, horas):
+    """Reemplaza las reglas semanales del asesor (Modo Automático). Retorna cuántas quedaron."""
+    zona = asesor.user.timezone or get_current_timezone().key
+    reglas = [
+        AvailabilityRule(
+            asesor=asesor,
+            weekday=int(dia),
+            start_time=datetime.strptime(hora, "%H:%M").time(),
+            duration_minutes=asesor.session_duration,
+            timezone=zona,
+            valid_from=desde,
+        )
+        for dia in sorted({int(d) for d in dias})
+        for hora in sorted(set(horas)) if hora
+    ]
+    with transaction.atomic():
+        asesor.availability_rules.all().delete()
+        AvailabilityRule.objects.bulk_create(reglas)
+    agenda_modificada(asesor.id)
+    return len(reglas)
+
+
+def cerrar_reglas(asesor, hasta):
+    """Las reglas dejan de generar bloques después de `hasta` (al salir del Modo Automático)."""
+    asesor.availability_rules.filter(Q(valid_until__isnull=True) | Q(valid_until__gt=hasta)).update(valid_until=hasta)
+    agenda_modificada(asesor.id)
+
+
+# ==========================================
+# GENERACIÓN MASIVA DE BLOQUES
+# ==========================================
+def generar_bloques(asesor, desde, hasta, dias, horas):
+    """
+    Crea los bloques de `asesor` entre `desde` y `hasta` (inclusive) para los días de la semana
+    `dias` (0=Lunes) y las horas `horas` ("HH:MM"). Los que ya existen se saltan.
+
+    Cantidad fija de consultas sin importar cuántos bloques se creen: una para leer los
+    existentes, un bulk_create (la restricción única asesor+fecha+hora evita duplicados
+    si dos requests generan al mismo tiempo) y un COUNT. Retorna cuántos bloques se
+    insertaron de verdad (filas de la ventana después del insert menos las que ya había):
+    con ignore_conflicts la BD no informa cuáles insertó.
+    """
+    dias = {int(d) for d in dias}
+    horas_obj = sorted({datetime.strptime(h, "%H:%M").time() for h in horas if h})
+    duracion = timedelta(minutes=asesor.session_duration)
+
+    existentes = set(
+        Availability.objects.filter(asesor=asesor, date__gte=desde, date__lte=hasta)
+        .values_list('date', 'start_time')
+    )
+
+    nuevos = []
+    fecha_actual = desde
+    while fecha_actual <= hasta:
+        if fecha_actual.weekday() in dias:
+            for hora_obj in horas_obj:
+                if (fecha_actual, hora_obj) in existentes:
+                    continue
+                fin = (datetime.combine(fecha_actual, hora_obj) + duracion).time()
+                nuevos.append(Availability(asesor=asesor, date=fecha_actual, start_time=hora_obj, end_time=fin))
+        fecha_actual += timedelta(days=1)
+
+    if not nuevos:
+        return 0
+    Availability.objects.bulk_create(nuevos, batch_size=1000, ignore_conflicts=True)
+    creados = Availability.objects.filter(asesor=asesor, date__gte=desde, date__lte=hasta).count() - len(existentes)
+    creados = max(0, min(creados, len(nuevos)))
+    if creados:
+        agenda_modificada(asesor.id)
+    return creados
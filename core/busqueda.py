@@ -0,0 +1,161 @@
+"""
+Motor de búsqueda del catálogo de asesores.
+
+Cada AsesorProfile guarda un `search_document` (título, especialidad, experiencia,
+biografía y nombre) ya normalizado: minúsculas y sin tildes.
+- PostgreSQL: índice GIN sobre to_tsvector('spanish', search_document) (stemming en español).
+- SQLite (local): tabla virtual FTS5 sincronizada con triggers.
+"""
+import re
+import unicodedata
+
+from django.db import connection
+
+# Máximo de resultados rankeados que devuelve una búsqueda
+LIMITE_RESULTADOS = 500
+
+TABLA_PERFILES = 'core_asesorprofile'
+TABLA_FTS = 'core_asesorprofile_fts'
+INDICE_GIN = 'core_asesorprofile_search_gin'
+
+
+def normalizar_texto(texto):
+    """Pasa a minúsculas y quita tildes ('Martínez' -> 'martinez')."""
+    if not texto:
+        return ""
+    descompuesto = unicodedata.normalize('NFKD', str(texto))
+    sin_tildes = "".join(c for c in descompuesto if not unicodedata.combining(c))
+    return sin_tildes.lower()
+
+
+def construir_documento(perfil):
+    """Arma el texto indexable de un perfil."""
+    partes = [
+        perfil.public_title,
+        perfil.specialty,
+        perfil.experience_summary,
+        perfil.description,
+    ]
+    if perfil.user_id:
+        partes += [perfil.user.first_name, perfil.user.last_name]
+    return normalizar_texto(" ".join(p for p in partes if p))
+
+
+def _terminos(query):
+    return re.findall(r'\w+', normalizar_texto(query))
+
+
+def buscar_ids(query, perfiles=None, limite=LIMITE_RESULTADOS):
+    """
+    Devuelve los IDs de AsesorProfile que calzan con `query`, del más relevante al menos.
+
+    `perfiles` (un queryset: aprobados, precio, facetas...) se aplica dentro de la misma
+    consulta al índice, como subconsulta: el límite corta recién después de filtrar, así que
+    un catálogo con muchos perfiles no aprobados o fuera del filtro no deja resultados afuera.
+    """
+    terminos = _terminos(query)
+    if not terminos:
+        return []
+
+    vendor = connection.vendor
+    subconsulta, filtro_params = None, ()
+    if perfiles is not None and vendor in ('postgresql', 'sqlite'):
+        subconsulta, filtro_params = perfiles.order_by().values('id').query.sql_with_params()
+
+    if vendor == 'postgresql':
+        texto = " ".join(terminos)
+        filtro = f"AND id IN ({subconsulta})" if subconsulta else ""
+        sql = f"""
+            SELECT id FROM {TABLA_PERFILES}
+            WHERE to_tsvector('spanish', search_document) @@ websearch_to_tsquery('spanish', %s)
+            {filtro}
+            ORDER BY ts_rank(to_tsvector('spanish', search_document), websearch_to_tsquery('spanish', %s)) DESC, id
+            LIMIT %s
+        """
+        params = [texto, *filtro_params, texto, limite]
+
+    elif vendor == 'sqlite' and _fts5_disponible():
+        # Cada término como prefijo: "pyth" encuentra "python"
+        match = " ".join(f'"{t}"*' for t in terminos)
+        filtro = f"AND rowid IN ({subconsulta})" if subconsulta else ""
+        sql = f"""
+            SELECT rowid FROM {TABLA_FTS}
+            WHERE {TABLA_FTS} MATCH %s
+            {filtro}
+            ORDER BY rank
+            LIMIT %s
+        """
+        params = [match, *filtro_params, limite]
+
+    else:
+        # Respaldo genérico (sin ranking): todos los términos deben aparecer
+        from .models import AsesorProfile
+        qs = AsesorProfile.objects.all() if perfiles is None else perfiles
+        for t in terminos:
+            qs = qs.filter(search_document__contains=t)
+        return list(qs.order_by('id').values_list('id', flat=True)[:limite])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [fila[0] for fila in cursor.fetchall()]
+
+
+def _fts5_disponible():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=%s", [TABLA_FTS]
+        )
+        return cursor.fetchone() is not None
+
+
+# ==========================================
+# INSTALACIÓN DEL ÍNDICE (migraciones / post_migrate)
+# ==========================================
+def instalar_indice(conexion):
+    """
+    Crea el índice de búsqueda según el motor. Es idempotente.
+    En SQLite se llama también después de cada migrate, porque Django reconstruye
+    la tabla al alterarla y con eso se pierden los triggers.
+    """
+    with conexion.cursor() as cursor:
+        if conexion.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {INDICE_GIN} ON {TABLA_PERFILES} "
+                f"USING GIN (to_tsvector('spanish', search_document))"
+            )
+
+        elif conexion.vendor == 'sqlite':
+            try:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5("
+                    f"search_document, content='{TABLA_PERFILES}', content_rowid='id', "
+                    f"tokenize='unicode61 remove_diacritics 2')"
+                )
+            except Exception as e:
+                print(f"⚠️ SQLite sin FTS5, se usará búsqueda simple: {e}")
+                return
+
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ai AFTER INSERT ON {TABLA_PERFILES} BEGIN "
+                f"INSERT INTO {TABLA_FTS}(rowid, search_document) VALUES (new.id, new.search_document); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ad AFTER DELETE ON {TABLA_PERFILES} BEGIN "
+                f"INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_au AFTER UPDATE OF search_document ON {TABLA_PERFILES} BEGIN "
+                f"INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, search_document) VALUES ('delete', old.id, old.search_document); "
+                f"INSERT INTO {TABLA_FTS}(rowid, search_document) VALUES (new.id, new.search_document); END"
+            )
+            cursor.execute(f"INSERT INTO {TABLA_FTS}({TABLA_FTS}) VALUES ('rebuild')")
+
+
+def desinstalar_indice(conexion):
+    with conexion.cursor() as cursor:
+        if conexion.vendor == 'postgresql':
+            cursor.execute(f"DROP INDEX IF EXISTS {INDICE_GIN}")
+        elif conexion.vendor == 'sqlite':
+            for sufijo in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {TABLA_FTS}_{sufijo}")
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLA_FTS}")
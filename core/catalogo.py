@@ -0,0 +1,329 @@
+"""
+Listado público de asesores: paginación por cursor (keyset) y serialización de tarjetas.
+
+El cursor guarda el valor de la columna de orden + el id del último asesor de la página,
+así la siguiente página es un WHERE sobre un índice (no un OFFSET que crece con el catálogo).
+"""
+import base64
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Q, Case, When, Value, Count, IntegerField, BooleanField
+from django.urls import reverse
+from django.utils.timezone import localtime, now
+
+TAMANO_PAGINA = 12
+
+# Caché de resultados: la clave incluye la versión del catálogo, así invalidar es un solo INCR
+CLAVE_VERSION = 'catalogo:version'
+CLAVE_HITS = 'catalogo:hits'
+CLAVE_MISSES = 'catalogo:misses'
+TTL_RESULTADOS = 120  # segundos (el rating y la próxima hora cambian sin subir la versión)
+
+# Solo traemos las columnas que pinta la tarjeta
+CAMPOS_TARJETA = (
+    'id', 'public_title', 'experience_summary', 'hourly_rate',
+    'avg_rating', 'review_count', 'next_free_slot',
+    'user__first_name', 'user__last_name',
+)
+
+# orden -> (campo, descendente). El desempate siempre es el id en el mismo sentido.
+ORDENES = {
+    'nuevos': (None, True),
+    'precio': ('hourly_rate', False),
+    'rating': ('avg_rating', True),
+    'disponible': ('next_free_slot', False),
+}
+ORDEN_POR_DEFECTO = 'nuevos'
+
+
+# ==========================================
+# CURSORES
+# ==========================================
+def codificar_cursor(datos):
+    texto = json.dumps(datos, separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Devuelve el contenido del cursor o None si viene vacío o adulterado."""
+    if not cursor:
+        return None
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(cursor + relleno))
+    except (ValueError, TypeError):
+        return None
+
+
+def _a_json(valor):
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
+
+
+def _desde_json(campo, valor):
+    if campo == 'next_free_slot':
+        return datetime.fromisoformat(valor)
+    valor = Decimal(valor)
+    if not valor.is_finite():
+        raise ArithmeticError(valor)  # Cursor adulterado con NaN / Infinity
+    return valor
+
+
+# ==========================================
+# CACHÉ VERSIONADO
+# ==========================================
+def version_catalogo():
+    version = cache.get(CLAVE_VERSION)
+    if version is None:
+        # Partimos desde la hora actual para no reutilizar versiones viejas si se vació el caché
+        cache.add(CLAVE_VERSION, int(time.time()), None)
+        version = cache.get(CLAVE_VERSION)
+    return version
+
+
+def invalidar_catalogo():
+    """Sube la versión: todas las búsquedas cacheadas quedan obsoletas de inmediato."""
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        version_catalogo()
+
+
+def clave_resultados(parametros):
+    """Clave de caché a partir de los parámetros normalizados del listado."""
+    from .busqueda import normalizar_texto
+    normalizados = {
+        'q': " ".join(normalizar_texto(parametros.get('q', '')).split()),
+        'precio': (parametros.get('precio') or '').strip(),
+        'orden': parametros.get('orden') or '',
+        'disponible': parametros.get('disponible') == '1',
+        'cursor': parametros.get('cursor') or '',
+        'especialidad': parametros.get('especialidad') or '',
+        'duracion': parametros.get('duracion') or '',
+        'tramo': parametros.get('tramo') or '',
+        'semana': parametros.get('semana') == '1',
+    }
+    huella = hashlib.sha1(json.dumps(normalizados, sort_keys=True).encode()).hexdigest()
+    return f"catalogo:v{version_catalogo()}:{huella}"
+
+
+def _contar(clave):
+    try:
+        cache.incr(clave)
+    except ValueError:
+        cache.add(clave, 0, None)
+        cache.incr(clave)
+
+
+def obtener_cacheado(clave):
+    resultado = cache.get(clave)
+    _contar(CLAVE_HITS if resultado is not None else CLAVE_MISSES)
+    return resultado
+
+
+def guardar_cacheado(clave, resultado):
+    cache.set(clave, resultado, TTL_RESULTADOS)
+
+
+def estadisticas_cache():
+    hits = cache.get(CLAVE_HITS) or 0
+    misses = cache.get(CLAVE_MISSES) or 0
+    total = hits + misses
+    return {
+        'version': version_catalogo(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 3) if total else 0,
+    }
+
+
+# ==========================================
+# FACETAS
+# ==========================================
+# (desde, hasta, etiqueta) en CLP; 'hasta' es exclusivo
+TRAMOS_PRECIO = (
+    (None, 20000, "Hasta $20.000"),
+    (20000, 50000, "$20.000 - $50.000"),
+    (50000, 100000, "$50.000 - $100.000"),
+    (100000, None, "Más de $100.000"),
+)
+
+
+def fin_de_semana():
+    """Domingo 23:59:59 de la semana actual (hora local)."""
+    hoy = localtime(now())
+    domingo = hoy + timedelta(days=6 - hoy.weekday())
+    return domingo.replace(hour=23, minute=59, second=59, microsecond=0)
+
+
+def _q_tramo(indice):
+    desde, hasta, _ = TRAMOS_PRECIO[indice]
+    q = Q()
+    if desde is not None:
+        q &= Q(hourly_rate__gte=desde)
+    if hasta is not None:
+        q &= Q(hourly_rate__lt=hasta)
+    return q
+
+
+def filtrar_por_facetas(asesores, parametros):
+    """Aplica los filtros que el usuario eligió desde las facetas."""
+    if parametros.get('especialidad'):
+        asesores = asesores.filter(specialty=parametros['especialidad'])
+    if (parametros.get('duracion') or '').isdigit():
+        asesores = asesores.filter(session_duration=int(parametros['duracion']))
+    tramo = parametros.get('tramo') or ''
+    if tramo.isdigit() and int(tramo) < len(TRAMOS_PRECIO):
+        asesores = asesores.filter(_q_tramo(int(tramo)))
+    if parametros.get('semana') == '1':
+        asesores = asesores.filter(next_free_slot__gte=now(), next_free_slot__lte=fin_de_semana())
+    return asesores
+
+
+def calcular_facetas(asesores):
+    """
+    Conteos por especialidad, tramo de precio, duración y "disponible esta semana"
+    en UNA consulta agrupada. Las filas resultantes son combinaciones de facetas
+    (pocas), no asesores: el trabajo en Python no depende del tamaño del catálogo.
+    """
+    ahora = now()
+    filas = (
+        asesores.order_by()
+        .annotate(
+            tramo=Case(
+                *[When(_q_tramo(i), then=Value(i)) for i in range(len(TRAMOS_PRECIO))],
+                output_field=IntegerField(),
+            ),
+            semana=Case(
+                When(next_free_slot__gte=ahora, next_free_slot__lte=fin_de_semana(), then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            ),
+        )
+        .values('specialty', 'session_duration', 'tramo', 'semana')
+        .annotate(total=Count('id'))
+    )
+
+    especialidades, duraciones, tramos = {}, {}, {}
+    disponibles_semana = 0
+    for fila in filas:
+        especialidades[fila['specialty']] = especialidades.get(fila['specialty'], 0) + fila['total']
+        duraciones[fila['session_duration']] = duraciones.get(fila['session_duration'], 0) + fila['total']
+        if fila['tramo'] is not None:
+            tramos[fila['tramo']] = tramos.get(fila['tramo'], 0) + fila['total']
+        if fila['semana']:
+            disponibles_semana += fila['total']
+
+    return {
+        'especialidad': [
+            {'valor': valor, 'total': total}
+            for valor, total in sorted(especialidades.items(), key=lambda x: (-x[1], x[0]))
+        ],
+        'tramo': [
+            {'valor': i, 'etiqueta': TRAMOS_PRECIO[i][2], 'total': tramos[i]}
+            for i in range(len(TRAMOS_PRECIO)) if tramos.get(i)
+        ],
+        'duracion': [
+            {'valor': valor, 'total': total} for valor, total in sorted(duraciones.items())
+        ],
+        'semana': disponibles_semana,
+    }
+
+
+# ==========================================
+# PÁGINAS
+# ==========================================
+def pagina_por_orden(asesores, orden, cursor=None, tamano=TAMANO_PAGINA):
+    """
+    Página keyset para un orden estable (precio, rating, nuevos, disponible).
+    Retorna (lista_de_asesores, cursor_siguiente).
+    """
+    if orden not in ORDENES:
+        orden = ORDEN_POR_DEFECTO
+    campo, descendente = ORDENES[orden]
+
+    if orden == 'disponible':
+        asesores = asesores.filter(next_free_slot__gte=now())
+
+    if campo:
+        asesores = asesores.order_by(f"-{campo}" if descendente else campo, '-id' if descendente else 'id')
+    else:
+        asesores = asesores.order_by('-id')
+
+    posicion = decodificar_cursor(cursor)
+    if isinstance(posicion, list) and len(posicion) == 2:
+        valor, ultimo_id = posicion
+        try:
+            if campo:
+                valor = _desde_json(campo, valor)
+                despues = '__lt' if descendente else '__gt'
+                asesores = asesores.filter(
+                    Q(**{f"{campo}{despues}": valor}) |
+                    Q(**{campo: valor, f"id{despues}": ultimo_id})
+                )
+            else:
+                asesores = asesores.filter(id__lt=ultimo_id)
+        except (ValueError, TypeError, ArithmeticError):
+            pass  # Cursor inválido: partimos desde el principio
+
+    # Pedimos uno extra para saber si hay más
+    filas = list(asesores[:tamano + 1])
+    hay_mas = len(filas) > tamano
+    filas = filas[:tamano]
+
+    siguiente = None
+    if hay_mas and filas:
+        ultimo = filas[-1]
+        siguiente = codificar_cursor([_a_json(getattr(ultimo, campo)) if campo else None, ultimo.id])
+    return filas, siguiente
+
+
+def pagina_por_relevancia(asesores, ids_rankeados, cursor=None, tamano=TAMANO_PAGINA):
+    """
+    Página para resultados de búsqueda: el orden lo define el motor de búsqueda
+    (lista acotada por busqueda.LIMITE_RESULTADOS, ya filtrada dentro de la consulta al
+    índice), el cursor es la posición en esa lista.
+    """
+    permitidos = set(asesores.filter(id__in=ids_rankeados).values_list('id', flat=True))
+    ordenados = [pk for pk in ids_rankeados if pk in permitidos]
+
+    posicion = decodificar_cursor(cursor)
+    inicio = posicion if isinstance(posicion, int) and posicion >= 0 else 0
+
+    ids_pagina = ordenados[inicio:inicio + tamano]
+    por_id = {a.id: a for a in asesores.filter(id__in=ids_pagina)}
+    filas = [por_id[pk] for pk in ids_pagina if pk in por_id]
+
+    fin = inicio + tamano
+    siguiente = codificar_cursor(fin) if fin < len(ordenados) else None
+    return filas, siguiente
+
+
+# ==========================================
+# TARJETAS
+# ==========================================
+def serializar_asesor(asesor):
+    """Datos de una tarjeta del listado (sirve para el HTML y para el JSON de 'cargar más')."""
+    nombre = asesor.user.first_name or ""
+    apellido = asesor.user.last_name or ""
+    proxima = localtime(asesor.next_free_slot) if asesor.next_free_slot else None
+    return {
+        'id': asesor.id,
+        'nombre': f"{nombre} {apellido}".strip(),
+        'iniciales': f"{nombre[:1]}{apellido[:1]}",
+        'titulo': asesor.public_title,
+        'resumen': asesor.experience_summary,
+        'precio': int(asesor.hourly_rate or 0),
+        'rating': float(asesor.avg_rating or 0),
+        'resenas': asesor.review_count,
+        'proxima_hora': proxima.strftime("%d/%m %H:%M") if proxima else None,
+        'url_perfil': reverse('perfil_publico', args=[asesor.id]),
+    }
@@ -0,0 +1,217 @@
+"""
+Cliente HTTP de MercadoPago compartido por todo el proceso.
+
+- Una sola requests.Session con pool de conexiones keep-alive (no un SDK nuevo por request).
+- Timeout de conexión y de lectura en cada llamada: un MercadoPago lento no deja colgado
+  a un worker de gunicorn.
+- Reintentos con backoff exponencial y jitter ante caídas de red, 429 y 5xx. Las creaciones
+  llevan X-Idempotency-Key, así reintentarlas no duplica preferencias.
+- Circuit breaker: tras varias fallas seguidas deja de llamar por unos segundos y falla al
+  tiro (MercadoPagoNoDisponible); después deja pasar una llamada de prueba.
+- Métricas por operación (llamadas, errores, latencias) para `api_metricas_pagos`.
+"""
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+REINTENTABLES = {429, 500, 502, 503, 504}
+# Fallas de red transitorias; el resto de RequestException (URL inválida, redirecciones
+# infinitas...) no mejora reintentando
+ERRORES_RED_REINTENTABLES = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+class ErrorMercadoPago(Exception):
+    """MercadoPago respondió con error o no respondió."""
+
+
+class MercadoPagoNoDisponible(ErrorMercadoPago):
+    """El circuit breaker está abierto: no se intentó la llamada."""
+
+
+# ==========================================
+# CIRCUIT BREAKER
+# ==========================================
+class CircuitBreaker:
+    def __init__(self, umbral, enfriamiento):
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self.fallas = 0
+        self.abierto_hasta = 0
+        self.probando = False
+        self._candado = threading.Lock()
+
+    @property
+    def estado(self):
+        if self.fallas < self.umbral:
+            return 'cerrado'
+        return 'abierto' if time.monotonic() < self.abierto_hasta else 'semiabierto'
+
+    def permitir(self):
+        with self._candado:
+            estado = self.estado
+            if estado == 'cerrado':
+                return True
+            if estado == 'semiabierto' and not self.probando:
+                self.probando = True  # Solo una llamada de prueba a la vez
+                return True
+            return False
+
+    def exito(self):
+        with self._candado:
+            self.fallas = 0
+            self.probando = False
+
+    def falla(self):
+        with self._candado:
+            self.fallas += 1
+            self.probando = False
+            if self.fallas >= self.umbral:
+                self.abierto_hasta = time.monotonic() + self.enfriamiento
+
+
+# ==========================================
+# MÉTRICAS
+# ==========================================
+class Metricas:
+    """Contadores por operación, con las últimas latencias para percentiles."""
+
+    def __init__(self, muestras=500):
+        self._datos = {}
+        self._muestras = muestras
+        self._candado = threading.Lock()
+
+    def registrar(self, operacion, segundos, error=None):
+        with self._candado:
+            datos = self._datos.setdefault(operacion, {
+                'llamadas': 0, 'errores': 0, 'rechazadas': 0, 'ultimo_error': '',
+                'latencias': deque(maxlen=self._muestras),
+            })
+            datos['llamadas'] += 1
+            if error == 'circuito':
+                datos['rechazadas'] += 1
+            elif error:
+                datos['errores'] += 1
+                datos['ultimo_error'] = error[:200]
+            if segundos is not None:
+                datos['latencias'].append(segundos)
+
+    def resumen(self):
+        with self._candado:
+            resultado = {}
+            for operacion, datos in self._datos.items():
+                latencias = sorted(datos['latencias'])
+
+                def percentil(p):
+                    return round(latencias[min(len(latencias) - 1, int(len(latencias) * p))] * 1000, 1) if latencias else None
+
+                resultado[operacion] = {
+                    'llamadas': datos['llamadas'],
+                    'errores': datos['errores'],
+                    'rechazadas_por_circuito': datos['rechazadas'],
+                    'ultimo_error': datos['ultimo_error'],
+                    'latencia_ms_p50': percentil(0.50),
+                    'latencia_ms_p95': percentil(0.95),
+                    'latencia_ms_max': percentil(1.0),
+                }
+            return resultado
+
+
+# ==========================================
+# CLIENTE
+# ==========================================
+class ClienteMercadoPago:
+    def __init__(self, url_base, token, timeout=(3, 10), reintentos=2, espera_base=0.25,
+                 umbral_fallas=5, enfriamiento=30, conexiones=20):
+        self.url_base = url_base.rstrip('/')
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.circuito = CircuitBreaker(umbral_fallas, enfriamiento)
+        self.metricas = Metricas()
+
+        self.sesion = requests.Session()
+        self.sesion.headers['Authorization'] = f"Bearer {token}"
+        adaptador = HTTPAdapter(pool_connections=conexiones, pool_maxsize=conexiones)
+        self.sesion.mount('https://', adaptador)
+        self.sesion.mount('http://', adaptador)
+
+    def _llamar(self, operacion, metodo, ruta, **kwargs):
+        if not self.circuito.permitir():
+            self.metricas.registrar(operacion, None, 'circuito')
+            raise MercadoPagoNoDisponible(f"{operacion}: circuito abierto")
+
+        inicio = time.perf_counter()
+        error = None
+        for intento in range(self.reintentos + 1):
+            try:
+                respuesta = self.sesion.request(metodo, f"{self.url_base}{ruta}", timeout=self.timeout, **kwargs)
+                if respuesta.status_code not in REINTENTABLES:
+                    break
+                error = f"HTTP {respuesta.status_code}"
+            except requests.RequestException as e:
+                respuesta, error = None, f"{type(e).__name__}: {e}"
+                if not isinstance(e, ERRORES_RED_REINTENTABLES):
+                    break
+
+            if intento < self.reintentos:
+                # Backoff exponencial con jitter completo: los workers no reintentan todos juntos
+                time.sleep(random.uniform(0, self.espera_base * 2 ** intento))
+
+        segundos = time.perf_counter() - inicio
+        if respuesta is None or respuesta.status_code in REINTENTABLES:
+            self.circuito.falla()
+            self.metricas.registrar(operacion, segundos, error)
+            raise ErrorMercadoPago(f"{operacion}: {error}")
+
+        # Un 4xx es culpa de la request, no de MercadoPago: no abre el circuito
+        self.circuito.exito()
+        if respuesta.status_code >= 400:
+            self.metricas.registrar(operacion, segundos, f"HTTP {respuesta.status_code}")
+            raise ErrorMercadoPago(f"{operacion}: HTTP {respuesta.status_code} {respuesta.text[:200]}")
+
+        self.metricas.registrar(operacion, segundos)
+        try:
+            return respuesta.json()
+        except ValueError:
+            raise ErrorMercadoPago(f"{operacion}: respuesta no es JSON")
+
+    def crear_preferencia(self, datos):
+        return self._llamar(
+            'preferencia.crear', 'POST', '/checkout/preferences',
+            json=datos, headers={'X-Idempotency-Key': str(uuid.uuid4())},
+        )
+
+    def obtener_pago(self, payment_id):
+        return self._llamar('pago.obtener', 'GET', f"/v1/payments/{payment_id}")
+
+    def buscar_pagos(self, external_reference):
+        """Pagos asociados a una referencia (el id de la cita), del más nuevo al más viejo."""
+        respuesta = self._llamar('pago.buscar', 'GET', '/v1/payments/search', params={
+            'external_reference': external_reference, 'sort': 'date_created', 'criteria': 'desc',
+        })
+        return respuesta.get('results', [])
+
+
+_cliente = None
+_candado_cliente = threading.Lock()
+
+
+def cliente_mp():
+    """El cliente compartido del proceso (se crea la primera vez que se usa)."""
+    global _cliente
+    if _cliente is None:
+        with _candado_cliente:
+            if _cliente is None:
+                _cliente = ClienteMercadoPago(
+                    settings.MERCADO_PAGO_API_URL,
+                    settings.MERCADO_PAGO_TOKEN,
+                    timeout=(settings.MERCADO_PAGO_TIMEOUT_CONEXION, settings.MERCADO_PAGO_TIMEOUT_LECTURA),
+                    reintentos=settings.MERCADO_PAGO_REINTENTOS,
+                )
+    return _cliente
@@ -0,0 +1,243 @@
+"""
+Contabilidad: montos cobrados y libro de movimientos (LedgerEntry).
+
+El precio se congela en la cita (price_amount) al pagar y cada evento de dinero agrega una
+fila al libro: VENTA al confirmar el pago, REEMBOLSO (lo devuelto, ya descontada la multa)
+al aprobar un reclamo y ANULACION cuando se cancela una venta completa. Los ingresos son
+SUM(amount) sobre una sola tabla indexada por fecha de sesión: no dependen de la tarifa
+actual del asesor ni hacen JOIN.
+
+Cada movimiento suma además en MonthlyRevenue (asesor, año, mes), de modo que el dashboard
+lee una fila por mes en vez de recorrer el libro. Si el resumen se desalinea, se reconstruye
+desde el libro con `reconstruir_resumen_mensual`.
+
+Las series de tiempo (`serie`) agrupan el libro por mes o semana en un solo GROUP BY y se
+cachean por rango; cada movimiento nuevo sube la versión y las deja obsoletas.
+"""
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear, TruncMonth, TruncWeek
+from django.utils.timezone import localtime
+
+from .models import Appointment, LedgerEntry, MonthlyRevenue
+
+TASA_MULTA = Decimal('0.15')
+
+CLAVE_VERSION = 'contabilidad:version'
+TTL_SERIE = 600  # segundos (la versión sube con cada movimiento, el TTL es solo un respaldo)
+PERIODOS = {'mes': TruncMonth, 'semana': TruncWeek}
+MAXIMO_PERIODOS = 260  # ~5 años por semana o ~21 años por mes
+
+
+def _movimiento(cita, tipo, monto):
+    return LedgerEntry(
+        asesor_id=cita.asesor_id,
+        appointment_id=cita.id,
+        kind=tipo,
+        amount=monto,
+        service_date=localtime(cita.start_datetime).date(),
+    )
+
+
+def _acumular(movimientos):
+    """Suma los movimientos al resumen mensual: un UPDATE con F() por (asesor, año, mes) tocado."""
+    deltas = defaultdict(lambda: [0, 0])
+    for m in movimientos:
+        delta = deltas[(m.asesor_id, m.service_date.year, m.service_date.month)]
+        delta[0] += m.amount
+        delta[1] += 1 if m.kind == 'VENTA' else -1
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        # Crea en cero los meses que falten; si otro proceso ya la creó, se ignora
+        MonthlyRevenue.objects.bulk_create(
+            [MonthlyRevenue(asesor_id=a, year=y, month=m) for a, y, m in deltas],
+            ignore_conflicts=True,
+        )
+        for (asesor_id, anio, mes), (monto, ventas) in deltas.items():
+            MonthlyRevenue.objects.filter(asesor_id=asesor_id, year=anio, month=mes).update(
+                revenue=F('revenue') + monto, sales=F('sales') + ventas,
+            )
+
+
+def _agregar(movimientos):
+    if not movimientos:
+        return
+    with transaction.atomic():
+        LedgerEntry.objects.bulk_create(movimientos)
+        _acumular(movimientos)
+        transaction.on_commit(invalidar_series)
+
+
+def registrar_ventas(citas):
+    """Una VENTA por cita recién pagada (usa el precio congelado en price_amount)."""
+    _agregar([_movimiento(c, 'VENTA', c.price_amount or 0) for c in citas])
+
+
+def registrar_anulaciones(citas):
+    """Revierte la venta completa de citas pagadas que se cancelan (vacaciones, anulación)."""
+    _agregar([_movimiento(c, 'ANULACION', -(c.price_amount or 0)) for c in citas if c.price_amount])
+
+
+def registrar_reembolso(cita):
+    """Reembolso de un reclamo aprobado: se devuelve el precio menos la multa del 15%."""
+    precio = cita.price_amount or 0
+    multa = (precio * TASA_MULTA).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+    devuelto = precio - multa
+    Appointment.objects.filter(id=cita.id).update(penalty_amount=multa, refund_amount=devuelto)
+    cita.penalty_amount, cita.refund_amount = multa, devuelto
+    _agregar([_movimiento(cita, 'REEMBOLSO', -devuelto)])
+
+
+def _filtro_periodo(asesor=None, anio=None, mes=None):
+    filtros = {}
+    if asesor is not None:
+        filtros['asesor'] = asesor
+    if anio:
+        filtros['year'] = anio
+    if anio and mes:
+        filtros['month'] = mes
+    return filtros
+
+
+def resumen(asesor=None, anio=None, mes=None):
+    """{'ingresos', 'ventas'} netos desde el resumen mensual: cuesta O(meses), no O(citas)."""
+    totales = MonthlyRevenue.objects.filter(**_filtro_periodo(asesor, anio, mes)).aggregate(
+        ingresos=Sum('revenue'), ventas=Sum('sales'),
+    )
+    return {'ingresos': totales['ingresos'] or 0, 'ventas': totales['ventas'] or 0}
+
+
+def ingresos(asesor=None, anio=None, mes=None):
+    """Ingresos netos (ventas - reembolsos - anulaciones), opcionalmente de un asesor, un año y/o un mes."""
+    return resumen(asesor, anio, mes)['ingresos']
+
+
+def anios_con_movimientos():
+    return list(MonthlyRevenue.objects.order_by('year').values_list('year', flat=True).distinct())
+
+
+def ranking_asesores(limite=5):
+    """[(asesor_id, ventas netas)] de los que más vendieron en toda la historia."""
+    return list(
+        MonthlyRevenue.objects.values('asesor_id').annotate(total=Sum('sales'))
+        .order_by('-total', 'asesor_id').values_list('asesor_id', 'total')[:limite]
+    )
+
+
+def reconstruir_resumen():
+    """Rehace MonthlyRevenue completo desde el libro (un solo GROUP BY). Devuelve las filas creadas."""
+    filas = (
+        LedgerEntry.objects
+        .annotate(anio=ExtractYear('service_date'), mes=ExtractMonth('service_date'))
+        .values('asesor_id', 'anio', 'mes')
+        .annotate(
+            total=Sum('amount'),
+            ventas=Count('id', filter=Q(kind='VENTA')) - Count('id', filter=~Q(kind='VENTA')),
+        )
+        .order_by()
+    )
+    with transaction.atomic():
+        MonthlyRevenue.objects.all().delete()
+        creadas = MonthlyRevenue.objects.bulk_create([
+            MonthlyRevenue(asesor_id=f['asesor_id'], year=f['anio'], month=f['mes'],
+                           revenue=f['total'] or 0, sales=f['ventas'])
+            for f in filas
+        ], batch_size=1000)
+    return len(creadas)
+
+
+# ==========================================
+# SERIES DE TIEMPO (CACHÉ VERSIONADO)
+# ==========================================
+def version_contabilidad():
+    version = cache.get(CLAVE_VERSION)
+    if version is None:
+        cache.add(CLAVE_VERSION, int(time.time()), None)
+        version = cache.get(CLAVE_VERSION)
+    return version
+
+
+def invalidar_series():
+    """Sube la versión: todas las series cacheadas quedan obsoletas de inmediato."""
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        version_contabilidad()
+
+
+def inicio_periodo(fecha, periodo):
+    return fecha.replace(day=1) if periodo == 'mes' else fecha - timedelta(days=fecha.weekday())
+
+
+def _siguiente(fecha, periodo):
+    if periodo == 'mes':
+        return fecha.replace(year=fecha.year + fecha.month // 12, month=fecha.month % 12 + 1)
+    return fecha + timedelta(days=7)
+
+
+def cantidad_periodos(desde, hasta, periodo):
+    inicio, fin = inicio_periodo(desde, periodo), inicio_periodo(hasta, periodo)
+    if periodo == 'mes':
+        return (fin.year - inicio.year) * 12 + fin.month - inicio.month + 1
+    return (fin - inicio).days // 7 + 1
+
+
+def periodos_entre(desde, hasta, periodo):
+    """Inicios de mes (o lunes) desde el período de `desde` hasta el de `hasta`, ambos incluidos."""
+    actual, fin = inicio_periodo(desde, periodo), inicio_periodo(hasta, periodo)
+    inicios = []
+    while actual <= fin:
+        inicios.append(actual)
+        actual = _siguiente(actual, periodo)
+    return inicios
+
+
+def serie(desde, hasta, periodo='mes', asesor_id=None):
+    """
+    Ingresos netos, ventas y devoluciones por mes o semana entre dos fechas de sesión (incluidas).
+    Una sola consulta con GROUP BY sobre el libro; los períodos sin movimientos vienen en cero.
+    """
+    clave = f"contabilidad:serie:v{version_contabilidad()}:{periodo}:{desde}:{hasta}:{asesor_id or 'todos'}"
+    resultado = cache.get(clave)
+    if resultado is not None:
+        return resultado
+
+    movimientos = LedgerEntry.objects.filter(service_date__gte=desde, service_date__lte=hasta)
+    if asesor_id:
+        movimientos = movimientos.filter(asesor_id=asesor_id)
+    filas = (
+        movimientos
+        .annotate(inicio=PERIODOS[periodo]('service_date'))
+        .values('inicio')
+        .annotate(
+            ingresos=Sum('amount'),
+            ventas=Count('id', filter=Q(kind='VENTA')),
+            anulaciones=Count('id', filter=Q(kind='ANULACION')),
+            reembolsos=Count('id', filter=Q(kind='REEMBOLSO')),
+            monto_reembolsado=Sum('amount', filter=Q(kind='REEMBOLSO')),
+        )
+        .order_by()
+    )
+    por_inicio = {f['inicio']: f for f in filas}
+
+    resultado = []
+    for inicio in periodos_entre(desde, hasta, periodo):
+        fila = por_inicio.get(inicio, {})
+        resultado.append({
+            'inicio': inicio.isoformat(),
+            'ingresos': int(fila.get('ingresos') or 0),
+            'ventas': fila.get('ventas', 0),
+            'anulaciones': fila.get('anulaciones', 0),
+            'reembolsos': fila.get('reembolsos', 0),
+            'monto_reembolsado': -int(fila.get('monto_reembolsado') or 0),
+        })
+    cache.set(clave, resultado, TTL_SERIE)
+    return resultado
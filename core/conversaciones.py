@@ -0,0 +1,135 @@
+"""
+Conversaciones del chat: una fila por par de usuarios con el último mensaje y los no leídos
+de cada lado, para que la bandeja del admin sea una consulta paginada (no recorrer todos los
+ChatMessage ni contar por usuario).
+
+Se actualiza desde el signal post_save del mensaje (las vistas crean el ChatMessage dentro de
+transaction.atomic(), así ambos se confirman juntos) y al marcar leídos, siempre con UPDATEs
+atómicos (F). Si se desalinea, `reconstruir_conversaciones` la rehace desde los mensajes.
+"""
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+
+from .catalogo import codificar_cursor, decodificar_cursor
+from .models import ChatMessage, Conversation
+
+TAMANO_PAGINA = 20
+
+
+def _par(usuario_id, otro_id):
+    return (usuario_id, otro_id) if usuario_id <= otro_id else (otro_id, usuario_id)
+
+
+def _campo_no_leidos(lector_id, otro_id):
+    return 'unread_a' if lector_id <= otro_id else 'unread_b'
+
+
+def registrar_mensaje(mensaje):
+    """Suma el mensaje a su conversación (la crea si es la primera vez que hablan)."""
+    user_a, user_b = _par(mensaje.sender_id, mensaje.recipient_id)
+    campo = _campo_no_leidos(mensaje.recipient_id, mensaje.sender_id)
+    with transaction.atomic():
+        Conversation.objects.bulk_create(
+            [Conversation(user_a_id=user_a, user_b_id=user_b, last_message_at=mensaje.fecha)],
+            ignore_conflicts=True,
+        )
+        conversacion = Conversation.objects.filter(user_a_id=user_a, user_b_id=user_b)
+        if not mensaje.leido:
+            conversacion.update(**{campo: F(campo) + 1})
+        # Con mensajes concurrentes gana el de id mayor, no el último en escribir
+        conversacion.filter(Q(last_message__isnull=True) | Q(last_message_id__lt=mensaje.id)).update(
+            last_message=mensaje, last_message_at=mensaje.fecha,
+        )
+
+
+def marcar_leidos(lector, otro):
+    """Marca como leídos los mensajes que `lector` recibió de `otro` y deja su contador en cero."""
+    with transaction.atomic():
+        marcados = ChatMessage.objects.filter(sender=otro, recipient=lector, leido=False).update(leido=True)
+        if marcados:
+            user_a, user_b = _par(lector.id, otro.id)
+            Conversation.objects.filter(user_a_id=user_a, user_b_id=user_b).update(
+                **{_campo_no_leidos(lector.id, otro.id): 0}
+            )
+    return marcados
+
+
+def no_leidos(lector, otro):
+    """Mensajes de `otro` que `lector` no ha leído (una lectura por clave única)."""
+    user_a, user_b = _par(lector.id, otro.id)
+    campo = _campo_no_leidos(lector.id, otro.id)
+    return Conversation.objects.filter(user_a_id=user_a, user_b_id=user_b).values_list(campo, flat=True).first() or 0
+
+
+def bandeja(usuario, busqueda=None, cursor=None, tamano=TAMANO_PAGINA):
+    """
+    Bandeja del staff: todas las conversaciones con el equipo (no solo las de `usuario`), de la
+    más reciente a la más antigua. Recorre el índice (-last_message_at, -id) con página keyset
+    y trae a los dos participantes y el último mensaje en el mismo JOIN: una consulta.
+    Retorna ([(otro, conversacion), ...], cursor_siguiente); `otro` es el participante que no
+    es `usuario` o, en conversaciones de otro miembro del equipo, el que no es superusuario.
+    """
+    conversaciones = (
+        Conversation.objects
+        .exclude(user_a__is_superuser=True, user_b__is_superuser=True)
+        .select_related('user_a', 'user_b', 'last_message')
+        .order_by('-last_message_at', '-id')
+    )
+    if busqueda:
+        conversaciones = conversaciones.filter(
+            Q(user_a__first_name__icontains=busqueda) | Q(user_b__first_name__icontains=busqueda) |
+            Q(user_a__last_name__icontains=busqueda) | Q(user_b__last_name__icontains=busqueda) |
+            Q(user_a__email__icontains=busqueda) | Q(user_b__email__icontains=busqueda)
+        )
+
+    posicion = decodificar_cursor(cursor)
+    if isinstance(posicion, list) and len(posicion) == 2:
+        try:
+            fecha, ultimo_id = datetime.fromisoformat(posicion[0]), int(posicion[1])
+            conversaciones = conversaciones.filter(
+                Q(last_message_at__lt=fecha) | Q(last_message_at=fecha, id__lt=ultimo_id)
+            )
+        except (ValueError, TypeError):
+            pass  # Cursor inválido: partimos desde el principio
+
+    # Pedimos una extra para saber si hay más
+    filas = list(conversaciones[:tamano + 1])
+    siguiente = None
+    if len(filas) > tamano:
+        filas = filas[:tamano]
+        siguiente = codificar_cursor([filas[-1].last_message_at.isoformat(), filas[-1].id])
+
+    return [(_participante_externo(c, usuario), c) for c in filas], siguiente
+
+
+def _participante_externo(conversacion, usuario):
+    if usuario.id in (conversacion.user_a_id, conversacion.user_b_id):
+        return conversacion.otro(usuario)
+    return conversacion.user_b if conversacion.user_a.is_superuser else conversacion.user_a
+
+
+def reconstruir_conversaciones():
+    """Rehace Conversation completo desde ChatMessage. Devuelve cuántas conversaciones quedaron."""
+    resumen = {}
+    filas = (
+        ChatMessage.objects.values('sender_id', 'recipient_id')
+        .annotate(ultimo=Max('id'), no_leidos=Count('id', filter=Q(leido=False)))
+        .order_by()
+    )
+    for fila in filas:
+        par = _par(fila['sender_id'], fila['recipient_id'])
+        datos = resumen.setdefault(par, {'ultimo': 0, 'unread_a': 0, 'unread_b': 0})
+        datos['ultimo'] = max(datos['ultimo'], fila['ultimo'])
+        datos[_campo_no_leidos(fila['recipient_id'], fila['sender_id'])] += fila['no_leidos']
+
+    fechas = dict(ChatMessage.objects.filter(id__in=[d['ultimo'] for d in resumen.values()]).values_list('id', 'fecha'))
+    with transaction.atomic():
+        Conversation.objects.all().delete()
+        Conversation.objects.bulk_create([
+            Conversation(user_a_id=a, user_b_id=b, last_message_id=d['ultimo'], last_message_at=fechas[d['ultimo']],
+                         unread_a=d['unread_a'], unread_b=d['unread_b'])
+            for (a, b), d in resumen.items()
+        ], batch_size=1000)
+    return len(resumen)
@@ -0,0 +1,103 @@
+"""
+Outbox de correos: las vistas y los workers solo insertan filas en OutgoingEmail, dentro de
+la misma transacción que el cambio de estado (si la transacción se revierte, el correo no
+existe). El comando `enviar_correos` los manda por lotes sobre una sola conexión SMTP
+(get_connection + send_messages) y reintenta los fallidos con backoff exponencial.
+
+Para avisos masivos (p. ej. vacaciones) el que encola guarda solo la plantilla y un contexto
+chico por mensaje; el cuerpo lo renderiza el worker al enviar, fuera de la request.
+
+Funciona con cualquier EMAIL_BACKEND (smtp, console, locmem, filebased).
+"""
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils.timezone import now
+
+from .models import OutgoingEmail
+
+TAMANO_LOTE = 50
+MAX_INTENTOS = 6
+ESPERA_BASE = 30  # segundos; se duplica en cada intento (30s, 1m, 2m, 4m, 8m)
+
+
+def correo(asunto, mensaje, destinatarios, remitente='', plantilla='', contexto=None):
+    """
+    Arma un OutgoingEmail sin guardarlo (para encolar varios de una vez). Con `plantilla`, el
+    cuerpo se renderiza al enviar con `contexto` (debe ser serializable a JSON).
+    """
+    return OutgoingEmail(subject=asunto[:255], body=mensaje, from_email=remitente,
+                         recipients=[d for d in destinatarios if d],
+                         template=plantilla, context=contexto or {})
+
+
+def encolar(correos):
+    """Guarda los correos en el outbox. Llamar dentro de la transacción del cambio que los origina."""
+    correos = [c for c in correos if c.recipients]
+    OutgoingEmail.objects.bulk_create(correos, batch_size=500)
+    return len(correos)
+
+
+def _cuerpo(c):
+    return render_to_string(c.template, c.context) if c.template else c.body
+
+
+def _espera(intentos):
+    return timedelta(seconds=random.uniform(0.5, 1) * ESPERA_BASE * 2 ** (intentos - 1))
+
+
+def enviar_pendientes(tamano=TAMANO_LOTE):
+    """
+    Envía un lote de correos pendientes por una sola conexión. Retorna (enviados, fallidos).
+    Varios workers pueden correr a la vez: cada uno toma filas distintas (skip_locked).
+    """
+    with transaction.atomic():
+        lote = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(sent_at__isnull=True, send_after__lte=now(), attempts__lt=MAX_INTENTOS)
+            .order_by('send_after', 'id')[:tamano]
+        )
+        if not lote:
+            return 0, 0
+
+        enviados, errores = [], {}
+        conexion = get_connection(fail_silently=False)
+        try:
+            conexion.open()
+        except Exception as e:
+            # Sin conexión no se intenta ninguno: todo el lote queda para el próximo intento
+            errores = {c.id: f"conexión: {e}" for c in lote}
+        else:
+            try:
+                for c in lote:
+                    try:
+                        mensaje = EmailMessage(c.subject, _cuerpo(c), c.from_email or settings.DEFAULT_FROM_EMAIL,
+                                               c.recipients, connection=conexion)
+                        # Un mensaje a la vez sobre la conexión abierta: un destinatario malo no bota el lote
+                        conexion.send_messages([mensaje])
+                        enviados.append(c.id)
+                    except Exception as e:
+                        errores[c.id] = str(e)
+            finally:
+                conexion.close()
+
+        OutgoingEmail.objects.filter(id__in=enviados).update(sent_at=now(), attempts=F('attempts') + 1, last_error='')
+        for c in lote:
+            if c.id in errores:
+                OutgoingEmail.objects.filter(id=c.id).update(
+                    attempts=F('attempts') + 1,
+                    send_after=now() + _espera(c.attempts + 1),
+                    last_error=errores[c.id][:255],
+                )
+    return len(enviados), len(errores)
+
+
+def limpiar_enviados(dias=30):
+    """Borra los correos ya enviados hace más de `dias` días."""
+    borrados, _ = OutgoingEmail.objects.filter(sent_at__lt=now() - timedelta(days=dias)).delete()
+    return borrados
@@ -0,0 +1,79 @@
+"""
+Estadísticas desnormalizadas de cada asesor (rating, reseñas, ventas, próxima hora libre).
+
+Se actualizan con UPDATEs atómicos (F) en cada transición, así el listado puede
+ordenar y filtrar con una sola consulta indexada sobre AsesorProfile.
+`recalcular()` las reconstruye desde cero (comando `recalcular_estadisticas`).
+"""
+from django.db.models import F, Q, Avg, Sum, Count, OuterRef, Subquery, Value, DecimalField, ExpressionWrapper
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+
+from .models import AsesorProfile, Appointment, Review
+
+
+def registrar_resena(asesor_id, rating):
+    """Suma una reseña nueva al promedio (exacto: usamos la suma total de estrellas)."""
+    AsesorProfile.objects.filter(id=asesor_id).update(
+        rating_total=F('rating_total') + rating,
+        review_count=F('review_count') + 1,
+        avg_rating=ExpressionWrapper(
+            (F('rating_total') + rating) * Value(1.0) / (F('review_count') + 1),
+            output_field=DecimalField(max_digits=3, decimal_places=2),
+        ),
+    )
+
+
+def sumar_ventas(asesor_id, cantidad=1):
+    """Ajusta las ventas confirmadas (cantidad negativa al cancelar o reembolsar)."""
+    if cantidad:
+        AsesorProfile.objects.filter(id=asesor_id).update(confirmed_sales=F('confirmed_sales') + cantidad)
+
+
+def actualizar_proxima_hora(asesor_id):
+    """Recalcula la próxima hora libre de UN asesor (se llama al reservar, liberar o editar la agenda)."""
+    from .agenda import proximo_bloque_libre
+    AsesorProfile.objects.filter(id=asesor_id).update(next_free_slot=proximo_bloque_libre(asesor_id))
+
+
+def refrescar_proximas_vencidas():
+    """
+    Recalcula la próxima hora libre de los asesores cuya hora guardada ya pasó (o que no tenían
+    y siguen con reglas: la ventana visible avanza un día cada día). Sin esto, un asesor sin
+    cambios en su agenda desaparece de los filtros por disponibilidad. Retorna cuántos revisó.
+    """
+    ids = list(
+        AsesorProfile.objects.filter(
+            Q(next_free_slot__lt=now()) | Q(next_free_slot__isnull=True, availability_rules__isnull=False)
+        ).values_list('id', flat=True).distinct()
+    )
+    for asesor_id in ids:
+        actualizar_proxima_hora(asesor_id)
+    return len(ids)
+
+
+def recalcular(asesor_ids=None):
+    """Reconstruye todas las estadísticas desde Review, Appointment y Availability."""
+    perfiles = AsesorProfile.objects.all()
+    if asesor_ids is not None:
+        perfiles = perfiles.filter(id__in=asesor_ids)
+
+    resenas = Review.objects.filter(asesor=OuterRef('pk')).order_by().values('asesor')
+    ventas = Appointment.objects.filter(asesor=OuterRef('pk'), status='CONFIRMADA').order_by().values('asesor')
+
+    perfiles.update(
+        rating_total=Coalesce(Subquery(resenas.annotate(s=Sum('rating')).values('s')), Value(0)),
+        review_count=Coalesce(Subquery(resenas.annotate(c=Count('id')).values('c')), Value(0)),
+        avg_rating=Coalesce(
+            Subquery(resenas.annotate(p=Avg('rating')).values('p'), output_field=DecimalField(max_digits=3, decimal_places=2)),
+            Value(0, output_field=DecimalField(max_digits=3, decimal_places=2)),
+        ),
+        confirmed_sales=Coalesce(Subquery(ventas.annotate(c=Count('id')).values('c')), Value(0)),
+    )
+
+    # La próxima hora libre depende de la hora actual y de las reglas: se calcula por asesor
+    total = 0
+    for asesor_id in perfiles.values_list('id', flat=True):
+        actualizar_proxima_hora(asesor_id)
+        total += 1
+    return total
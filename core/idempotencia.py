@@ -0,0 +1,70 @@
+"""
+Idempotencia para las acciones que el usuario repite sin querer (doble clic en "Reservar",
+doble envío del checkout).
+
+La primera request con una clave ejecuta la vista y guarda a dónde redirigió. Las siguientes
+con la misma clave redirigen ahí de inmediato: no vuelven a llamar a la API de MercadoPago
+ni escriben de nuevo. Solo se guardan redirecciones; si la vista responde otra cosa (una
+página de error) la clave se borra y el usuario puede reintentar.
+"""
+from datetime import timedelta
+
+from django.contrib import messages
+from django.db import IntegrityError, transaction
+from django.shortcuts import redirect
+from django.utils.timezone import now
+
+from .models import IdempotencyKey
+
+HORAS_VIGENCIA = 24
+LARGO_MAXIMO_CLAVE = 64
+
+
+def clave_cliente(request):
+    """Clave que manda el navegador (parámetro 'clave' o cabecera Idempotency-Key), o None si no es válida."""
+    clave = request.POST.get('clave') or request.GET.get('clave') or request.headers.get('Idempotency-Key')
+    if clave and len(clave) <= LARGO_MAXIMO_CLAVE and clave.replace('-', '').replace('_', '').isalnum():
+        return clave
+    return None
+
+
+def una_sola_vez(request, clave, vista, mensaje_repeticion, destino_en_curso):
+    """
+    Ejecuta `vista()` solo la primera vez que llega `clave` (None = sin idempotencia).
+
+    - Repetición de una acción terminada: redirige a donde redirigió la primera vez.
+    - Repetición mientras la primera sigue corriendo: avisa y redirige a `destino_en_curso`.
+    """
+    if not clave:
+        return vista()
+
+    try:
+        with transaction.atomic():
+            registro = IdempotencyKey.objects.create(key=clave)
+    except IntegrityError:
+        registro = IdempotencyKey.objects.filter(key=clave).first()
+        if registro is None:
+            return vista()  # La primera falló y liberó la clave justo ahora
+        if registro.location:
+            messages.info(request, mensaje_repeticion)
+            return redirect(registro.location)
+        messages.info(request, "Estamos procesando tu solicitud, espera un momento.")
+        return redirect(destino_en_curso)
+
+    try:
+        respuesta = vista()
+    except Exception:
+        registro.delete()
+        raise
+
+    if respuesta.status_code in (301, 302) and respuesta.get('Location'):
+        IdempotencyKey.objects.filter(id=registro.id).update(location=respuesta['Location'][:500])
+    else:
+        registro.delete()
+    return respuesta
+
+
+def limpiar_claves(horas=HORAS_VIGENCIA):
+    """Borra las claves viejas (los reintentos llegan en segundos, no en días). Retorna cuántas borró."""
+    borradas, _ = IdempotencyKey.objects.filter(created_at__lt=now() - timedelta(hours=horas)).delete()
+    return borradas
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.pagos import conciliar, HORAS_CONCILIACION, TAMANO_LOTE
+
+
+class Command(BaseCommand):
+    help = ("Concilia con MercadoPago las citas POR_PAGAR y las canceladas recientes: confirma las que sí se "
+            "pagaron (registrando su Payment) y cancela las rechazadas cuya ventana de pago ya venció.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horas', type=int, default=HORAS_CONCILIACION,
+                            help="Revisar citas creadas en las últimas N horas")
+        parser.add_argument('--hilos', type=int, default=8, help="Consultas simultáneas a MercadoPago")
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help="Citas por lote")
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        resultado = conciliar(options['horas'], options['hilos'], options['lote'])
+        segundos = time.perf_counter() - inicio
+
+        self.stdout.write(
+            f"🔎 {resultado['revisadas']} citas revisadas en {segundos:.2f}s "
+            f"({resultado['revisadas'] / segundos if segundos else 0:.0f} citas/s con {options['hilos']} hilos): "
+            f"{resultado['confirmadas']} confirmadas, {resultado['canceladas']} canceladas, "
+            f"{resultado['errores']} sin respuesta de MercadoPago."
+        )
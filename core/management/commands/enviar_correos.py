@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.correos import enviar_pendientes, limpiar_enviados, TAMANO_LOTE
+
+
+class Command(BaseCommand):
+    help = "Envía los correos del outbox por lotes (una conexión SMTP por lote) y reintenta los fallidos con backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help="Correos por lote (y por conexión)")
+        parser.add_argument('--loop', action='store_true',
+                            help="Quedarse corriendo y revisar el outbox cada --intervalo segundos")
+        parser.add_argument('--intervalo', type=int, default=5)
+
+    def handle(self, *args, **options):
+        while True:
+            inicio = time.perf_counter()
+            total_enviados = total_fallidos = 0
+            # Vaciamos el outbox lote a lote antes de dormir
+            while True:
+                enviados, fallidos = enviar_pendientes(options['lote'])
+                total_enviados += enviados
+                total_fallidos += fallidos
+                if enviados + fallidos < options['lote']:
+                    break
+
+            if total_enviados or total_fallidos:
+                segundos = time.perf_counter() - inicio
+                self.stdout.write(
+                    f"📧 {total_enviados} correos enviados, {total_fallidos} fallidos "
+                    f"en {segundos:.1f}s ({total_enviados / segundos:.1f} correos/s)."
+                )
+            elif not options['loop']:
+                self.stdout.write("📭 No hay correos pendientes.")
+
+            if not options['loop']:
+                break
+            limpiar_enviados()
+            time.sleep(options['intervalo'])
@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import time as hora, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+from django.utils.timezone import localtime, now
+
+from core.models import User, AsesorProfile, Availability, Appointment
+from core.reservas import confirmar_retencion, HoraTomada
+from core.retenciones import retener_bloque
+
+
+class Command(BaseCommand):
+    help = ("Prueba de estrés: muchos clientes intentan reservar EL MISMO bloque al mismo tiempo, por el mismo "
+            "camino que la web (retención de checkout y después la cita). Verifica que haya exactamente un ganador "
+            "e informa el rendimiento. Solo corre con DEBUG=True: crea datos temporales que borra al final.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=300, help="Cantidad de clientes concurrentes")
+        parser.add_argument('--hilos', type=int, default=50, help="Hilos que disparan las reservas")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG:
+            raise CommandError("estres_reservas escribe usuarios y citas de prueba: solo corre con DEBUG=True.")
+
+        clientes_n, hilos = options['clientes'], options['hilos']
+        marca = f"estres{int(time.time())}"
+
+        asesor_user = User.objects.create(username=f"{marca}_asesor", role='ASESOR')
+        asesor = AsesorProfile.objects.create(
+            user=asesor_user, public_title="Prueba de estrés", experience_summary="-", hourly_rate=1000,
+        )
+        manana = localtime(now()).date() + timedelta(days=1)
+        horario = Availability.objects.create(asesor=asesor, date=manana, start_time=hora(10), end_time=hora(11))
+        User.objects.bulk_create([User(username=f"{marca}_c{i}") for i in range(clientes_n)])
+        clientes = list(User.objects.filter(username__startswith=f"{marca}_c"))
+
+        resultados = {'ganadas': 0, 'tomadas': 0, 'errores': 0}
+        candado = threading.Lock()
+        largada = threading.Barrier(min(hilos, clientes_n))
+
+        def intentar(cliente):
+            try:
+                try:
+                    largada.wait(timeout=5)  # que todos partan juntos
+                except threading.BrokenBarrierError:
+                    pass
+                token = retener_bloque(asesor.id, horario.date, horario.start_time, horario.end_time, cliente.id)
+                confirmar_retencion(token, cliente)
+                resultado = 'ganadas'
+            except HoraTomada:
+                resultado = 'tomadas'
+            except OperationalError:
+                resultado = 'errores'  # p.ej. "database is locked" en SQLite
+            finally:
+                connection.close()  # cada hilo abre su propia conexión
+            with candado:
+                resultados[resultado] += 1
+
+        inicio = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=hilos) as pool:
+                list(pool.map(intentar, clientes))
+            segundos = time.perf_counter() - inicio
+
+            citas = Appointment.objects.filter(availability=horario).count()
+            self.stdout.write(
+                f"{clientes_n} intentos en {segundos:.2f}s ({clientes_n / segundos:.0f} intentos/s) con {hilos} hilos "
+                f"[{connection.vendor}]: {resultados['ganadas']} ganador(es), {resultados['tomadas']} 'hora tomada', "
+                f"{resultados['errores']} errores de BD. Citas en la BD para el bloque: {citas}."
+            )
+            if resultados['ganadas'] == 1 and citas == 1:
+                self.stdout.write(self.style.SUCCESS("OK: exactamente un cliente se quedó con la hora."))
+            else:
+                self.stdout.write(self.style.ERROR("FALLA: el bloque no tiene exactamente una reserva."))
+        finally:
+            User.objects.filter(username__startswith=marca).delete()
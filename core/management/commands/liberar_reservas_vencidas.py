@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.reservas import liberar_reservas_vencidas, MINUTOS_PARA_PAGAR
+from core.idempotencia import limpiar_claves
+from core.estadisticas import refrescar_proximas_vencidas
+
+
+class Command(BaseCommand):
+    help = "Cancela las reservas POR_PAGAR vencidas y libera sus horarios; refresca las próximas horas libres que ya pasaron y borra las claves de idempotencia viejas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutos', type=int, default=MINUTOS_PARA_PAGAR,
+                            help="Antigüedad mínima de la reserva sin pagar")
+        parser.add_argument('--loop', action='store_true',
+                            help="Quedarse corriendo y repetir cada --intervalo segundos")
+        parser.add_argument('--intervalo', type=int, default=60)
+
+    def handle(self, *args, **options):
+        while True:
+            liberadas = liberar_reservas_vencidas(options['minutos'])
+            refrescar_proximas_vencidas()
+            limpiar_claves()
+            if liberadas or not options['loop']:
+                self.stdout.write(f"🧹 {liberadas} reservas vencidas liberadas.")
+
+            if not options['loop']:
+                break
+            time.sleep(options['intervalo'])
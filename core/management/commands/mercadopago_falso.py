@@ -0,0 +1,119 @@
+import hashlib
+import hmac
+import itertools
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ("Servidor local que imita la API de MercadoPago (preferencias, pagos y webhooks) para desarrollo "
+            "y pruebas de carga. Usar con MP_API_URL=http://127.0.0.1:<puerto>.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--puerto', type=int, default=8001)
+        parser.add_argument('--webhook', help="URL del webhook a notificar al crear un pago "
+                                              "(ej: http://127.0.0.1:8000/webhooks/mercadopago/)")
+        parser.add_argument('--latencia', type=int, default=0, help="Milisegundos de espera por respuesta")
+
+    def handle(self, *args, **options):
+        pagos, preferencias = {}, {}
+        candado = threading.Lock()
+        ids = itertools.count(10_000_001)
+        base = f"http://127.0.0.1:{options['puerto']}"
+        secreto = settings.MERCADO_PAGO_WEBHOOK_SECRET
+        stdout = self.stdout
+
+        def notificar(payment_id):
+            # Misma firma que MercadoPago: HMAC-SHA256 de "id:<id>;request-id:<x-request-id>;ts:<ts>;"
+            request_id, ts = str(uuid.uuid4()), str(int(time.time() * 1000))
+            firma = hmac.new(secreto.encode(), f"id:{payment_id};request-id:{request_id};ts:{ts};".encode(),
+                             hashlib.sha256).hexdigest()
+            try:
+                requests.post(
+                    f"{options['webhook']}?data.id={payment_id}&type=payment",
+                    json={'type': 'payment', 'action': 'payment.created', 'data': {'id': str(payment_id)}},
+                    headers={'x-signature': f"ts={ts},v1={firma}", 'x-request-id': request_id},
+                    timeout=5,
+                )
+            except requests.RequestException as e:
+                stdout.write(f"⚠️ Webhook no respondió: {e}")
+
+        class Manejador(BaseHTTPRequestHandler):
+            def _responder(self, codigo, datos):
+                if options['latencia']:
+                    time.sleep(options['latencia'] / 1000)
+                cuerpo = json.dumps(datos).encode()
+                self.send_response(codigo)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def _cuerpo(self):
+                largo = int(self.headers.get('Content-Length') or 0)
+                try:
+                    return json.loads(self.rfile.read(largo) or b'{}')
+                except ValueError:
+                    return {}
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                ruta = url.path.rstrip('/')
+                if ruta == '/v1/payments/search':
+                    referencia = parse_qs(url.query).get('external_reference', [''])[0]
+                    with candado:
+                        encontrados = [p for p in pagos.values() if p['external_reference'] == referencia]
+                    encontrados.sort(key=lambda p: p['id'], reverse=True)
+                    return self._responder(200, {'results': encontrados, 'paging': {'total': len(encontrados)}})
+                if ruta.startswith('/v1/payments/'):
+                    pago = pagos.get(ruta.rsplit('/', 1)[-1])
+                    return self._responder(200, pago) if pago else self._responder(404, {'message': 'not_found'})
+                return self._responder(404, {'message': 'not_found'})
+
+            def do_POST(self):
+                ruta = urlparse(self.path).path.rstrip('/')
+                datos = self._cuerpo()
+
+                if ruta == '/checkout/preferences':
+                    pref_id = f"pref-{uuid.uuid4().hex[:12]}"
+                    preferencia = {**datos, 'id': pref_id, 'init_point': f"{base}/checkout/{pref_id}"}
+                    with candado:
+                        preferencias[pref_id] = preferencia
+                    return self._responder(201, preferencia)
+
+                if ruta == '/v1/payments':
+                    # Simula que el cliente pagó: {"external_reference": "<id cita>", "status": "approved", ...}
+                    with candado:
+                        payment_id = str(next(ids))
+                        pago = {
+                            'id': int(payment_id),
+                            'status': datos.get('status', 'approved'),
+                            'external_reference': str(datos.get('external_reference', '')),
+                            'transaction_amount': datos.get('transaction_amount', 0),
+                        }
+                        pagos[payment_id] = pago
+                    if options['webhook']:
+                        threading.Thread(target=notificar, args=(payment_id,), daemon=True).start()
+                    return self._responder(201, pago)
+
+                return self._responder(404, {'message': 'not_found'})
+
+            def log_message(self, formato, *args):
+                pass  # Silencioso: en pruebas de carga el log por request molesta
+
+        servidor = ThreadingHTTPServer(('127.0.0.1', options['puerto']), Manejador)
+        self.stdout.write(f"🧪 MercadoPago falso escuchando en {base} (Ctrl+C para salir)")
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            servidor.server_close()
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.pagos import procesar_notificaciones, TAMANO_LOTE
+
+
+class Command(BaseCommand):
+    help = "Procesa la cola de notificaciones de MercadoPago: confirma las citas pagadas por lotes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help="Notificaciones por lote")
+        parser.add_argument('--loop', action='store_true',
+                            help="Quedarse corriendo y revisar la cola cada --intervalo segundos")
+        parser.add_argument('--intervalo', type=int, default=5)
+
+    def handle(self, *args, **options):
+        while True:
+            # Vaciamos la cola lote a lote antes de dormir
+            while True:
+                procesadas, confirmadas = procesar_notificaciones(options['lote'])
+                if procesadas:
+                    self.stdout.write(
+                        f"💳 {procesadas} notificaciones: {confirmadas} citas confirmadas."
+                    )
+                if procesadas < options['lote']:
+                    break
+
+            if not options['loop']:
+                break
+            time.sleep(options['intervalo'])
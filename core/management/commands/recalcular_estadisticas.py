@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.estadisticas import recalcular
+
+
+class Command(BaseCommand):
+    help = "Reconstruye desde cero las estadísticas de los asesores (rating, reseñas, ventas, próxima hora libre)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--asesor', type=int, action='append', help="ID de asesor (se puede repetir)")
+
+    def handle(self, *args, **options):
+        total = recalcular(options['asesor'])
+        self.stdout.write(self.style.SUCCESS(f"Estadísticas recalculadas para {total} asesores."))
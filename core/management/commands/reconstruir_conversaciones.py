@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.conversaciones import reconstruir_conversaciones
+
+
+class Command(BaseCommand):
+    help = "Reconstruye desde los mensajes la tabla de conversaciones (último mensaje y no leídos por lado)."
+
+    def handle(self, *args, **options):
+        total = reconstruir_conversaciones()
+        self.stdout.write(self.style.SUCCESS(f"Conversaciones reconstruidas: {total}."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.contabilidad import reconstruir_resumen
+
+
+class Command(BaseCommand):
+    help = "Reconstruye desde el libro de movimientos el resumen mensual de ingresos y ventas por asesor."
+
+    def handle(self, *args, **options):
+        total = reconstruir_resumen()
+        self.stdout.write(self.style.SUCCESS(f"Resumen mensual reconstruido: {total} filas (asesor, mes)."))
@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+from core.busqueda import construir_documento, instalar_indice, desinstalar_indice
+
+
+def poblar_documentos(apps, schema_editor):
+    AsesorProfile = apps.get_model('core', 'AsesorProfile')
+    for perfil in AsesorProfile.objects.select_related('user'):
+        perfil.search_document = construir_documento(perfil)
+        perfil.save(update_fields=['search_document'])
+
+
+def crear_indice(apps, schema_editor):
+    instalar_indice(schema_editor.connection)
+
+
+def borrar_indice(apps, schema_editor):
+    desinstalar_indice(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_alter_appointment_options_alter_availability_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asesorprofile',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(poblar_documentos, migrations.RunPython.noop),
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
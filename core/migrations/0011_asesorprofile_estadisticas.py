@@ -0,0 +1,73 @@
+# Generated by Django 6.0 on 2026-10-18 10:43
+
+from datetime import datetime
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, Q, Sum
+from django.utils import timezone
+
+
+def poblar_estadisticas(apps, schema_editor):
+    AsesorProfile = apps.get_model('core', 'AsesorProfile')
+    Review = apps.get_model('core', 'Review')
+    Appointment = apps.get_model('core', 'Appointment')
+    Availability = apps.get_model('core', 'Availability')
+
+    ahora = timezone.localtime(timezone.now())
+    for perfil in AsesorProfile.objects.all():
+        resenas = Review.objects.filter(asesor=perfil).aggregate(s=Sum('rating'), c=Count('id'), p=Avg('rating'))
+        bloque = Availability.objects.filter(asesor=perfil, is_booked=False).filter(
+            Q(date__gt=ahora.date()) | Q(date=ahora.date(), start_time__gte=ahora.time())
+        ).order_by('date', 'start_time').first()
+
+        AsesorProfile.objects.filter(id=perfil.id).update(
+            rating_total=resenas['s'] or 0,
+            review_count=resenas['c'],
+            avg_rating=round(resenas['p'] or 0, 2),
+            confirmed_sales=Appointment.objects.filter(asesor=perfil, status='CONFIRMADA').count(),
+            next_free_slot=timezone.make_aware(datetime.combine(bloque.date, bloque.start_time)) if bloque else None,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_asesorprofile_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asesorprofile',
+            name='avg_rating',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=3, verbose_name='Calificación Promedio'),
+        ),
+        migrations.AddField(
+            model_name='asesorprofile',
+            name='confirmed_sales',
+            field=models.PositiveIntegerField(default=0, verbose_name='Ventas Confirmadas'),
+        ),
+        migrations.AddField(
+            model_name='asesorprofile',
+            name='next_free_slot',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Próxima Hora Libre'),
+        ),
+        migrations.AddField(
+            model_name='asesorprofile',
+            name='rating_total',
+            field=models.PositiveIntegerField(default=0, help_text='Suma de estrellas (para promediar sin redondeos)'),
+        ),
+        migrations.AddField(
+            model_name='asesorprofile',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Cantidad de Reseñas'),
+        ),
+        migrations.AddIndex(
+            model_name='asesorprofile',
+            index=models.Index(fields=['is_approved', '-avg_rating'], name='asesor_aprobado_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asesorprofile',
+            index=models.Index(fields=['is_approved', 'next_free_slot'], name='asesor_aprobado_proxima_idx'),
+        ),
+        migrations.RunPython(poblar_estadisticas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_asesorprofile_estadisticas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asesorprofile',
+            index=models.Index(fields=['is_approved', 'hourly_rate', 'id'], name='asesor_aprobado_precio_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_asesorprofile_indice_precio'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asesorprofile',
+            index=models.Index(fields=['is_approved', 'specialty'], name='asesor_aprobado_especial_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asesorprofile',
+            index=models.Index(fields=['is_approved', 'session_duration'], name='asesor_aprobado_duracion_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-18 10:47
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def eliminar_duplicados(apps, schema_editor):
+    """Antes de la restricción única: deja un solo bloque por asesor+fecha+hora (el reservado, si hay)."""
+    Availability = apps.get_model('core', 'Availability')
+    repetidos = (
+        Availability.objects.values('asesor_id', 'date', 'start_time')
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for grupo in repetidos:
+        ids = list(
+            Availability.objects.filter(
+                asesor_id=grupo['asesor_id'], date=grupo['date'], start_time=grupo['start_time']
+            ).order_by('-is_booked', 'id').values_list('id', flat=True)
+        )
+        Availability.objects.filter(id__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_asesorprofile_indices_facetas'),
+    ]
+
+    operations = [
+        migrations.RunPython(eliminar_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='availability',
+            constraint=models.UniqueConstraint(fields=('asesor', 'date', 'start_time'), name='bloque_unico_por_hora'),
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 6.0 on 2026-10-18 10:49
+
+from datetime import date, datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def convertir_a_reglas(apps, schema_editor):
+    """
+    Pasa active_days/active_hours del Modo Automático a reglas semanales y borra los bloques
+    futuros libres que esas reglas ya generan (se vuelven virtuales). Los reservados se quedan.
+    """
+    AsesorProfile = apps.get_model('core', 'AsesorProfile')
+    AvailabilityRule = apps.get_model('core', 'AvailabilityRule')
+    Availability = apps.get_model('core', 'Availability')
+
+    hoy = date.today()
+    for perfil in AsesorProfile.objects.filter(auto_schedule=True).select_related('user'):
+        dias = {int(d) for d in perfil.active_days.split(',') if d.strip().isdigit()}
+        horas = set()
+        for h in perfil.active_hours.split(','):
+            try:
+                horas.add(datetime.strptime(h.strip(), "%H:%M").time())
+            except ValueError:
+                continue
+        if not dias or not horas:
+            continue
+
+        AvailabilityRule.objects.bulk_create([
+            AvailabilityRule(
+                asesor=perfil, weekday=dia, start_time=hora,
+                duration_minutes=perfil.session_duration,
+                timezone=perfil.user.timezone or 'America/Santiago',
+                valid_from=hoy,
+            )
+            for dia in dias for hora in horas
+        ], ignore_conflicts=True)
+
+        # date__week_day: 1=Domingo ... 7=Sábado ; weekday(): 0=Lunes ... 6=Domingo
+        dias_django = [(d + 1) % 7 + 1 for d in dias]
+        Availability.objects.filter(
+            asesor=perfil, is_booked=False, date__gte=hoy,
+            date__week_day__in=dias_django, start_time__in=horas,
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_availability_bloque_unico'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Fecha')),
+                ('start_time', models.TimeField(blank=True, null=True, verbose_name='Hora Inicio')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('asesor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability_exceptions', to='core.asesorprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['asesor', 'date'], name='excepcion_asesor_fecha_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AvailabilityRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(help_text='0=Lunes, 6=Domingo', verbose_name='Día')),
+                ('start_time', models.TimeField(verbose_name='Hora Inicio')),
+                ('duration_minutes', models.PositiveIntegerField(default=60, verbose_name='Duración (minutos)')),
+                ('timezone', models.CharField(default='America/Santiago', max_length=50, verbose_name='Zona Horaria')),
+                ('valid_from', models.DateField(verbose_name='Vigente desde')),
+                ('valid_until', models.DateField(blank=True, help_text='Vacío = indefinido', null=True, verbose_name='Vigente hasta')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('asesor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability_rules', to='core.asesorprofile')),
+            ],
+            options={
+                'ordering': ['weekday', 'start_time'],
+                'constraints': [models.UniqueConstraint(fields=('asesor', 'weekday', 'start_time'), name='regla_unica_por_hora')],
+            },
+        ),
+        migrations.RunPython(convertir_a_reglas, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='asesorprofile',
+            name='active_days',
+        ),
+        migrations.RemoveField(
+            model_name='asesorprofile',
+            name='active_hours',
+        ),
+    ]
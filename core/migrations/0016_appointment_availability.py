@@ -0,0 +1,60 @@
+# Generated by Django 6.0 on 2026-10-18 10:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q
+from django.utils.timezone import localtime
+
+LOTE = 500
+
+
+def enlazar_bloques(apps, schema_editor):
+    """Une cada cita existente con su bloque (mismo asesor, fecha y hora local). Última vez que se busca así."""
+    Appointment = apps.get_model('core', 'Appointment')
+    Availability = apps.get_model('core', 'Availability')
+
+    ultimo_id = 0
+    while True:
+        citas = list(
+            Appointment.objects.filter(id__gt=ultimo_id, availability__isnull=True)
+            .order_by('id').only('id', 'asesor_id', 'start_datetime')[:LOTE]
+        )
+        if not citas:
+            break
+        ultimo_id = citas[-1].id
+
+        claves = {}
+        for cita in citas:
+            inicio = localtime(cita.start_datetime)
+            claves[cita.id] = (cita.asesor_id, inicio.date(), inicio.time())
+
+        filtro = Q()
+        for asesor_id, fecha, hora in set(claves.values()):
+            filtro |= Q(asesor_id=asesor_id, date=fecha, start_time=hora)
+        bloques = {
+            (b['asesor_id'], b['date'], b['start_time']): b['id']
+            for b in Availability.objects.filter(filtro).values('id', 'asesor_id', 'date', 'start_time')
+        }
+
+        enlazadas = []
+        for cita in citas:
+            cita.availability_id = bloques.get(claves[cita.id])
+            if cita.availability_id:
+                enlazadas.append(cita)
+        Appointment.objects.bulk_update(enlazadas, ['availability'], batch_size=LOTE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_reglas_disponibilidad'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='availability',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='appointments', to='core.availability'),
+        ),
+        migrations.RunPython(enlazar_bloques, migrations.RunPython.noop),
+    ]
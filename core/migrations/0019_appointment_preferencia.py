@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_paymentnotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='mp_init_point',
+            field=models.URLField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='mp_preference_hash',
+            field=models.CharField(blank=True, default='', help_text='Huella de los datos con que se creó', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='mp_preference_id',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
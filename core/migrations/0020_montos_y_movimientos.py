@@ -0,0 +1,77 @@
+# Generated by Django 6.0 on 2026-10-18 12:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q, OuterRef, Subquery
+from django.utils.timezone import localtime
+
+
+def poblar_movimientos(apps, schema_editor):
+    """
+    Congela el precio de las citas ya pagadas con la tarifa actual del asesor (es lo mejor que
+    sabemos) y crea sus movimientos. Las reembolsadas y las canceladas después de pagar quedan
+    con su venta y una anulación por el total, igual que como las contaba el dashboard antes.
+    """
+    Appointment = apps.get_model('core', 'Appointment')
+    AsesorProfile = apps.get_model('core', 'AsesorProfile')
+    LedgerEntry = apps.get_model('core', 'LedgerEntry')
+
+    pagadas = Appointment.objects.filter(
+        Q(status__in=['CONFIRMADA', 'FINALIZADA', 'REEMBOLSADO']) |
+        Q(status='CANCELADA', payment_token__isnull=False)
+    )
+    tarifa = AsesorProfile.objects.filter(id=OuterRef('asesor_id')).values('hourly_rate')[:1]
+    pagadas.filter(price_amount__isnull=True).update(price_amount=Subquery(tarifa))
+
+    movimientos = []
+    for cita in pagadas.only('id', 'asesor_id', 'status', 'start_datetime', 'price_amount').iterator(chunk_size=1000):
+        fecha = localtime(cita.start_datetime).date()
+        movimientos.append(LedgerEntry(
+            asesor_id=cita.asesor_id, appointment_id=cita.id, kind='VENTA', amount=cita.price_amount, service_date=fecha,
+        ))
+        if cita.status in ('REEMBOLSADO', 'CANCELADA'):
+            movimientos.append(LedgerEntry(
+                asesor_id=cita.asesor_id, appointment_id=cita.id, kind='ANULACION', amount=-cita.price_amount, service_date=fecha,
+            ))
+    LedgerEntry.objects.bulk_create(movimientos, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_appointment_preferencia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='penalty_amount',
+            field=models.DecimalField(decimal_places=0, default=0, max_digits=10, verbose_name='Multa retenida'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='price_amount',
+            field=models.DecimalField(blank=True, decimal_places=0, max_digits=10, null=True, verbose_name='Precio cobrado'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='refund_amount',
+            field=models.DecimalField(decimal_places=0, default=0, max_digits=10, verbose_name='Monto devuelto'),
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('VENTA', 'Venta'), ('REEMBOLSO', 'Reembolso (descontada la multa)'), ('ANULACION', 'Anulación de una venta')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=0, help_text='Negativo en reembolsos y anulaciones', max_digits=10)),
+                ('service_date', models.DateField(verbose_name='Fecha de la sesión')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('appointment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='core.appointment')),
+                ('asesor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='core.asesorprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['service_date'], name='movimiento_fecha_idx'), models.Index(fields=['asesor', 'service_date'], name='movimiento_asesor_fecha_idx')],
+            },
+        ),
+        migrations.RunPython(poblar_movimientos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 6.0 on 2026-10-18 13:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def poblar_resumen(apps, schema_editor):
+    """Arma el resumen mensual con lo que ya está en el libro de movimientos."""
+    LedgerEntry = apps.get_model('core', 'LedgerEntry')
+    MonthlyRevenue = apps.get_model('core', 'MonthlyRevenue')
+
+    filas = (
+        LedgerEntry.objects
+        .annotate(anio=ExtractYear('service_date'), mes=ExtractMonth('service_date'))
+        .values('asesor_id', 'anio', 'mes')
+        .annotate(
+            total=Sum('amount'),
+            ventas=Count('id', filter=Q(kind='VENTA')) - Count('id', filter=~Q(kind='VENTA')),
+        )
+        .order_by()
+    )
+    MonthlyRevenue.objects.bulk_create([
+        MonthlyRevenue(asesor_id=f['asesor_id'], year=f['anio'], month=f['mes'], revenue=f['total'] or 0, sales=f['ventas'])
+        for f in filas
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_montos_y_movimientos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('revenue', models.DecimalField(decimal_places=0, default=0, max_digits=12)),
+                ('sales', models.IntegerField(default=0, help_text='Ventas menos anulaciones y reembolsos')),
+                ('asesor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_revenue', to='core.asesorprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['year', 'month'], name='resumen_mes_idx')],
+                'constraints': [models.UniqueConstraint(fields=('asesor', 'year', 'month'), name='resumen_unico_por_mes')],
+            },
+        ),
+        migrations.RunPython(poblar_resumen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 6.0 on 2026-10-18 15:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def poblar_conversaciones(apps, schema_editor):
+    """Una Conversation por cada par de usuarios que ya intercambió mensajes."""
+    ChatMessage = apps.get_model('core', 'ChatMessage')
+    Conversation = apps.get_model('core', 'Conversation')
+
+    resumen = {}
+    filas = (
+        ChatMessage.objects.values('sender_id', 'recipient_id')
+        .annotate(ultimo=Max('id'), no_leidos=Count('id', filter=Q(leido=False)))
+        .order_by()
+    )
+    for fila in filas:
+        emisor, receptor = fila['sender_id'], fila['recipient_id']
+        par = (min(emisor, receptor), max(emisor, receptor))
+        datos = resumen.setdefault(par, {'ultimo': 0, 'unread_a': 0, 'unread_b': 0})
+        datos['ultimo'] = max(datos['ultimo'], fila['ultimo'])
+        datos['unread_a' if receptor <= emisor else 'unread_b'] += fila['no_leidos']
+
+    fechas = dict(ChatMessage.objects.filter(id__in=[d['ultimo'] for d in resumen.values()]).values_list('id', 'fecha'))
+    Conversation.objects.bulk_create([
+        Conversation(user_a_id=a, user_b_id=b, last_message_id=d['ultimo'], last_message_at=fechas[d['ultimo']],
+                     unread_a=d['unread_a'], unread_b=d['unread_b'])
+        for (a, b), d in resumen.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_indices_chat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_at', models.DateTimeField()),
+                ('unread_a', models.PositiveIntegerField(default=0, help_text='Mensajes que user_a no ha leído')),
+                ('unread_b', models.PositiveIntegerField(default=0, help_text='Mensajes que user_b no ha leído')),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.chatmessage')),
+                ('user_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversaciones_a', to=settings.AUTH_USER_MODEL)),
+                ('user_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversaciones_b', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_a', '-last_message_at', '-id'], name='conversacion_a_fecha_idx'), models.Index(fields=['user_b', '-last_message_at', '-id'], name='conversacion_b_fecha_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user_a', 'user_b'), name='conversacion_unica')],
+            },
+        ),
+        migrations.RunPython(poblar_conversaciones, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-18 16:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_conversaciones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckoutHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32, unique=True)),
+                ('date', models.DateField(verbose_name='Fecha')),
+                ('start_time', models.TimeField(verbose_name='Hora Inicio')),
+                ('end_time', models.TimeField(verbose_name='Hora Fin')),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('asesor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retenciones', to='core.asesorprofile')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retenciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('asesor', 'date', 'start_time'), name='retencion_unica_por_bloque')],
+            },
+        ),
+    ]
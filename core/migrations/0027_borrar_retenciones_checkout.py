@@ -0,0 +1,16 @@
+# Generated by Django 6.0 on 2026-10-18 11:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_retenciones_checkout'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='CheckoutHold',
+        ),
+    ]
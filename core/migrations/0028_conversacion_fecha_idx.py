@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_borrar_retenciones_checkout'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['-last_message_at', '-id'], name='conversacion_fecha_idx'),
+        ),
+    ]
@@ -53,10 +53,43 @@ class AsesorProfile(models.Model):
     cv_file = models.FileField(upload_to='cvs/', null=True, blank=True)
     session_duration = models.IntegerField("Duración (minutos)", default=60, help_text="Tiempo que dura cada bloque de horario")
 
-    # AUTOMATIZACIÓN DE AGENDA
+    # AUTOMATIZACIÓN DE AGENDA (las reglas semanales están en AvailabilityRule)
     auto_schedule = models.BooleanField(default=False, verbose_name="Modo Automático") 
-    active_days = models.CharField(max_length=50, blank=True, default="", help_text="Días activos (0=Lunes, 6=Domingo)") 
-    active_hours = models.TextField(blank=True, default="", help_text="Lista de horas activas separadas por coma") 
+
+    # BÚSQUEDA (texto normalizado que indexa core/busqueda.py)
+    search_document = models.TextField(blank=True, default="", editable=False)
+
+    # ESTADÍSTICAS DESNORMALIZADAS (las mantiene core/estadisticas.py)
+    avg_rating = models.DecimalField("Calificación Promedio", max_digits=3, decimal_places=2, default=0)
+    review_count = models.PositiveIntegerField("Cantidad de Reseñas", default=0)
+    rating_total = models.PositiveIntegerField(default=0, help_text="Suma de estrellas (para promediar sin redondeos)")
+    confirmed_sales = models.PositiveIntegerField("Ventas Confirmadas", default=0)
+    next_free_slot = models.DateTimeField("Próxima Hora Libre", null=True, blank=True)
+
+    CAMPOS_ESTADISTICAS = ('avg_rating', 'review_count', 'rating_total', 'confirmed_sales', 'next_free_slot')
+
+    def save(self, *args, **kwargs):
+        from .busqueda import construir_documento
+        self.search_document = construir_documento(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and self.pk and not self._state.adding:
+            # Las estadísticas se actualizan con UPDATEs atómicos: un save() normal no las pisa
+            update_fields = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.CAMPOS_ESTADISTICAS
+            ]
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'search_document'}
+        super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_approved', '-avg_rating'], name='asesor_aprobado_rating_idx'),
+            models.Index(fields=['is_approved', 'next_free_slot'], name='asesor_aprobado_proxima_idx'),
+            models.Index(fields=['is_approved', 'hourly_rate', 'id'], name='asesor_aprobado_precio_idx'),
+            models.Index(fields=['is_approved', 'specialty'], name='asesor_aprobado_especial_idx'),
+            models.Index(fields=['is_approved', 'session_duration'], name='asesor_aprobado_duracion_idx'),
+        ]
 
     def __str__(self):
         return f"Perfil de {self.user.username} - {self.public_title}"
@@ -73,10 +106,52 @@ class Availability(models.Model):
 
     class Meta:
         ordering = ['date', 'start_time'] # Mejora: Ordenar cronológicamente
+        constraints = [
+            models.UniqueConstraint(fields=['asesor', 'date', 'start_time'], name='bloque_unico_por_hora'),
+        ]
 
     def __str__(self):
         return f"{self.asesor} - {self.date} a las {self.start_time}"
 
+class AvailabilityRule(models.Model):
+    """
+    Regla semanal del Modo Automático: "todos los <weekday> a las <start_time>".
+    Sus bloques se generan al vuelo (core/agenda.py); solo se guarda un Availability
+    cuando alguien reserva ese bloque.
+    """
+    asesor = models.ForeignKey(AsesorProfile, on_delete=models.CASCADE, related_name='availability_rules')
+    weekday = models.PositiveSmallIntegerField("Día", help_text="0=Lunes, 6=Domingo")
+    start_time = models.TimeField("Hora Inicio")
+    duration_minutes = models.PositiveIntegerField("Duración (minutos)", default=60)
+    timezone = models.CharField("Zona Horaria", max_length=50, default='America/Santiago')
+    valid_from = models.DateField("Vigente desde")
+    valid_until = models.DateField("Vigente hasta", null=True, blank=True, help_text="Vacío = indefinido")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['weekday', 'start_time']
+        constraints = [
+            models.UniqueConstraint(fields=['asesor', 'weekday', 'start_time'], name='regla_unica_por_hora'),
+        ]
+
+    def __str__(self):
+        return f"{self.asesor} - día {self.weekday} a las {self.start_time}"
+
+class AvailabilityException(models.Model):
+    """Bloque que una regla generaría pero el asesor quitó (start_time vacío = todo el día)."""
+    asesor = models.ForeignKey(AsesorProfile, on_delete=models.CASCADE, related_name='availability_exceptions')
+    date = models.DateField("Fecha")
+    start_time = models.TimeField("Hora Inicio", null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['asesor', 'date'], name='excepcion_asesor_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.asesor} sin bloque el {self.date} {self.start_time or '(todo el día)'}"
+
 # ==========================================
 # 4. RESERVAS (LÓGICA DE NEGOCIO POTENTE)
 # ==========================================
@@ -108,6 +183,8 @@ class Appointment(models.Model):
     # RELACIONES
     client = models.ForeignKey(User, on_delete=models.CASCADE, related_name='appointments', null=True, blank=True)
     asesor = models.ForeignKey('AsesorProfile', on_delete=models.CASCADE, related_name='asesor_appointments')
+    # Bloque reservado: liberar o bloquear la hora es un UPDATE por id (sin convertir zonas horarias)
+    availability = models.ForeignKey('Availability', on_delete=models.SET_NULL, null=True, blank=True, related_name='appointments')
     
     # FECHAS
     start_datetime = models.DateTimeField("Fecha/Hora Inicio")
@@ -157,6 +234,15 @@ class Appointment(models.Model):
 
     # PAGO
     payment_token = models.CharField(max_length=100, null=True, blank=True, help_text="Referencia interna")
+    # MONTOS COBRADOS (se congelan al pagar: cambiar la tarifa del asesor no reescribe la historia)
+    price_amount = models.DecimalField("Precio cobrado", max_digits=10, decimal_places=0, null=True, blank=True)
+    penalty_amount = models.DecimalField("Multa retenida", max_digits=10, decimal_places=0, default=0)
+    refund_amount = models.DecimalField("Monto devuelto", max_digits=10, decimal_places=0, default=0)
+
+    # Preferencia de MercadoPago ya creada (se reutiliza si el checkout se reenvía sin cambios)
+    mp_preference_id = models.CharField(max_length=100, blank=True, default="")
+    mp_init_point = models.URLField(max_length=500, blank=True, default="")
+    mp_preference_hash = models.CharField(max_length=64, blank=True, default="", help_text="Huella de los datos con que se creó")
 
     # ==========================================
     # LÓGICA AGREGADA PARA HTML (MIS RESERVAS)
@@ -213,6 +299,76 @@ class Payment(models.Model):
     payment_status = models.CharField(max_length=20, default='approved')
     created_at = models.DateTimeField(auto_now_add=True)
 
+class LedgerEntry(models.Model):
+    """
+    Libro de movimientos (solo se agregan filas, nunca se editan). Los ingresos son la suma
+    de `amount`; `service_date` es la fecha de la sesión, para agrupar por mes.
+    """
+    KIND_CHOICES = (
+        ('VENTA', 'Venta'),
+        ('REEMBOLSO', 'Reembolso (descontada la multa)'),
+        ('ANULACION', 'Anulación de una venta'),
+    )
+
+    asesor = models.ForeignKey(AsesorProfile, on_delete=models.CASCADE, related_name='ledger_entries')
+    appointment = models.ForeignKey(Appointment, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=10, decimal_places=0, help_text="Negativo en reembolsos y anulaciones")
+    service_date = models.DateField("Fecha de la sesión")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['service_date'], name='movimiento_fecha_idx'),
+            models.Index(fields=['asesor', 'service_date'], name='movimiento_asesor_fecha_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError("Los movimientos no se editan: registra uno nuevo que lo compense.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} ${self.amount} ({self.service_date})"
+
+class MonthlyRevenue(models.Model):
+    """Resumen del libro por asesor y mes (lo mantiene core/contabilidad.py al agregar cada movimiento)."""
+    asesor = models.ForeignKey(AsesorProfile, on_delete=models.CASCADE, related_name='monthly_revenue')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    revenue = models.DecimalField(max_digits=12, decimal_places=0, default=0)
+    sales = models.IntegerField(default=0, help_text="Ventas menos anulaciones y reembolsos")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['asesor', 'year', 'month'], name='resumen_unico_por_mes'),
+        ]
+        indexes = [
+            models.Index(fields=['year', 'month'], name='resumen_mes_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.asesor} {self.month:02d}/{self.year}: ${self.revenue}"
+
+class PaymentNotification(models.Model):
+    """Notificación (webhook) de MercadoPago en cola: la procesa el comando `procesar_pagos`."""
+    payment_id = models.CharField("ID de pago MercadoPago", max_length=100)
+    topic = models.CharField(max_length=30, default='payment')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            # La cola: pendientes en orden de llegada
+            models.Index(fields=['processed_at', 'id'], name='notificacion_pendiente_idx'),
+            models.Index(fields=['payment_id'], name='notificacion_pago_idx'),
+        ]
+
+    def __str__(self):
+        return f"Notificación {self.topic} {self.payment_id}"
+
 class Review(models.Model):
     asesor = models.ForeignKey(AsesorProfile, on_delete=models.CASCADE, related_name='reviews')
     client = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -246,10 +402,49 @@ class ChatMessage(models.Model):
 
     class Meta:
         ordering = ['fecha'] # Mejora: Ordenar mensajes por fecha
+        indexes = [
+            # Polling del chat: "mensajes de esta conversación con id > cursor"
+            models.Index(fields=['sender', 'recipient', 'id'], name='chat_conversacion_idx'),
+            # Globo de no leídos
+            models.Index(fields=['recipient', 'leido'], name='chat_no_leidos_idx'),
+        ]
 
     def __str__(self):
         return f"De {self.sender.first_name} para {self.recipient.first_name} - {self.fecha.strftime('%d/%m %H:%M')}"
 
+class Conversation(models.Model):
+    """
+    Resumen de la conversación entre dos usuarios (user_a es siempre el de id menor). Lo
+    mantiene core/conversaciones.py al crear mensajes y al marcarlos leídos.
+    """
+    user_a = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversaciones_a')
+    user_b = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversaciones_b')
+    last_message = models.ForeignKey(ChatMessage, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_at = models.DateTimeField()
+    unread_a = models.PositiveIntegerField(default=0, help_text="Mensajes que user_a no ha leído")
+    unread_b = models.PositiveIntegerField(default=0, help_text="Mensajes que user_b no ha leído")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_a', 'user_b'], name='conversacion_unica'),
+        ]
+        indexes = [
+            # Bandeja de un usuario: sus conversaciones de la más reciente a la más antigua
+            models.Index(fields=['user_a', '-last_message_at', '-id'], name='conversacion_a_fecha_idx'),
+            models.Index(fields=['user_b', '-last_message_at', '-id'], name='conversacion_b_fecha_idx'),
+            # Bandeja del staff: todas las conversaciones, de la más reciente a la más antigua
+            models.Index(fields=['-last_message_at', '-id'], name='conversacion_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_a} ↔ {self.user_b}"
+
+    def otro(self, usuario):
+        return self.user_b if usuario.id == self.user_a_id else self.user_a
+
+    def no_leidos(self, usuario):
+        return self.unread_a if usuario.id == self.user_a_id else self.unread_b
+
 # ==========================================
 # 7. SISTEMA DE RECLAMOS / SUGERENCIAS
 # ==========================================
@@ -271,4 +466,40 @@ class SoporteUsuario(models.Model):
     leido = models.BooleanField(default=False) # Para que el admin sepa si ya lo vio
 
     def __str__(self):
-        return f"{self.get_tipo_display()} de {self.nombre}"
\ No newline at end of file
+        return f"{self.get_tipo_display()} de {self.nombre}"
+# ==========================================
+# 8. IDEMPOTENCIA (REINTENTOS Y DOBLE CLIC)
+# ==========================================
+class IdempotencyKey(models.Model):
+    """Resultado de la primera ejecución de una acción; los reintentos con la misma clave lo repiten."""
+    key = models.CharField(max_length=150, unique=True)
+    location = models.CharField("Redirección guardada", max_length=500, blank=True)  # vacío = todavía en curso
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.key
+
+# ==========================================
+# 9. CORREOS SALIENTES (OUTBOX)
+# ==========================================
+class OutgoingEmail(models.Model):
+    """Correo por enviar: se guarda en la misma transacción que el cambio y lo manda `enviar_correos`."""
+    subject = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    template = models.CharField(max_length=150, blank=True)  # si viene, el worker arma el cuerpo con `context`
+    context = models.JSONField(default=dict, blank=True)
+    from_email = models.CharField(max_length=254, blank=True)  # vacío = DEFAULT_FROM_EMAIL
+    recipients = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent_at', 'send_after', 'id'], name='correo_pendiente_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} → {', '.join(self.recipients)}"
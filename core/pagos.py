@@ -0,0 +1,361 @@
+"""
+Pagos con MercadoPago: notificaciones (webhooks), cola y confirmación en lotes.
+
+El navegador ya no confirma nada. MercadoPago avisa a `webhook_mercadopago`, que valida la
+firma y deja la notificación en PaymentNotification (un INSERT, responde al tiro). El comando
+`procesar_pagos` toma la cola por lotes, consulta cada pago una vez en la API y confirma las
+citas pagadas con UPDATEs de conjunto. Un pago rechazado no cancela la cita: MercadoPago deja
+reintentar sobre la misma preferencia y, si nadie paga, la limpieza de reservas vencidas libera
+el bloque. `pago_exitoso` solo lee el estado de la cita.
+
+Las llamadas a la API pasan por el cliente compartido (core/cliente_pagos.py). Su URL sale de
+settings.MERCADO_PAGO_API_URL, así se puede probar contra el servidor falso
+(`manage.py mercadopago_falso`).
+"""
+import hashlib
+import hmac
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Case, When, Value, CharField, DecimalField
+from django.utils.timezone import localtime, now
+
+from .models import Appointment, Availability, Payment, PaymentNotification
+from .estadisticas import sumar_ventas
+from .agenda import agenda_modificada
+from .cliente_pagos import cliente_mp, ErrorMercadoPago
+from .contabilidad import registrar_ventas
+from .reservas import MINUTOS_PARA_PAGAR
+from .correos import correo, encolar
+
+TAMANO_LOTE = 100
+MAX_INTENTOS = 5
+ESTADOS_RECHAZO = ('rejected', 'cancelled', 'refunded', 'charged_back')
+HORAS_CONCILIACION = 48
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================================
+# API
+# ==========================================
+def consultar_pago(payment_id):
+    """Estado de un pago según MercadoPago (dict de /v1/payments/<id>)."""
+    return cliente_mp().obtener_pago(payment_id)
+
+
+# ==========================================
+# WEBHOOK
+# ==========================================
+def firma_valida(cabecera_firma, request_id, data_id, secreto=None):
+    """
+    Valida la cabecera x-signature ("ts=...,v1=...") de MercadoPago:
+    v1 = HMAC-SHA256(secreto, "id:<data.id>;request-id:<x-request-id>;ts:<ts>;")
+
+    Sin secreto configurado no se acepta ninguna (tampoco en desarrollo): cualquiera podría
+    encolar pagos falsos.
+    """
+    secreto = settings.MERCADO_PAGO_WEBHOOK_SECRET if secreto is None else secreto
+    if not secreto:
+        logger.error("Webhook de MercadoPago rechazado: falta MP_WEBHOOK_SECRET")
+        return False
+
+    partes = dict(
+        parte.strip().split('=', 1) for parte in (cabecera_firma or '').split(',') if '=' in parte
+    )
+    if 'ts' not in partes or 'v1' not in partes:
+        return False
+
+    manifiesto = f"id:{str(data_id).lower()};request-id:{request_id or ''};ts:{partes['ts']};"
+    esperada = hmac.new(secreto.encode(), manifiesto.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(esperada, partes['v1'])
+
+
+def encolar_notificacion(payment_id, topic='payment'):
+    """Deja el pago en la cola (si ya hay una notificación pendiente del mismo pago, no duplica)."""
+    payment_id = str(payment_id)[:100]
+    if not PaymentNotification.objects.filter(payment_id=payment_id, processed_at__isnull=True).exists():
+        PaymentNotification.objects.create(payment_id=payment_id, topic=topic)
+
+
+# ==========================================
+# PROCESAMIENTO DE LA COLA
+# ==========================================
+def procesar_notificaciones(tamano=TAMANO_LOTE):
+    """
+    Procesa un lote de notificaciones pendientes. Retorna (procesadas, confirmadas).
+
+    Las consultas a MercadoPago (HTTP con reintentos) se hacen antes de abrir la transacción,
+    como en `conciliar`: los bloqueos sobre notificaciones y citas duran solo lo que toman los
+    UPDATEs. Varios workers pueden correr a la vez: al aplicar, cada uno bloquea las filas que
+    siguen pendientes (skip_locked) y se salta las que otro ya tomó; confirmar es idempotente,
+    así que una consulta repetida entre workers no cambia el resultado.
+    """
+    lote = list(
+        PaymentNotification.objects
+        .filter(processed_at__isnull=True, attempts__lt=MAX_INTENTOS)
+        .order_by('id')
+        .values_list('id', 'payment_id')[:tamano]
+    )
+    if not lote:
+        return 0, 0
+
+    # Un mismo pago puede venir varias veces: se consulta una sola
+    pagos, errores = {}, {}
+    for payment_id in {pid for _, pid in lote}:
+        try:
+            pagos[payment_id] = consultar_pago(payment_id)
+        except ErrorMercadoPago as e:
+            errores[payment_id] = str(e)[:255]
+
+    with transaction.atomic():
+        lote = list(
+            PaymentNotification.objects.select_for_update(skip_locked=True)
+            .filter(id__in=[nid for nid, _ in lote], processed_at__isnull=True)
+            .order_by('id')
+            .values_list('id', 'payment_id')
+        )
+        if not lote:
+            return 0, 0
+        tomados = {pid for _, pid in lote}
+
+        # Los rechazos no se aplican: el cliente puede reintentar con otra tarjeta
+        aprobados = {}
+        for payment_id, pago in pagos.items():
+            referencia = str(pago.get('external_reference') or '')
+            if payment_id in tomados and referencia.isdigit() and pago.get('status') == 'approved':
+                aprobados[int(referencia)] = pago
+
+        # reactivar: si la limpieza ya canceló la cita por vencida, el pago igual la confirma
+        # mientras su bloque siga libre
+        confirmadas = confirmar_citas(aprobados, reactivar=True)
+
+        ok = [nid for nid, pid in lote if pid not in errores]
+        PaymentNotification.objects.filter(id__in=ok).update(processed_at=now())
+        for payment_id, error in errores.items():
+            PaymentNotification.objects.filter(
+                id__in=[nid for nid, pid in lote if pid == payment_id]
+            ).update(attempts=F('attempts') + 1, last_error=error)
+
+        encolar_correos_confirmacion(confirmadas)
+    return len(lote), len(confirmadas)
+
+
+def confirmar_citas(aprobados, reactivar=False):
+    """
+    aprobados = {cita_id: pago (dict de la API)}. Confirma las que siguen POR_PAGAR en un solo
+    UPDATE, registra su Payment y retorna esas citas (para los correos). Las ya confirmadas se
+    ignoran: es idempotente.
+
+    Con reactivar=True también confirma las CANCELADAS (la limpieza las canceló antes de que
+    llegara el pago) siempre que su bloque siga libre: se vuelve a tomar con el mismo UPDATE
+    condicional de las reservas.
+    """
+    if not aprobados:
+        return []
+    citas = list(
+        Appointment.objects.select_for_update(of=('self',))
+        .filter(id__in=list(aprobados), status__in=['POR_PAGAR', 'CANCELADA'] if reactivar else ['POR_PAGAR'])
+        .select_related('client', 'asesor__user')
+        .order_by('id')
+    )
+
+    canceladas = [c for c in citas if c.status == 'CANCELADA']
+    if canceladas:
+        libres = set(
+            Availability.objects.select_for_update()
+            .filter(id__in=[c.availability_id for c in canceladas if c.availability_id], is_booked=False)
+            .values_list('id', flat=True)
+        )
+        recuperadas, tomados = [], set()
+        for cita in canceladas:
+            if cita.availability_id in libres and cita.availability_id not in tomados:
+                tomados.add(cita.availability_id)
+                recuperadas.append(cita)
+        Availability.objects.filter(id__in=tomados).update(is_booked=True)
+        transaction.on_commit(lambda: [agenda_modificada(a) for a in {c.asesor_id for c in recuperadas}])
+        citas = [c for c in citas if c.status == 'POR_PAGAR'] + recuperadas
+
+    if not citas:
+        return []
+
+    # Precio cobrado: el congelado en el checkout; si no hay, lo que informa MercadoPago
+    for cita in citas:
+        cita.price_amount = (
+            cita.price_amount or Decimal(str(aprobados[cita.id].get('transaction_amount') or 0)) or cita.asesor.hourly_rate
+        )
+
+    Appointment.objects.filter(id__in=[c.id for c in citas]).update(
+        status='CONFIRMADA',
+        payment_token=Case(
+            *[When(id=c.id, then=Value(str(aprobados[c.id]['id']))) for c in citas],
+            output_field=CharField(),
+        ),
+        price_amount=Case(
+            *[When(id=c.id, then=Value(c.price_amount)) for c in citas],
+            output_field=DecimalField(max_digits=10, decimal_places=0),
+        ),
+    )
+    registrar_ventas(citas)
+    Payment.objects.bulk_create([
+        Payment(
+            appointment_id=c.id,
+            amount=aprobados[c.id].get('transaction_amount') or 0,
+            transaction_id=str(aprobados[c.id]['id']),
+            payment_status=aprobados[c.id].get('status', 'approved'),
+        )
+        for c in citas
+    ], ignore_conflicts=True)
+    for asesor_id, cantidad in Counter(c.asesor_id for c in citas).items():
+        sumar_ventas(asesor_id, cantidad)
+    for cita in citas:
+        cita.status = 'CONFIRMADA'
+        cita.payment_token = str(aprobados[cita.id]['id'])
+    return citas
+
+
+def cancelar_citas(cita_ids):
+    """
+    Cancela las citas POR_PAGAR cuyo pago fue rechazado y libera sus bloques. Retorna cuántas.
+    Solo las que ya pasaron su ventana de pago: dentro de ella el cliente puede reintentar.
+    """
+    if not cita_ids:
+        return 0
+    filas = list(
+        Appointment.objects.select_for_update()
+        .filter(
+            id__in=list(cita_ids), status='POR_PAGAR',
+            created_at__lt=now() - timedelta(minutes=MINUTOS_PARA_PAGAR),
+        )
+        .values_list('id', 'asesor_id', 'availability_id')
+    )
+    if not filas:
+        return 0
+    Appointment.objects.filter(id__in=[f[0] for f in filas]).update(status='CANCELADA')
+    Availability.objects.filter(id__in=[f[2] for f in filas if f[2]]).update(is_booked=False)
+    transaction.on_commit(lambda: [agenda_modificada(a) for a in {f[1] for f in filas}])
+    return len(filas)
+
+
+# ==========================================
+# CONCILIACIÓN
+# ==========================================
+def _estado_final(pagos):
+    """De todos los pagos de una cita: el aprobado si hay alguno; 'rechazado' si todos fallaron; None si no se sabe."""
+    for pago in pagos:
+        if pago.get('status') == 'approved':
+            return pago
+    if pagos and all(pago.get('status') in ESTADOS_RECHAZO for pago in pagos):
+        return 'rechazado'
+    return None
+
+
+def _buscar_pagos(cita_id):
+    try:
+        return cita_id, cliente_mp().buscar_pagos(str(cita_id))
+    except ErrorMercadoPago:
+        return cita_id, None
+
+
+def conciliar(horas=HORAS_CONCILIACION, hilos=8, tamano=TAMANO_LOTE):
+    """
+    Revisa contra MercadoPago las citas POR_PAGAR y las CANCELADAS recientes (creadas en las
+    últimas `horas`), buscando sus pagos por external_reference. Consulta en paralelo con un
+    pool de `hilos` (solo HTTP, sin tocar la BD) y aplica cada lote con UPDATEs de conjunto.
+    Retorna un dict con los totales.
+    """
+    desde = now() - timedelta(hours=horas)
+    resultado = {'revisadas': 0, 'confirmadas': 0, 'canceladas': 0, 'errores': 0}
+    ultimo_id = 0
+
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        while True:
+            ids = list(
+                Appointment.objects.filter(
+                    id__gt=ultimo_id, status__in=['POR_PAGAR', 'CANCELADA'], created_at__gte=desde,
+                ).order_by('id').values_list('id', flat=True)[:tamano]
+            )
+            if not ids:
+                break
+            ultimo_id = ids[-1]
+
+            aprobados, rechazados = {}, set()
+            for cita_id, pagos in pool.map(_buscar_pagos, ids):
+                if pagos is None:
+                    resultado['errores'] += 1
+                    continue
+                estado = _estado_final(pagos)
+                if estado == 'rechazado':
+                    rechazados.add(cita_id)
+                elif estado:
+                    aprobados[cita_id] = estado
+
+            with transaction.atomic():
+                confirmadas = confirmar_citas(aprobados, reactivar=True)
+                canceladas = cancelar_citas(rechazados)
+                encolar_correos_confirmacion(confirmadas)
+
+            resultado['revisadas'] += len(ids)
+            resultado['confirmadas'] += len(confirmadas)
+            resultado['canceladas'] += canceladas
+
+    resultado['sin_cambios'] = resultado['revisadas'] - resultado['confirmadas'] - resultado['canceladas'] - resultado['errores']
+    return resultado
+
+
+# ==========================================
+# CORREOS
+# ==========================================
+def correos_confirmacion(reserva):
+    """Correo al cliente y al asesor cuando la cita queda pagada."""
+    fecha_local = localtime(reserva.start_datetime)
+    link_reunion = reserva.asesor.meeting_link
+    if not link_reunion:
+        link_reunion = "El asesor te enviará el enlace pronto."
+
+    # CORREO 1: AL CLIENTE
+    asunto_cliente = f"✅ Reserva Confirmada con {reserva.asesor.user.first_name}"
+    mensaje_cliente = f"""
+    Hola {reserva.client.first_name},
+
+    ¡Todo listo! Tu cita ha sido pagada y validada exitosamente.
+
+    ----------------------------------------
+    📅 Fecha: {fecha_local.strftime("%d/%m/%Y")}
+    ⏰ Hora: {fecha_local.strftime("%H:%M")} hrs
+
+    🔗 ENLACE DE VIDEOLLAMADA:
+    {link_reunion}
+    ----------------------------------------
+
+    ¡Te esperamos!
+    """
+
+    # CORREO 2: AL ASESOR
+    asunto_asesor = "💰 ¡Nueva Venta! Tienes una nueva reserva"
+    mensaje_asesor = f"""
+    Hola {reserva.asesor.user.first_name},
+
+    ¡Buenas noticias! {reserva.client.first_name} {reserva.client.last_name} ha reservado contigo.
+
+    📅 Fecha: {fecha_local.strftime("%d/%m/%Y")}
+    ⏰ Hora: {fecha_local.strftime("%H:%M")}
+    👤 Cliente: {reserva.client.email}
+
+    Por favor asegúrate de estar puntual.
+    """
+
+    return [
+        correo(asunto_cliente, mensaje_cliente, [reserva.client.email], settings.EMAIL_HOST_USER),
+        correo(asunto_asesor, mensaje_asesor, [reserva.asesor.user.email], settings.EMAIL_HOST_USER),
+    ]
+
+
+def encolar_correos_confirmacion(citas):
+    """Deja en el outbox los correos de las citas recién confirmadas (los envía `enviar_correos`)."""
+    return encolar([c for cita in citas for c in correos_confirmacion(cita)])
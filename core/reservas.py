@@ -0,0 +1,167 @@
+"""
+Lógica de reservas que no depende de una vista: tomar un bloque, limpieza de reservas vencidas, etc.
+"""
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.utils.timezone import now, make_aware, localtime
+
+from .models import AsesorProfile, Appointment, Availability
+from .agenda import agenda_modificada, materializar_bloque
+from .estadisticas import sumar_ventas
+from .contabilidad import registrar_anulaciones
+from .correos import correo, encolar
+
+# Minutos que tiene el cliente para pagar antes de perder la hora
+MINUTOS_PARA_PAGAR = 15
+TAMANO_LOTE = 500
+
+
+class HoraTomada(Exception):
+    """El bloque ya estaba reservado (otro cliente lo tomó primero)."""
+
+
+# ==========================================
+# TOMAR UN BLOQUE
+# ==========================================
+def tomar_bloque(horario, cliente, estado='POR_PAGAR'):
+    """
+    Reserva `horario` para `cliente` y retorna la cita creada. Lanza HoraTomada si ya no está libre.
+
+    El bloque se toma con un UPDATE condicional (WHERE is_booked = false): la base de datos
+    garantiza que solo una de las requests concurrentes afecta la fila. La cita se crea en la
+    misma transacción, así nunca queda un bloque tomado sin cita ni dos citas para un bloque.
+    """
+    inicio = make_aware(datetime.combine(horario.date, horario.start_time))
+    fin = make_aware(datetime.combine(horario.date, horario.end_time))
+
+    with transaction.atomic():
+        tomado = Availability.objects.filter(id=horario.id, is_booked=False).update(is_booked=True)
+        if not tomado:
+            raise HoraTomada(horario.id)
+
+        cita = Appointment.objects.create(
+            client=cliente,
+            asesor_id=horario.asesor_id,
+            availability_id=horario.id,
+            start_datetime=inicio,
+            end_datetime=fin,
+            status=estado,
+        )
+
+    agenda_modificada(horario.asesor_id)
+    return cita
+
+
+def confirmar_retencion(token, cliente):
+    """
+    Convierte la retención de checkout en una cita POR_PAGAR (recién aquí se escribe en la BD).
+    Lanza HoraTomada si la retención expiró, es de otro cliente o el bloque ya no está libre.
+    """
+    from .retenciones import obtener_retencion, soltar_retencion
+
+    datos = obtener_retencion(token)
+    if datos is None or datos['cliente_id'] != cliente.id:
+        raise HoraTomada(token)
+
+    asesor = AsesorProfile.objects.get(id=datos['asesor_id'])
+    horario = materializar_bloque(asesor, datos['fecha'], datos['hora'])
+    if horario is None:
+        raise HoraTomada(token)
+
+    cita = tomar_bloque(horario, cliente)
+    soltar_retencion(token)
+    return cita
+
+
+# ==========================================
+# RESERVAS VENCIDAS
+# ==========================================
+
+
+def liberar_reservas_vencidas(minutos=MINUTOS_PARA_PAGAR):
+    """
+    Cancela las reservas POR_PAGAR más antiguas que `minutos` y libera sus horarios.
+    Trabaja por lotes con UPDATEs de conjunto (no un save() por cita).
+    Retorna cuántas reservas se liberaron.
+    """
+    limite = now() - timedelta(minutes=minutos)
+    total = 0
+    asesores_afectados = set()
+
+    while True:
+        with transaction.atomic():
+            lote = list(
+                Appointment.objects.select_for_update(skip_locked=True)
+                .filter(status='POR_PAGAR', created_at__lt=limite)
+                .order_by('id')
+                .values_list('id', 'asesor_id', 'availability_id')[:TAMANO_LOTE]
+            )
+            if not lote:
+                break
+
+            Appointment.objects.filter(id__in=[fila[0] for fila in lote], status='POR_PAGAR').update(status='CANCELADA')
+
+            # Cada reserva apunta a su bloque: se liberan todos por id en un solo UPDATE
+            bloques = [bloque_id for _, _, bloque_id in lote if bloque_id]
+            Availability.objects.filter(id__in=bloques).update(is_booked=False)
+
+        total += len(lote)
+        asesores_afectados.update(fila[1] for fila in lote)
+
+        if len(lote) < TAMANO_LOTE:
+            break
+
+    for asesor_id in asesores_afectados:
+        agenda_modificada(asesor_id)
+
+    return total
+
+
+# ==========================================
+# VACACIONES
+# ==========================================
+def cancelar_por_vacaciones(asesor, inicio, fin):
+    """
+    Cancela de una vez las citas CONFIRMADAS del asesor entre `inicio` y `fin` (fechas incluidas)
+    y deja un aviso por cliente en el outbox; el worker de correos renderiza y envía por lotes.
+    Retorna los ids de las citas canceladas.
+    """
+    # Rango de datetimes (no __date) para que use el índice de start_datetime
+    desde = make_aware(datetime.combine(inicio, datetime.min.time()))
+    hasta = make_aware(datetime.combine(fin + timedelta(days=1), datetime.min.time()))
+    nombre_asesor = asesor.user.first_name
+
+    with transaction.atomic():
+        citas = list(
+            Appointment.objects.select_for_update(of=('self',))
+            .filter(asesor=asesor, status='CONFIRMADA', start_datetime__gte=desde, start_datetime__lt=hasta)
+            .select_related('client')
+            .only('id', 'asesor_id', 'start_datetime', 'price_amount', 'client__first_name', 'client__email')
+        )
+        ids = [cita.id for cita in citas]
+        if not ids:
+            return ids
+
+        Appointment.objects.filter(id__in=ids).update(status='CANCELADA')
+        sumar_ventas(asesor.id, -len(ids))
+        registrar_anulaciones(citas)
+
+        avisos = []
+        for cita in citas:
+            if not cita.client:
+                continue
+            inicio_local = localtime(cita.start_datetime)
+            avisos.append(correo(
+                f"⚠️ Cita Cancelada: {nombre_asesor} estará ausente", '', [cita.client.email],
+                plantilla='core/correos/cita_cancelada_vacaciones.txt',
+                contexto={
+                    'cliente': cita.client.first_name,
+                    'asesor': nombre_asesor,
+                    'fecha': inicio_local.strftime('%d/%m/%Y'),
+                    'hora': inicio_local.strftime('%H:%M'),
+                },
+            ))
+        encolar(avisos)
+
+    return ids
@@ -0,0 +1,79 @@
+"""
+Retenciones: el bloque queda apartado para un cliente mientras completa el checkout.
+
+Viven solo en el caché con un TTL igual a la ventana de pago: no escriben Appointment ni
+Availability, y si el cliente abandona simplemente expiran, sin limpieza en la BD. Con
+DEBUG apagado settings exige REDIS_URL, así todos los workers ven las mismas retenciones
+(el locmem de desarrollo solo sirve con un proceso). La cita se crea recién cuando el cliente
+envía el checkout (reservas.confirmar_retencion).
+
+Dos claves por retención:
+- retencion:bloque:<asesor>:<fecha>:<hora> -> token  (cache.add: solo un cliente la obtiene)
+- retencion:<token> -> datos del bloque y del cliente
+"""
+import secrets
+
+from django.core.cache import cache
+
+from .reservas import MINUTOS_PARA_PAGAR, HoraTomada
+
+TTL_RETENCION = MINUTOS_PARA_PAGAR * 60
+
+
+def _clave_bloque(asesor_id, fecha, hora):
+    return f"retencion:bloque:{asesor_id}:{fecha:%Y-%m-%d}:{hora:%H:%M}"
+
+
+def _clave_token(token):
+    return f"retencion:{token}"
+
+
+def retener_bloque(asesor_id, fecha, hora, fin, cliente_id):
+    """
+    Aparta el bloque para el cliente y retorna el token de la retención.
+    Si el mismo cliente ya lo tenía apartado, retorna su token. Lanza HoraTomada si lo tiene otro.
+    """
+    clave = _clave_bloque(asesor_id, fecha, hora)
+    token = secrets.token_urlsafe(16)
+    datos = {
+        'asesor_id': asesor_id, 'fecha': fecha, 'hora': hora, 'fin': fin, 'cliente_id': cliente_id,
+    }
+
+    # Primero los datos y después el candado: quien gane el add ya encuentra sus datos
+    cache.set(_clave_token(token), datos, TTL_RETENCION)
+    if cache.add(clave, token, TTL_RETENCION):
+        return token
+
+    cache.delete(_clave_token(token))
+    actual = cache.get(clave)
+    existente = obtener_retencion(actual) if actual else None
+    if existente and existente['cliente_id'] == cliente_id:
+        return actual
+    raise HoraTomada(f"{asesor_id}:{fecha}:{hora}")
+
+
+def obtener_retencion(token):
+    """Datos de la retención, o None si expiró (o el token no existe)."""
+    datos = cache.get(_clave_token(token))
+    if datos is None or cache.get(_clave_bloque(datos['asesor_id'], datos['fecha'], datos['hora'])) != token:
+        return None
+    return datos
+
+
+def soltar_retencion(token):
+    """Libera el bloque antes de que expire (el cliente canceló o ya se creó la cita)."""
+    datos = cache.get(_clave_token(token))
+    if datos is None:
+        return
+    clave = _clave_bloque(datos['asesor_id'], datos['fecha'], datos['hora'])
+    if cache.get(clave) == token:
+        cache.delete(clave)
+    cache.delete(_clave_token(token))
+
+
+def bloques_retenidos(asesor_id, bloques):
+    """De los (fecha, hora) dados, cuáles están retenidos ahora. Un solo get_many al caché."""
+    claves = {_clave_bloque(asesor_id, fecha, hora): (fecha, hora) for fecha, hora in bloques}
+    if not claves:
+        return set()
+    return {claves[clave] for clave in cache.get_many(list(claves))}
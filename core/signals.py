@@ -0,0 +1,48 @@
+from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import User, AsesorProfile, ChatMessage
+from .busqueda import construir_documento, instalar_indice
+from .catalogo import invalidar_catalogo
+from .tiempo_real import publicar_mensaje
+from .conversaciones import registrar_mensaje
+
+
+# El nombre del asesor es parte de su documento de búsqueda
+@receiver(post_save, sender=User)
+def actualizar_documento_busqueda(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'first_name', 'last_name'} & set(update_fields):
+        return  # Ej: el login solo actualiza last_login
+    perfil = AsesorProfile.objects.filter(user=instance).first()
+    if perfil:
+        perfil.user = instance
+        documento = construir_documento(perfil)
+        if documento != perfil.search_document:
+            AsesorProfile.objects.filter(id=perfil.id).update(search_document=documento)
+            invalidar_catalogo()
+
+
+# Aprobar, rechazar, cambiar precio o editar un perfil cambia lo que muestra el catálogo
+@receiver(post_save, sender=AsesorProfile)
+@receiver(post_delete, sender=AsesorProfile)
+def invalidar_catalogo_por_perfil(sender, instance, **kwargs):
+    invalidar_catalogo()
+
+
+# Cada mensaje nuevo actualiza su conversación y se empuja por SSE a los dos participantes (si
+# están conectados a este proceso). Las vistas crean el mensaje dentro de transaction.atomic(),
+# así mensaje y contador se confirman juntos
+@receiver(post_save, sender=ChatMessage)
+def publicar_mensaje_chat(sender, instance, created, **kwargs):
+    if created:
+        registrar_mensaje(instance)
+        transaction.on_commit(lambda: publicar_mensaje(instance))
+
+
+def reinstalar_indice_busqueda(sender, using='default', **kwargs):
+    """En SQLite los triggers FTS se pierden cuando una migración reconstruye la tabla."""
+    from django.db import connections
+    conexion = connections[using]
+    if conexion.vendor == 'sqlite':
+        instalar_indice(conexion)
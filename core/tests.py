@@ -1,3 +1,575 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import os
+import threading
+from datetime import time as hora, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import connection, OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import localtime, now
+
+from .agenda import bloques_en_ventana, generar_bloques, guardar_reglas, quitar_bloque
+from .busqueda import buscar_ids
+from .cliente_pagos import ErrorMercadoPago
+from .conversaciones import bandeja
+from .contabilidad import ingresos, resumen, registrar_reembolso, reconstruir_resumen, ranking_asesores
+from .correos import correo, encolar, enviar_pendientes
+from .models import (
+    User, AsesorProfile, Availability, Appointment, Payment, PaymentNotification, OutgoingEmail,
+    LedgerEntry, MonthlyRevenue, ChatMessage,
+)
+from .pagos import firma_valida, procesar_notificaciones, conciliar, confirmar_citas
+from .reservas import tomar_bloque, cancelar_por_vacaciones, HoraTomada, MINUTOS_PARA_PAGAR
+from .tiempo_real import PubSubRedis, eventos_chat
+from .retenciones import retener_bloque, obtener_retencion, soltar_retencion, bloques_retenidos, _clave_bloque
+
+
+def crear_asesor(nombre='asesor', tarifa=20000):
+    usuario = User.objects.create(username=nombre, first_name=nombre.title(), email=f"{nombre}@test.cl", role='ASESOR')
+    return AsesorProfile.objects.create(
+        user=usuario, public_title="Asesor de prueba", experience_summary="-", hourly_rate=tarifa,
+    )
+
+
+def crear_cliente(nombre='cliente', nombre_visible=None):
+    return User.objects.create(username=nombre, first_name=nombre_visible or nombre.title(), email=f"{nombre}@test.cl")
+
+
+def crear_bloque(asesor, dias=1, inicio=hora(10)):
+    fecha = localtime(now()).date() + timedelta(days=dias)
+    return Availability.objects.create(
+        asesor=asesor, date=fecha, start_time=inicio, end_time=hora(inicio.hour + 1),
+    )
+
+
+# ==========================================
+# BÚSQUEDA
+# ==========================================
+class BusquedaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Perfiles pendientes que calzan con la búsqueda y quedan antes en el índice
+        for i in range(3):
+            crear_asesor(f"pendiente{i}")
+        self.aprobado = crear_asesor('aprobado')
+        AsesorProfile.objects.filter(id=self.aprobado.id).update(is_approved=True)
+
+    def test_el_limite_corta_despues_de_filtrar(self):
+        aprobados = AsesorProfile.objects.filter(is_approved=True)
+        self.assertEqual(buscar_ids("prueba", aprobados, limite=2), [self.aprobado.id])
+        self.assertEqual(len(buscar_ids("prueba", limite=2)), 2)
+
+    def test_busqueda_sin_tildes_en_el_catalogo(self):
+        respuesta = self.client.get(reverse('lista_asesores'), {'q': "Prüeba", 'formato': 'json'})
+        self.assertEqual([a['id'] for a in respuesta.json()['asesores']], [self.aprobado.id])
+
+    def test_facetas_cuentan_solo_lo_que_calza_con_la_busqueda(self):
+        contador = crear_asesor('contador')
+        contador.specialty, contador.is_approved = "Contabilidad", True
+        contador.save()
+
+        respuesta = self.client.get(reverse('lista_asesores'), {'q': "contabilidad", 'formato': 'json'})
+        resultado = respuesta.json()
+        self.assertEqual([a['id'] for a in resultado['asesores']], [contador.id])
+        self.assertEqual(resultado['facetas']['especialidad'], [{'valor': "Contabilidad", 'total': 1}])
+
+
+# ==========================================
+# AGENDA
+# ==========================================
+class AgendaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.asesor = crear_asesor()
+        self.manana = localtime(now()).date() + timedelta(days=1)
+
+    def test_generar_bloques_cuenta_solo_los_insertados(self):
+        hasta = self.manana + timedelta(days=6)
+        self.assertEqual(generar_bloques(self.asesor, self.manana, hasta, range(7), ["10:00", "11:00"]), 14)
+        self.assertEqual(generar_bloques(self.asesor, self.manana, hasta, range(7), ["10:00", "12:00"]), 7)
+        self.assertEqual(Availability.objects.filter(asesor=self.asesor).count(), 21)
+
+    def test_reglas_generan_bloques_sin_filas(self):
+        guardar_reglas(self.asesor, self.manana, [self.manana.weekday()], ["09:00", "15:00"])
+        quitar_bloque(self.asesor, self.manana, hora(15))
+
+        bloques = bloques_en_ventana(self.asesor.id, self.manana, self.manana)
+        self.assertEqual([(b.start_time, b.id) for b in bloques], [(hora(9), None)])
+        self.assertFalse(Availability.objects.exists())
+
+    def test_etag_del_calendario(self):
+        self.client.force_login(crear_cliente())
+        crear_bloque(self.asesor)
+        url = reverse('api_disponibilidad', args=[self.asesor.id])
+        etag = self.client.get(url)['ETag']
+
+        def estado(if_none_match):
+            return self.client.get(url, headers={'If-None-Match': if_none_match}).status_code
+
+        self.assertEqual(estado(etag), 304)
+        self.assertEqual(estado(f'W/{etag}'), 304)
+        self.assertEqual(estado(f'"viejo", {etag}'), 304)
+        self.assertEqual(estado('*'), 304)
+        # Comparación exacta por etiqueta, no por substring
+        self.assertEqual(estado(f'"x{etag[1:-1]}"'), 200)
+        self.assertEqual(estado(f'"{etag[1:-1]}x"'), 200)
+
+
+# ==========================================
+# RESERVAS CONCURRENTES
+# ==========================================
+class ReservaConcurrenteTests(TransactionTestCase):
+    """Muchos clientes piden el mismo bloque a la vez: exactamente uno se queda con él."""
+
+    CLIENTES = 12
+
+    def test_un_solo_ganador(self):
+        asesor = crear_asesor()
+        horario = crear_bloque(asesor)
+        clientes = [crear_cliente(f"c{i}") for i in range(self.CLIENTES)]
+
+        resultados = []
+        candado = threading.Lock()
+        largada = threading.Barrier(self.CLIENTES)
+
+        def intentar(cliente):
+            try:
+                largada.wait(timeout=5)
+                tomar_bloque(horario, cliente)
+                resultado = 'ganada'
+            except HoraTomada:
+                resultado = 'tomada'
+            except OperationalError:
+                resultado = 'error'  # SQLite serializa las escrituras; el bloque sigue protegido
+            finally:
+                connection.close()
+            with candado:
+                resultados.append(resultado)
+
+        hilos = [threading.Thread(target=intentar, args=(c,)) for c in clientes]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(len(resultados), self.CLIENTES)
+        self.assertEqual(resultados.count('ganada'), 1)
+        if connection.vendor != 'sqlite':
+            self.assertNotIn('error', resultados)  # En Postgres los perdedores ven HoraTomada, no errores
+        self.assertEqual(Appointment.objects.filter(availability=horario).count(), 1)
+        self.assertTrue(Availability.objects.get(id=horario.id).is_booked)
+
+    def test_bloque_tomado_no_se_vuelve_a_tomar(self):
+        asesor = crear_asesor()
+        horario = crear_bloque(asesor)
+        tomar_bloque(horario, crear_cliente('primero'))
+        with self.assertRaises(HoraTomada):
+            tomar_bloque(horario, crear_cliente('segundo'))
+        self.assertEqual(Appointment.objects.filter(availability=horario).count(), 1)
+
+    @override_settings(DEBUG=False)
+    def test_estres_no_corre_en_produccion(self):
+        with self.assertRaises(CommandError):
+            call_command('estres_reservas', clientes=2, hilos=2)
+        self.assertFalse(User.objects.exists())
+
+
+# ==========================================
+# RETENCIONES DE CHECKOUT (CACHÉ)
+# ==========================================
+class RetencionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.asesor = crear_asesor()
+        self.fecha = localtime(now()).date() + timedelta(days=2)
+        self.uno, self.otro = crear_cliente('uno'), crear_cliente('otro')
+
+    def retener(self, cliente):
+        return retener_bloque(self.asesor.id, self.fecha, hora(10), hora(11), cliente.id)
+
+    def test_una_retencion_por_bloque(self):
+        token = self.retener(self.uno)
+        # El mismo cliente recupera su retención; otro no puede tomarla
+        self.assertEqual(self.retener(self.uno), token)
+        with self.assertRaises(HoraTomada):
+            self.retener(self.otro)
+        self.assertEqual(bloques_retenidos(self.asesor.id, [(self.fecha, hora(10)), (self.fecha, hora(11))]),
+                         {(self.fecha, hora(10))})
+
+    def test_soltar_libera_el_bloque(self):
+        token = self.retener(self.uno)
+        soltar_retencion(token)
+
+        self.assertIsNone(obtener_retencion(token))
+        nuevo = self.retener(self.otro)
+        self.assertEqual(obtener_retencion(nuevo)['cliente_id'], self.otro.id)
+
+    def test_retencion_vencida_libera_el_bloque(self):
+        token = self.retener(self.uno)
+        cache.delete(_clave_bloque(self.asesor.id, self.fecha, hora(10)))  # Lo que hace el TTL al vencer
+
+        self.assertIsNone(obtener_retencion(token))
+        nuevo = self.retener(self.otro)
+        self.assertEqual(obtener_retencion(nuevo)['cliente_id'], self.otro.id)
+
+
+# ==========================================
+# PAGOS (MERCADOPAGO FALSO)
+# ==========================================
+class MercadoPagoFalso:
+    """Reemplaza al cliente HTTP: pagos en memoria, con la misma forma que la API."""
+
+    def __init__(self):
+        self.pagos = {}
+        self.caidos = set()
+
+    def pagar(self, cita, estado='approved', monto=20000):
+        payment_id = str(len(self.pagos) + 1000)
+        self.pagos[payment_id] = {
+            'id': int(payment_id), 'status': estado,
+            'external_reference': str(cita.id), 'transaction_amount': monto,
+        }
+        return payment_id
+
+    def obtener_pago(self, payment_id):
+        if payment_id in self.caidos:
+            raise ErrorMercadoPago("pago.obtener: HTTP 503")
+        return self.pagos[payment_id]
+
+    def buscar_pagos(self, external_reference):
+        encontrados = [p for p in self.pagos.values() if p['external_reference'] == external_reference]
+        return sorted(encontrados, key=lambda p: p['id'], reverse=True)
+
+
+def firmar(secreto, data_id, request_id, ts='1700000000'):
+    v1 = hmac.new(secreto.encode(), f"id:{data_id};request-id:{request_id};ts:{ts};".encode(), hashlib.sha256).hexdigest()
+    return f"ts={ts},v1={v1}"
+
+
+class FirmaTests(TestCase):
+    def test_firma_correcta(self):
+        self.assertTrue(firma_valida(firmar('s3', '123', 'req'), 'req', '123', secreto='s3'))
+
+    def test_firma_de_otro_pago_o_secreto(self):
+        self.assertFalse(firma_valida(firmar('s3', '123', 'req'), 'req', '124', secreto='s3'))
+        self.assertFalse(firma_valida(firmar('otro', '123', 'req'), 'req', '123', secreto='s3'))
+        self.assertFalse(firma_valida('basura', 'req', '123', secreto='s3'))
+
+    @override_settings(DEBUG=True)
+    def test_sin_secreto_rechaza_incluso_en_desarrollo(self):
+        with self.assertLogs('core.pagos', level='ERROR'):
+            self.assertFalse(firma_valida(firmar('', '123', 'req'), 'req', '123', secreto=''))
+
+
+@override_settings(MERCADO_PAGO_WEBHOOK_SECRET='secreto-de-prueba')
+class PagosTests(TestCase):
+    def setUp(self):
+        self.mp = MercadoPagoFalso()
+        parche = mock.patch('core.pagos.cliente_mp', return_value=self.mp)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+        self.asesor = crear_asesor()
+        self.cliente = crear_cliente()
+        self.horario = crear_bloque(self.asesor)
+        self.cita = tomar_bloque(self.horario, self.cliente)
+
+    def notificar(self, payment_id):
+        """POST al webhook con la firma que manda MercadoPago."""
+        request_id = 'req-1'
+        return self.client.post(
+            f"{reverse('webhook_mercadopago')}?data.id={payment_id}&type=payment",
+            data={'type': 'payment', 'data': {'id': payment_id}}, content_type='application/json',
+            headers={'x-signature': firmar('secreto-de-prueba', payment_id, request_id), 'x-request-id': request_id},
+        )
+
+    def test_webhook_sin_firma_valida_se_rechaza(self):
+        respuesta = self.client.post(f"{reverse('webhook_mercadopago')}?data.id=1&type=payment")
+        self.assertEqual(respuesta.status_code, 401)
+        self.assertFalse(PaymentNotification.objects.exists())
+
+    def test_webhook_repetido_confirma_una_vez(self):
+        payment_id = self.mp.pagar(self.cita)
+        for _ in range(3):
+            self.assertEqual(self.notificar(payment_id).status_code, 200)
+        # Mientras está pendiente, las repeticiones no duplican la notificación
+        self.assertEqual(PaymentNotification.objects.count(), 1)
+
+        self.assertEqual(procesar_notificaciones(), (1, 1))
+        # MercadoPago reintenta después de procesada: se encola de nuevo pero no cambia nada
+        self.notificar(payment_id)
+        self.assertEqual(procesar_notificaciones(), (1, 0))
+
+        self.cita.refresh_from_db()
+        self.assertEqual(self.cita.status, 'CONFIRMADA')
+        self.assertEqual(self.cita.payment_token, payment_id)
+        self.assertEqual(Payment.objects.filter(appointment=self.cita).count(), 1)
+        self.assertEqual(AsesorProfile.objects.get(id=self.asesor.id).confirmed_sales, 1)
+        self.assertEqual(OutgoingEmail.objects.count(), 2)  # cliente y asesor
+
+    def test_pago_rechazado_deja_reintentar(self):
+        rechazado = self.mp.pagar(self.cita, estado='rejected')
+        self.notificar(rechazado)
+        procesar_notificaciones()
+        self.cita.refresh_from_db()
+        self.assertEqual(self.cita.status, 'POR_PAGAR')
+
+        aprobado = self.mp.pagar(self.cita)
+        self.notificar(aprobado)
+        self.assertEqual(procesar_notificaciones(), (1, 1))
+        self.cita.refresh_from_db()
+        self.assertEqual(self.cita.status, 'CONFIRMADA')
+
+    def test_pago_aprobado_recupera_cita_vencida(self):
+        # La limpieza canceló la cita antes de que llegara el pago, pero el bloque sigue libre
+        Appointment.objects.filter(id=self.cita.id).update(status='CANCELADA')
+        Availability.objects.filter(id=self.horario.id).update(is_booked=False)
+
+        self.notificar(self.mp.pagar(self.cita))
+        self.assertEqual(procesar_notificaciones(), (1, 1))
+        self.cita.refresh_from_db()
+        self.assertEqual(self.cita.status, 'CONFIRMADA')
+        self.assertTrue(Availability.objects.get(id=self.horario.id).is_booked)
+
+    def test_api_caida_reintenta_la_notificacion(self):
+        payment_id = self.mp.pagar(self.cita)
+        self.mp.caidos.add(payment_id)
+        self.notificar(payment_id)
+
+        self.assertEqual(procesar_notificaciones(), (1, 0))
+        notificacion = PaymentNotification.objects.get()
+        self.assertIsNone(notificacion.processed_at)
+        self.assertEqual(notificacion.attempts, 1)
+
+        self.mp.caidos.clear()
+        self.assertEqual(procesar_notificaciones(), (1, 1))
+        self.assertIsNotNone(PaymentNotification.objects.get().processed_at)
+
+    def test_conciliar_confirma_y_cancela(self):
+        pagada = self.cita
+        otro_horario = crear_bloque(self.asesor, inicio=hora(12))
+        rechazada = tomar_bloque(otro_horario, crear_cliente('otro'))
+        Appointment.objects.filter(id=rechazada.id).update(
+            created_at=now() - timedelta(minutes=MINUTOS_PARA_PAGAR + 1),
+        )
+        self.mp.pagar(pagada)
+        self.mp.pagar(rechazada, estado='rejected')
+
+        resultado = conciliar(hilos=2)
+        self.assertEqual((resultado['confirmadas'], resultado['canceladas'], resultado['errores']), (1, 1, 0))
+        self.assertEqual(Appointment.objects.get(id=pagada.id).status, 'CONFIRMADA')
+        self.assertEqual(Appointment.objects.get(id=rechazada.id).status, 'CANCELADA')
+        self.assertFalse(Availability.objects.get(id=otro_horario.id).is_booked)
+
+        # Otra pasada no vuelve a registrar la venta ni el pago
+        resultado = conciliar(hilos=2)
+        self.assertEqual(resultado['confirmadas'], 0)
+        self.assertEqual(Payment.objects.filter(appointment=pagada).count(), 1)
+        self.assertEqual(AsesorProfile.objects.get(id=self.asesor.id).confirmed_sales, 1)
+
+    def test_conciliar_no_cancela_dentro_de_la_ventana(self):
+        # Rechazo recién ocurrido: el cliente todavía puede pagar con otra tarjeta
+        self.mp.pagar(self.cita, estado='rejected')
+
+        resultado = conciliar(hilos=2)
+        self.assertEqual((resultado['canceladas'], resultado['sin_cambios']), (0, 1))
+        self.assertEqual(Appointment.objects.get(id=self.cita.id).status, 'POR_PAGAR')
+        self.assertTrue(Availability.objects.get(id=self.horario.id).is_booked)
+
+
+# ==========================================
+# CONTABILIDAD
+# ==========================================
+def pagar(cita, monto=20000):
+    """Confirma la cita como lo hace el worker de pagos con un pago aprobado."""
+    return confirmar_citas({cita.id: {'id': cita.id + 5000, 'status': 'approved', 'transaction_amount': monto}})
+
+
+class LibroTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.asesor = crear_asesor(tarifa=20000)
+        self.cita = tomar_bloque(crear_bloque(self.asesor), crear_cliente())
+
+    def test_precio_congelado_al_pagar(self):
+        pagar(self.cita)
+        AsesorProfile.objects.filter(id=self.asesor.id).update(hourly_rate=99000)
+
+        self.cita.refresh_from_db()
+        self.assertEqual(self.cita.price_amount, 20000)
+        self.assertEqual(ingresos(self.asesor), 20000)
+
+    def test_reembolso_descuenta_la_multa(self):
+        pagar(self.cita)
+        self.cita.refresh_from_db()
+        registrar_reembolso(self.cita)
+
+        self.cita.refresh_from_db()
+        self.assertEqual((self.cita.penalty_amount, self.cita.refund_amount), (3000, 17000))
+        self.assertEqual(
+            list(LedgerEntry.objects.order_by('id').values_list('kind', 'amount')),
+            [('VENTA', 20000), ('REEMBOLSO', -17000)],
+        )
+        self.assertEqual(ingresos(self.asesor), 3000)
+
+
+class ResumenMensualTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.asesor = crear_asesor()
+        cliente = crear_cliente()
+        self.citas = [
+            tomar_bloque(crear_bloque(self.asesor, dias=dias), cliente) for dias in (1, 40)
+        ]
+        for cita in self.citas:
+            pagar(cita)
+
+    def mes(self, cita):
+        fecha = localtime(cita.start_datetime).date()
+        return fecha.year, fecha.month
+
+    def test_una_fila_por_asesor_y_mes(self):
+        self.assertEqual(MonthlyRevenue.objects.count(), 2)
+        anio, mes = self.mes(self.citas[1])
+        self.assertEqual(resumen(self.asesor, anio, mes), {'ingresos': 20000, 'ventas': 1})
+        self.assertEqual(resumen(self.asesor), {'ingresos': 40000, 'ventas': 2})
+        self.assertEqual(ranking_asesores(), [(self.asesor.id, 2)])
+
+    def test_reconstruir_desde_el_libro(self):
+        MonthlyRevenue.objects.update(revenue=0, sales=0)
+        self.assertEqual(reconstruir_resumen(), 2)
+        self.assertEqual(resumen(self.asesor), {'ingresos': 40000, 'ventas': 2})
+
+
+# ==========================================
+# OUTBOX DE CORREOS
+# ==========================================
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class CorreosTests(TestCase):
+    def test_envia_el_outbox_y_marca_enviados(self):
+        encolar([correo(f"Asunto {i}", "Cuerpo", [f"c{i}@test.cl"]) for i in range(5)])
+
+        self.assertEqual(enviar_pendientes(tamano=3), (3, 0))
+        self.assertEqual(enviar_pendientes(tamano=3), (2, 0))
+        self.assertEqual(enviar_pendientes(tamano=3), (0, 0))
+
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(OutgoingEmail.objects.filter(sent_at__isnull=True).exists())
+
+    def test_falla_reintenta_con_espera(self):
+        encolar([correo("Bueno", "Cuerpo", ["bueno@test.cl"]), correo("Malo", "Cuerpo", ["malo@test.cl"])])
+        enviar = mail.backends.locmem.EmailBackend.send_messages
+
+        def fallar_con_malo(backend, mensajes):
+            if "malo@test.cl" in mensajes[0].to:
+                raise OSError("buzón no existe")
+            return enviar(backend, mensajes)
+
+        with mock.patch.object(mail.backends.locmem.EmailBackend, 'send_messages', fallar_con_malo):
+            self.assertEqual(enviar_pendientes(), (1, 1))
+
+        malo = OutgoingEmail.objects.get(subject="Malo")
+        self.assertIsNone(malo.sent_at)
+        self.assertEqual(malo.attempts, 1)
+        self.assertIn("buzón no existe", malo.last_error)
+        self.assertGreater(malo.send_after, now())
+        # Hasta que pase la espera no se reintenta
+        self.assertEqual(enviar_pendientes(), (0, 0))
+
+    def test_aviso_de_vacaciones_en_texto_plano(self):
+        asesor = crear_asesor()
+        cliente = crear_cliente('jose', "José & Co O'Brien")
+        cita = tomar_bloque(crear_bloque(asesor, dias=3), cliente, estado='CONFIRMADA')
+        AsesorProfile.objects.filter(id=asesor.id).update(confirmed_sales=1)
+
+        fecha = localtime(cita.start_datetime).date()
+        self.assertEqual(cancelar_por_vacaciones(asesor, fecha, fecha), [cita.id])
+        self.assertEqual(enviar_pendientes(), (1, 0))
+
+        cuerpo = mail.outbox[0].body
+        self.assertIn("Hola José & Co O'Brien,", cuerpo)
+        self.assertNotIn("&amp;", cuerpo)
+        self.assertEqual(mail.outbox[0].to, [cliente.email])
+
+
+# ==========================================
+# CHAT EN TIEMPO REAL
+# ==========================================
+class StreamChatTests(TransactionTestCase):
+    def leer(self, usuario, otro, despues_de, cantidad):
+        """Los primeros `cantidad` eventos SSE del stream (después cierra la conexión)."""
+        async def consumir():
+            stream = eventos_chat(usuario.id, otro.id, despues_de)
+            try:
+                return [await anext(stream) for _ in range(cantidad)]
+            finally:
+                await stream.aclose()
+        return async_to_sync(consumir)()
+
+    def test_mensaje_de_otro_proceso_llega_al_reconectar(self):
+        cliente, asesor = crear_cliente(), crear_cliente('asesor')
+        visto = ChatMessage.objects.create(sender=cliente, recipient=asesor, mensaje="hola")
+        # Otro worker guarda la respuesta: aquí no se publica nada (bulk_create no dispara signals)
+        respuesta, = ChatMessage.objects.bulk_create([ChatMessage(sender=asesor, recipient=cliente, mensaje="buenas")])
+
+        # El navegador reabre el stream con Last-Event-ID = el último que vio
+        retry, evento = self.leer(cliente, asesor, visto.id, 2)
+        self.assertEqual(retry, "retry: 3000\n\n")
+        self.assertIn(f"id: {respuesta.id}\n", evento)
+        self.assertIn('"mensaje": "buenas"', evento)
+
+
+@skipUnless(os.environ.get('REDIS_URL'), "Requiere un Redis (REDIS_URL)")
+class PubSubRedisTests(TestCase):
+    def test_publicado_en_otro_proceso_llega_al_suscriptor(self):
+        # Dos instancias = dos procesos: cada una con su conexión y su thread de escucha
+        worker_a, worker_b = PubSubRedis(os.environ['REDIS_URL']), PubSubRedis(os.environ['REDIS_URL'])
+
+        async def esperar():
+            suscripcion = worker_a.suscribir(42)
+            try:
+                worker_b.publicar(42, {'id': 7, 'mensaje': "hola"})
+                return await asyncio.wait_for(suscripcion[1].get(), 5)
+            finally:
+                worker_a.desuscribir(42, suscripcion)
+
+        self.assertEqual(async_to_sync(esperar)(), {'id': 7, 'mensaje': "hola"})
+
+
+# ==========================================
+# BANDEJA DEL STAFF
+# ==========================================
+class BandejaTests(TestCase):
+    def setUp(self):
+        self.jefe = User.objects.create(username='jefe', is_staff=True, is_superuser=True)
+        self.otro_jefe = User.objects.create(username='otro_jefe', is_staff=True, is_superuser=True)
+        self.uno, self.dos, self.tres = crear_cliente('uno'), crear_cliente('dos'), crear_cliente('tres')
+
+        ChatMessage.objects.create(sender=self.uno, recipient=self.jefe, mensaje="1")
+        ChatMessage.objects.create(sender=self.dos, recipient=self.otro_jefe, mensaje="2")
+        ChatMessage.objects.create(sender=self.otro_jefe, recipient=self.jefe, mensaje="interno")
+        ChatMessage.objects.create(sender=self.tres, recipient=self.jefe, mensaje="3")
+
+    def test_todas_las_conversaciones_del_equipo_por_pagina(self):
+        pagina, siguiente = bandeja(self.jefe, tamano=2)
+        # También la del otro miembro del equipo; la conversación entre ellos dos no
+        self.assertEqual([otro for otro, _ in pagina], [self.tres, self.dos])
+
+        pagina, siguiente = bandeja(self.jefe, cursor=siguiente, tamano=2)
+        self.assertEqual([otro for otro, _ in pagina], [self.uno])
+        self.assertIsNone(siguiente)
+
+        self.assertEqual([otro for otro, _ in bandeja(self.jefe, busqueda="do")[0]], [self.dos])
+
+    def test_no_leidos_del_lado_del_equipo(self):
+        self.client.force_login(self.jefe)
+        respuesta = self.client.get(reverse('admin_chat_dashboard'))
+        chats = {item['usuario'].username: item['no_leidos'] for item in respuesta.context['lista_chats']}
+        self.assertEqual(chats, {'tres': 1, 'dos': 1, 'uno': 1})
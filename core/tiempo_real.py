@@ -0,0 +1,250 @@
+"""
+Chat en tiempo real con Server-Sent Events (SSE) sobre ASGI.
+
+Cada ventana de chat abre una conexión a `stream_mensajes` (vista async). La BD se consulta
+una sola vez al abrir (lo pendiente después del cursor) y la conexión a la BD se cierra ahí
+mismo: mientras espera, el stream es solo una corrutina y una cola, así un worker ASGI
+aguanta miles de conexiones quietas sin gastar conexiones de Postgres. Cuando se guarda un
+ChatMessage (signal post_save, al hacer commit) se publica a sus dos participantes por el
+pub/sub y les llega al tiro.
+
+El pub/sub se elige en settings.CHAT_PUBSUB:
+- PubSubLocal (desarrollo): vive en la memoria del proceso.
+- PubSubRedis (con REDIS_URL): cada proceso publica en un canal de Redis y un thread por
+  proceso reparte lo recibido a sus suscriptores locales, así un mensaje guardado en otro
+  worker o nodo llega igual de inmediato.
+Como red de seguridad (Redis caído, un mensaje escrito sin pasar por el signal) el stream se
+cierra cada RESINCRONIZAR segundos y el navegador lo reabre solo (EventSource, con
+Last-Event-ID); esa reapertura trae lo pendiente desde la BD.
+
+El polling (`api_obtener_mensajes`) se mantiene: lo usan los navegadores sin EventSource y
+las ventanas mientras la conexión SSE se está reabriendo.
+"""
+import asyncio
+import json
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils.module_loading import import_string
+from django.utils.timezone import localtime
+
+from .models import ChatMessage
+
+PULSO = 20  # segundos entre comentarios keep-alive (los proxies cortan conexiones mudas)
+RESINCRONIZAR = 60  # segundos que dura cada stream; al reabrirse trae lo publicado en otro proceso
+MAX_EN_COLA = 100  # si un cliente lento se atrasa más, se descartan y los recupera de la BD
+LIMITE_MENSAJES = 200
+
+
+# ==========================================
+# PUB/SUB
+# ==========================================
+class PubSubLocal:
+    """Suscriptores de este proceso: usuario_id -> {(event loop, cola)}."""
+
+    def __init__(self):
+        self._suscriptores = {}
+        self._candado = threading.Lock()
+
+    def suscribir(self, usuario_id):
+        """Llamar desde la corrutina que va a leer la cola. Retorna la suscripción."""
+        suscripcion = (asyncio.get_running_loop(), asyncio.Queue(maxsize=MAX_EN_COLA))
+        with self._candado:
+            self._suscriptores.setdefault(usuario_id, set()).add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, usuario_id, suscripcion):
+        with self._candado:
+            suscripciones = self._suscriptores.get(usuario_id)
+            if suscripciones:
+                suscripciones.discard(suscripcion)
+                if not suscripciones:
+                    del self._suscriptores[usuario_id]
+
+    def publicar(self, usuario_id, evento):
+        """Se puede llamar desde cualquier thread (las vistas sync corren fuera del event loop)."""
+        with self._candado:
+            suscripciones = list(self._suscriptores.get(usuario_id, ()))
+        for loop, cola in suscripciones:
+            try:
+                loop.call_soon_threadsafe(_poner, cola, evento)
+            except RuntimeError:
+                pass  # El loop ya se cerró; la suscripción se limpia en su finally
+
+    def conectados(self):
+        with self._candado:
+            return sum(len(s) for s in self._suscriptores.values())
+
+
+def _poner(cola, evento):
+    if not cola.full():
+        cola.put_nowait(evento)
+
+
+class PubSubRedis(PubSubLocal):
+    """
+    PubSubLocal repartido entre procesos: `publicar` va a un canal de Redis y un thread de
+    este proceso escucha el canal y entrega a los suscriptores locales (incluidos los propios).
+    """
+
+    CANAL = 'chat:mensajes'
+    ESPERA_RECONEXION = 1  # segundos
+
+    def __init__(self, url=None):
+        import redis
+
+        super().__init__()
+        self._redis = redis.Redis.from_url(url or settings.REDIS_URL)
+        self._errores = (redis.RedisError, OSError)
+        self._escuchando = False
+
+    def suscribir(self, usuario_id):
+        self._escuchar()
+        return super().suscribir(usuario_id)
+
+    def publicar(self, usuario_id, evento):
+        try:
+            self._redis.publish(self.CANAL, json.dumps({'usuario_id': usuario_id, 'evento': evento}))
+        except self._errores:
+            # Sin Redis al menos llega a los conectados a este proceso; el resto lo trae la resincronización
+            super().publicar(usuario_id, evento)
+
+    def _conectar(self):
+        suscripcion = self._redis.pubsub(ignore_subscribe_messages=True)
+        suscripcion.subscribe(self.CANAL)
+        return suscripcion
+
+    def _escuchar(self):
+        """
+        Arranca (una vez por proceso) el thread que reparte lo publicado en el canal. La
+        primera suscripción al canal se hace aquí mismo: cuando el stream lee lo pendiente de
+        la BD, lo que se publique después ya le llega.
+        """
+        with self._candado:
+            if self._escuchando:
+                return
+            self._escuchando = True
+        try:
+            suscripcion = self._conectar()
+        except self._errores:
+            suscripcion = None  # El thread reintenta
+        threading.Thread(target=self._bucle, args=(suscripcion,), name='chat-pubsub', daemon=True).start()
+
+    def _bucle(self, suscripcion):
+        while True:
+            try:
+                suscripcion = suscripcion or self._conectar()
+                for mensaje in suscripcion.listen():
+                    datos = json.loads(mensaje['data'])
+                    PubSubLocal.publicar(self, datos['usuario_id'], datos['evento'])
+            except self._errores:
+                suscripcion = None
+                time.sleep(self.ESPERA_RECONEXION)
+
+
+_pubsub = None
+_candado_pubsub = threading.Lock()
+
+
+def pubsub():
+    """El pub/sub del proceso (clase configurable en settings.CHAT_PUBSUB)."""
+    global _pubsub
+    if _pubsub is None:
+        with _candado_pubsub:
+            if _pubsub is None:
+                _pubsub = import_string(getattr(settings, 'CHAT_PUBSUB', 'core.tiempo_real.PubSubLocal'))()
+    return _pubsub
+
+
+def publicar_mensaje(mensaje):
+    """Avisa a los dos participantes de un ChatMessage recién guardado."""
+    evento = {
+        'id': mensaje.id,
+        'sender_id': mensaje.sender_id,
+        'recipient_id': mensaje.recipient_id,
+        'mensaje': mensaje.mensaje,
+        'hora': localtime(mensaje.fecha).strftime("%H:%M"),
+    }
+    canal = pubsub()
+    canal.publicar(mensaje.sender_id, evento)
+    canal.publicar(mensaje.recipient_id, evento)
+
+
+# ==========================================
+# STREAM SSE
+# ==========================================
+def _sse(evento, usuario_id):
+    datos = {
+        'id': evento['id'],
+        'es_mio': evento['sender_id'] == usuario_id,
+        'mensaje': evento['mensaje'],
+        'hora': evento['hora'],
+    }
+    return f"id: {evento['id']}\nevent: mensaje\ndata: {json.dumps(datos)}\n\n"
+
+
+def _pendientes(usuario_id, otro_id, despues_de):
+    """
+    Lo guardado después del cursor. Cierra al final las conexiones a la BD de este thread (las
+    de la autenticación y esta consulta): con CONN_MAX_AGE seguirían abiertas mientras dure
+    el stream, una por cliente conectado.
+    """
+    try:
+        mensajes = (
+            ChatMessage.objects
+            .filter(Q(sender_id=usuario_id, recipient_id=otro_id) | Q(sender_id=otro_id, recipient_id=usuario_id))
+            .filter(id__gt=despues_de)
+            .order_by('id')[:LIMITE_MENSAJES]
+        )
+        return [{
+            'id': m.id,
+            'sender_id': m.sender_id,
+            'recipient_id': m.recipient_id,
+            'mensaje': m.mensaje,
+            'hora': localtime(m.fecha).strftime("%H:%M"),
+        } for m in mensajes]
+    finally:
+        connections.close_all()
+
+
+async def eventos_chat(usuario_id, otro_id, despues_de=0):
+    """
+    Generador async de la conversación usuario <-> otro: primero lo que haya después del
+    cursor `despues_de` (única consulta a la BD) y luego cada mensaje nuevo apenas se publica,
+    durante RESINCRONIZAR segundos.
+    """
+    canal = pubsub()
+    # Suscribirse antes de leer la BD: lo que llegue entremedio queda en la cola
+    suscripcion = canal.suscribir(usuario_id)
+    cola = suscripcion[1]
+    participantes = {usuario_id, otro_id}
+    ultimo = despues_de
+    try:
+        yield "retry: 3000\n\n"
+
+        # Mismo thread que la autenticación de la vista: así también se cierra esa conexión
+        for evento in await sync_to_async(_pendientes)(usuario_id, otro_id, ultimo):
+            ultimo = evento['id']
+            yield _sse(evento, usuario_id)
+
+        fin = time.monotonic() + RESINCRONIZAR
+        while True:
+            restante = fin - time.monotonic()
+            if restante <= 0:
+                return  # El navegador reconecta (retry) y la nueva conexión trae lo pendiente
+            try:
+                evento = await asyncio.wait_for(cola.get(), min(PULSO, restante))
+            except asyncio.TimeoutError:
+                yield ": pulso\n\n"
+                continue
+
+            if evento['id'] <= ultimo or {evento['sender_id'], evento['recipient_id']} != participantes:
+                continue
+            ultimo = evento['id']
+            yield _sse(evento, usuario_id)
+    finally:
+        canal.desuscribir(usuario_id, suscripcion)
@@ -1,18 +1,20 @@
-import random
-import mercadopago
+import hashlib
 import json
+import random
+import uuid
 import time
 from decimal import Decimal
 from datetime import datetime, date, timedelta
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
 from django.conf import settings
 from django.utils import timezone 
 from django.utils.timezone import now, localtime
 from django.contrib import messages
-from django.core.mail import send_mail
-from django.db.models import Q, Sum, Count
+from django.db.models import Q
 from django.core.files.storage import FileSystemStorage
 from django.db import transaction
 
@@ -22,147 +24,303 @@ from django.contrib.admin.views.decorators import staff_member_required
 
 from .models import AsesorProfile, Availability, Appointment, User, Review, Vacation, ChatMessage, SoporteUsuario
 from .forms import RegistroUnificadoForm, PerfilAsesorForm, ReviewForm
+from .busqueda import buscar_ids
+from .estadisticas import registrar_resena, sumar_ventas
+from .agenda import (
+    DIAS_VISIBLES, agenda_modificada, calendario, etag_vigente, ventana_valida, generar_bloques,
+    bloques_en_ventana, quitar_bloque, guardar_reglas, cerrar_reglas,
+)
+from .catalogo import (
+    CAMPOS_TARJETA, ORDENES, pagina_por_orden, pagina_por_relevancia, serializar_asesor,
+    clave_resultados, obtener_cacheado, guardar_cacheado, estadisticas_cache,
+    filtrar_por_facetas, calcular_facetas,
+)
+from .reservas import MINUTOS_PARA_PAGAR, HoraTomada, confirmar_retencion, cancelar_por_vacaciones
+from .retenciones import retener_bloque, obtener_retencion, soltar_retencion
+from .idempotencia import clave_cliente, una_sola_vez
+from .pagos import firma_valida, encolar_notificacion
+from .cliente_pagos import cliente_mp, ErrorMercadoPago, MercadoPagoNoDisponible
+from .tiempo_real import eventos_chat
+from .conversaciones import bandeja, marcar_leidos, no_leidos
+from .contabilidad import (
+    ingresos as ingresos_netos, registrar_anulaciones, registrar_reembolso,
+    resumen as resumen_ingresos, anios_con_movimientos, ranking_asesores,
+    serie as serie_ingresos, cantidad_periodos, PERIODOS, MAXIMO_PERIODOS,
+)
+
+# Mensajes por respuesta del polling del chat (la primera carga trae los últimos)
+LIMITE_MENSAJES_CHAT = 200
 
 def lista_asesores(request):
-    # 1. Empezamos con TODOS los asesores aprobados
-    asesores = AsesorProfile.objects.filter(is_approved=True)
-
-    # 2. Capturamos lo que el usuario escribió en el buscador (si escribió algo)
+    # 1. Capturamos lo que el usuario escribió en el buscador (si escribió algo)
     query = request.GET.get('q')      # 'q' será el nombre del cuadrito de texto
     precio_max = request.GET.get('precio') # 'precio' será el filtro de dinero
+    orden = request.GET.get('orden')  # precio | rating | nuevos | disponible (vacío = relevancia o nuevos)
+    cursor = request.GET.get('cursor')
+    solo_disponibles = request.GET.get('disponible') == '1'
 
-    # 3. FILTRO DE TEXTO (Nombre O Título)
-    if query:
-        asesores = asesores.filter(
-            Q(public_title__icontains=query) |       # Busca en el título (ej: "Experto Python")
-            Q(user__first_name__icontains=query) |   # O busca en el nombre (ej: "Mateo")
-            Q(user__last_name__icontains=query)      # O busca en el apellido
-        )
+    # 2. CACHÉ: si esta misma búsqueda ya se hizo en esta versión del catálogo, no tocamos la BD
+    clave = clave_resultados(request.GET)
+    resultado = obtener_cacheado(clave)
 
-    # 4. FILTRO DE PRECIO (Menor o igual a...)
-    if precio_max:
-        try:
-            asesores = asesores.filter(hourly_rate__lte=precio_max) # lte = Less Than or Equal
-        except ValueError:
-            pass # Si el usuario escribe texto en el precio, lo ignoramos
+    if resultado is None:
+        # 3. Empezamos con TODOS los asesores aprobados (solo las columnas de la tarjeta + el usuario en el mismo JOIN)
+        asesores = AsesorProfile.objects.filter(is_approved=True).select_related('user').only(*CAMPOS_TARJETA)
+
+        # 4. FILTRO DE PRECIO (Menor o igual a...)
+        if precio_max:
+            try:
+                tope = Decimal(precio_max)
+                if not tope.is_finite():
+                    raise ArithmeticError(precio_max)  # NaN / Infinity: el DecimalField no los acepta
+                asesores = asesores.filter(hourly_rate__lte=tope) # lte = Less Than or Equal
+            except ArithmeticError:
+                pass # Si el usuario escribe texto en el precio, lo ignoramos
+
+        # 5. FILTRO POR DISPONIBILIDAD (columna desnormalizada, sin agregaciones)
+        if solo_disponibles:
+            asesores = asesores.filter(next_free_slot__gte=now())
+
+        # 6. BÚSQUEDA: una sola consulta al índice (título, especialidad, experiencia, bio y nombre)
+        asesores = filtrar_por_facetas(asesores, request.GET)
+        ids_busqueda = buscar_ids(query, asesores) if query else None
+        if query:
+            asesores = asesores.filter(id__in=ids_busqueda)
+
+        # 7. FACETAS: conteos sobre lo que calza con la búsqueda y los filtros (solo en la primera página)
+        facetas = calcular_facetas(asesores) if not cursor else None
+
+        # 8. PÁGINA (cursor keyset: el costo no crece con el tamaño del catálogo)
+        if query and orden not in ORDENES:
+            pagina, siguiente = pagina_por_relevancia(asesores, ids_busqueda, cursor)  # Orden por relevancia
+        else:
+            pagina, siguiente = pagina_por_orden(asesores, orden, cursor)
+
+        resultado = {
+            'asesores': [serializar_asesor(a) for a in pagina],
+            'siguiente': siguiente,
+            'facetas': facetas,
+        }
+        guardar_cacheado(clave, resultado)
+
+    # 9. Variante JSON para el botón "Cargar más" (y para clientes que filtran por facetas)
+    if request.GET.get('formato') == 'json':
+        return JsonResponse(resultado)
 
-    # 5. Renderizamos
+    parametros = request.GET.copy()
+    parametros.pop('cursor', None)
+    parametros.pop('formato', None)
+
+    # 10. Renderizamos
     return render(request, 'core/lista_asesores.html', {
-        'asesores': asesores,
+        'asesores': resultado['asesores'],
+        'siguiente': resultado['siguiente'],
+        'facetas': resultado['facetas'],
+        'parametros': parametros.urlencode(),
+        'filtros': request.GET,
         'query_actual': query, # Pasamos esto para que el buscador no se borre al buscar
+        'orden_actual': orden,
+        'solo_disponibles': solo_disponibles,
+    })
+
+@staff_member_required
+def api_cache_catalogo(request):
+    """Contadores de hits/misses del caché del catálogo (para monitoreo)."""
+    return JsonResponse(estadisticas_cache())
+
+@staff_member_required
+def api_metricas_pagos(request):
+    """Latencias, errores y estado del circuit breaker del cliente de MercadoPago (de este proceso)."""
+    cliente = cliente_mp()
+    return JsonResponse({'circuito': cliente.circuito.estado, 'operaciones': cliente.metricas.resumen()})
+
+@staff_member_required
+def api_serie_ingresos(request):
+    """
+    Ingresos, ventas y devoluciones por período (?periodo=mes|semana&desde=YYYY-MM-DD&hasta=YYYY-MM-DD[&asesor=ID]).
+    Sin fechas devuelve el año en curso.
+    """
+    hoy = timezone.localdate()
+    periodo = request.GET.get('periodo', 'mes')
+    if periodo not in PERIODOS:
+        return JsonResponse({'error': 'El período debe ser "mes" o "semana".'}, status=400)
+    try:
+        desde = datetime.strptime(request.GET['desde'], "%Y-%m-%d").date() if request.GET.get('desde') else date(hoy.year, 1, 1)
+        hasta = datetime.strptime(request.GET['hasta'], "%Y-%m-%d").date() if request.GET.get('hasta') else date(hoy.year, 12, 31)
+        asesor_id = int(request.GET['asesor']) if request.GET.get('asesor') else None
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos (fechas YYYY-MM-DD, asesor numérico).'}, status=400)
+
+    if hasta < desde:
+        return JsonResponse({'error': '"hasta" no puede ser anterior a "desde".'}, status=400)
+    if cantidad_periodos(desde, hasta, periodo) > MAXIMO_PERIODOS:
+        return JsonResponse({'error': f'Máximo {MAXIMO_PERIODOS} períodos por consulta.'}, status=400)
+
+    return JsonResponse({
+        'periodo': periodo,
+        'desde': str(desde),
+        'hasta': str(hasta),
+        'asesor': asesor_id,
+        'serie': serie_ingresos(desde, hasta, periodo, asesor_id),
     })
 
 @login_required
 def detalle_asesor(request, asesor_id):
     asesor = get_object_or_404(AsesorProfile, id=asesor_id)
-    
-    # --- 🧹 1. LIMPIADOR DE RESERVAS ZOMBIES (ESTO YA LO TENÍAS) ---
-    tiempo_limite = now() - timedelta(minutes=15)
-    citas_vencidas = Appointment.objects.filter(
-        status='POR_PAGAR',
-        created_at__lt=tiempo_limite
-    )
-
-    for cita in citas_vencidas:
-        cita.status = 'CANCELADA'
-        cita.save()
-        
-        # Corregimos zona horaria y liberamos el bloque
-        fecha_local = localtime(cita.start_datetime)
-        Availability.objects.filter(
-            asesor=cita.asesor,
-            date=fecha_local.date(),
-            start_time=fecha_local.time()
-        ).update(is_booked=False) 
-    # -----------------------------------------------------------
-
-    # 2. RANGO DE FECHAS
-    hoy = date.today()
-    hora_actual = localtime(now()).time() # <--- ¡NUEVO! Obtenemos la hora actual exacta
-    limite_cliente = hoy + timedelta(days=60)
-    
-    # 3. BUSCAR TODOS LOS HORARIOS
-    horarios = Availability.objects.filter(
-        asesor=asesor,
-        date__gte=hoy,
-        date__lte=limite_cliente
-    ).order_by('date', 'start_time')
-
-    # 4. SERIALIZAR CON FILTRO DE HORA PASADA
-    disponibilidad_map = {}
-    
-    for h in horarios:
-        # === ¡ESTO ES LO NUEVO! ===
-        # Si la fecha es HOY y la hora del bloque ya pasó...
-        if h.date == hoy and h.start_time < hora_actual:
-            continue # ¡Saltamos este bloque! No se agrega al calendario.
-        # ==========================
-
-        fecha_str = h.date.strftime("%Y-%m-%d")
-        
-        if fecha_str not in disponibilidad_map:
-            disponibilidad_map[fecha_str] = []
-        
-        disponibilidad_map[fecha_str].append({
-            'id': h.id,
-            'hora': h.start_time.strftime("%H:%M"),
-            'disponible': not h.is_booked
-        })
-
-    disponibilidad_json = json.dumps(disponibilidad_map)
 
+    # Las reservas vencidas (POR_PAGAR > 15 min) las libera el comando
+    # `liberar_reservas_vencidas`: ver el calendario no escribe en la BD.
+    # Los horarios los pide el navegador mes a mes a `api_disponibilidad`.
     return render(request, 'core/detalle_asesor.html', {
         'asesor': asesor,
-        'disponibilidad_json': disponibilidad_json,
+        'dias_visibles': DIAS_VISIBLES,
+        'clave_idempotencia': uuid.uuid4().hex,
     })
+
+@login_required
+def api_disponibilidad(request, asesor_id):
+    """
+    Calendario de un asesor en JSON para una ventana de fechas (?desde=YYYY-MM-DD&hasta=YYYY-MM-DD).
+    Responde 304 si el navegador ya tiene la versión actual (If-None-Match).
+    """
+    try:
+        desde = datetime.strptime(request.GET['desde'], "%Y-%m-%d").date() if request.GET.get('desde') else None
+        hasta = datetime.strptime(request.GET['hasta'], "%Y-%m-%d").date() if request.GET.get('hasta') else None
+    except ValueError:
+        return JsonResponse({'error': 'Fechas inválidas (formato YYYY-MM-DD).'}, status=400)
+
+    desde, hasta = ventana_valida(desde, hasta)
+    if hasta < desde:
+        return JsonResponse({'desde': str(desde), 'hasta': str(hasta), 'disponibilidad': {}})
+
+    etag, disponibilidad = calendario(asesor_id, desde, hasta)
+
+    if etag_vigente(request.headers.get('If-None-Match'), etag):
+        respuesta = HttpResponseNotModified()
+    else:
+        respuesta = JsonResponse({'desde': str(desde), 'hasta': str(hasta), 'disponibilidad': disponibilidad})
+
+    respuesta['ETag'] = etag
+    respuesta['Cache-Control'] = 'private, no-cache'
+    return respuesta
     
 @login_required
 def reservar_hora(request, cita_id):
     # 'cita_id' es el ID del Availability (Horario)
+    horario = get_object_or_404(Availability, id=cita_id)
+
+    if horario.is_booked:
+        messages.error(request, "Esa hora ya fue tomada.")
+        return redirect('detalle_asesor', asesor_id=horario.asesor_id)
+
+    clave = clave_cliente(request)
+    return una_sola_vez(
+        request, clave and f"reservar:{request.user.id}:{clave}:{horario.id}",
+        lambda: _retener_y_pagar(request, horario.asesor_id, horario.date, horario.start_time, horario.end_time),
+        "Ya tenías esta hora apartada.", reverse('detalle_asesor', args=[horario.asesor_id]),
+    )
+
+@login_required
+def reservar_bloque(request, asesor_id, fecha, hora):
+    """Reserva por fecha y hora: sirve para los bloques del Modo Automático que todavía no tienen fila."""
+    asesor = get_object_or_404(AsesorProfile, id=asesor_id)
+
     try:
-        horario = get_object_or_404(Availability, id=cita_id)
+        fecha_dt = datetime.strptime(fecha, "%Y-%m-%d").date()
+        hora_dt = datetime.strptime(hora, "%H:%M").time()
+    except ValueError:
+        messages.error(request, "Horario inválido.")
+        return redirect('detalle_asesor', asesor_id=asesor.id)
+
+    # Solo se puede reservar dentro de la ventana visible (hoy .. hoy + 60 días)
+    desde, hasta = ventana_valida(fecha_dt, fecha_dt)
+    bloque = None
+    if desde == fecha_dt == hasta:
+        bloque = next(
+            (b for b in bloques_en_ventana(asesor.id, fecha_dt, fecha_dt) if b.start_time == hora_dt and not b.is_booked),
+            None,
+        )
 
-        # 1. Seguridad: Verificar si ya está tomado antes de hacer nada
-        if horario.is_booked:
-            messages.error(request, "Esa hora ya fue tomada.")
-            return redirect('detalle_asesor', asesor_id=horario.asesor.id)
+    if not bloque:
+        messages.error(request, "Ese horario ya no está disponible.")
+        return redirect('detalle_asesor', asesor_id=asesor.id)
 
-        # 2. Preparar fechas (Hacerlas conscientes de zona horaria)
-        start_dt = datetime.combine(horario.date, horario.start_time)
-        end_dt = datetime.combine(horario.date, horario.end_time)
-        
-        if timezone.is_naive(start_dt):
-            start_dt = timezone.make_aware(start_dt)
-        if timezone.is_naive(end_dt):
-            end_dt = timezone.make_aware(end_dt)
-
-        # === 🛡️ BLOQUE ATÓMICO (SEGURIDAD DE DATOS) ===
-        # Esto asegura que se crea la cita Y se bloquea el horario al mismo tiempo.
-        # Si una falla, se deshace la otra.
-        with transaction.atomic():
-            nueva_cita = Appointment.objects.create(
-                client=request.user,
-                asesor=horario.asesor,
-                start_datetime=start_dt,
-                end_datetime=end_dt,
-                status='POR_PAGAR'
-            )
-
-            # Bloquear Horario
-            horario.is_booked = True
-            horario.save()
-        # ===============================================
-
-        print(f"✅ Cita creada ID: {nueva_cita.id}. Redirigiendo a checkout...")
-
-        # 4. REDIRECCIÓN
-        return redirect('checkout', reserva_id=nueva_cita.id)
+    clave = clave_cliente(request)
+    return una_sola_vez(
+        request, clave and f"reservar:{request.user.id}:{clave}:{asesor.id}:{fecha}:{hora}",
+        lambda: _retener_y_pagar(request, asesor.id, bloque.date, bloque.start_time, bloque.end_time),
+        "Ya tenías esta hora apartada.", reverse('detalle_asesor', args=[asesor.id]),
+    )
 
-    except Exception as e:
-        print(f"❌ CRITICAL ERROR EN RESERVAR: {e}")
-        messages.error(request, "Ocurrió un error creando la reserva. Intenta de nuevo.")
-        # Si falla, intentamos devolver al usuario a la lista de asesores o inicio
-        return redirect('inicio')
+def _retener_y_pagar(request, asesor_id, fecha, hora, fin):
+    """Aparta el bloque en el caché (sin escribir en la BD) y manda al cliente al checkout."""
+    try:
+        token = retener_bloque(asesor_id, fecha, hora, fin, request.user.id)
+    except HoraTomada:
+        messages.error(request, "Alguien está reservando esa hora en este momento. Elige otra.")
+        return redirect('detalle_asesor', asesor_id=asesor_id)
+
+    return redirect('checkout_retencion', token=token)
+
+@login_required
+def checkout_retencion(request, token):
+    """Checkout de un bloque retenido: la cita se crea recién cuando el cliente envía sus datos."""
+    if request.method == 'POST':
+        # Doble envío del formulario: el segundo va directo al pago que generó el primero
+        clave = clave_cliente(request)
+        return una_sola_vez(
+            request, clave and f"checkout:{request.user.id}:{clave}",
+            lambda: _confirmar_retencion_y_pagar(request, token),
+            "Ya habíamos registrado tus datos, continúa con el pago.", reverse('mis_reservas'),
+        )
+
+    retencion = obtener_retencion(token)
+    if retencion is None or retencion['cliente_id'] != request.user.id:
+        return _retencion_expirada(request)
+
+    # Cita sin guardar: solo para mostrar el resumen en la caja
+    reserva = Appointment(
+        client=request.user,
+        asesor=get_object_or_404(AsesorProfile, id=retencion['asesor_id']),
+        start_datetime=timezone.make_aware(datetime.combine(retencion['fecha'], retencion['hora'])),
+        end_datetime=timezone.make_aware(datetime.combine(retencion['fecha'], retencion['fin'])),
+    )
+    return render(request, 'core/checkout.html', {
+        'reserva': reserva,
+        'url_cancelar': reverse('cancelar_retencion', args=[token]),
+        'clave_idempotencia': uuid.uuid4().hex,
+    })
+
+def _retencion_expirada(request):
+    messages.error(request, f"Tu reserva expiró (tenías {MINUTOS_PARA_PAGAR} minutos). Elige la hora nuevamente.")
+    return redirect('lista_asesores')
+
+def _confirmar_retencion_y_pagar(request, token):
+    retencion = obtener_retencion(token)
+    if retencion is None or retencion['cliente_id'] != request.user.id:
+        return _retencion_expirada(request)
+    try:
+        reserva = confirmar_retencion(token, request.user)
+    except HoraTomada:
+        messages.error(request, "Esa hora ya fue tomada.")
+        return redirect('detalle_asesor', asesor_id=retencion['asesor_id'])
+
+    respuesta = _pagar_con_mercado_pago(request, reserva)
+    if respuesta.status_code != 302:
+        # La cita POR_PAGAR ya existe y la retención se soltó: el reintento (y cualquier repetición
+        # con la misma clave) sigue desde el checkout de la cita, no desde la retención
+        messages.warning(request, "No pudimos conectar con Mercado Pago. Tu hora sigue apartada: intenta pagar de nuevo.")
+        return redirect('checkout', reserva_id=reserva.id)
+    return respuesta
+
+@login_required
+def cancelar_retencion(request, token):
+    retencion = obtener_retencion(token)
+    if retencion and retencion['cliente_id'] == request.user.id:
+        soltar_retencion(token)
+        messages.warning(request, "Reserva cancelada y hora liberada.")
+        return redirect('detalle_asesor', asesor_id=retencion['asesor_id'])
+    return redirect('lista_asesores')
 
 # Vista simple para la "Caja" (La haremos bonita después)
 @login_required
@@ -171,64 +329,89 @@ def checkout(request, reserva_id):
     reserva = get_object_or_404(Appointment, id=reserva_id, client=request.user)
     
     if request.method == 'POST':
-        # --- 1. CAPTURAR Y GUARDAR DATOS SEGÚN TIPO ---
-        tipo_doc = request.POST.get('tipo_documento') # 'BOLETA' o 'FACTURA'
-        
-        reserva.tipo_documento = tipo_doc
-        reserva.rut_facturacion = request.POST.get('rut')
-        reserva.telefono_facturacion = request.POST.get('telefono')
-        reserva.email_facturacion = request.POST.get('email')
-        
-        # Dirección Fiscal Común
-        reserva.client_address = request.POST.get('direccion')
-        reserva.client_city = request.POST.get('ciudad')
-        reserva.comuna_facturacion = request.POST.get('comuna') # Nuevo campo
-
-        if tipo_doc == 'BOLETA':
-             # En boleta usamos el nombre personal
-            reserva.nombre_facturacion = request.POST.get('nombre_boleta')
-        else:
-            # En factura usamos la Razón Social y el Giro
-            reserva.nombre_facturacion = request.POST.get('razon_social')
-            reserva.giro_facturacion = request.POST.get('giro')
+        clave = clave_cliente(request)
+        return una_sola_vez(
+            request, clave and f"checkout:{request.user.id}:{clave}",
+            lambda: _pagar_con_mercado_pago(request, reserva),
+            "Ya habíamos registrado tus datos, continúa con el pago.", reverse('mis_reservas'),
+        )
 
-        reserva.save() # ¡Guardamos todo!
-        
-        # --- 2. INTEGRACIÓN MERCADO PAGO (IGUAL QUE ANTES) ---
-        sdk = mercadopago.SDK(settings.MERCADO_PAGO_TOKEN)
-        
-        preference_data = {
-            "items": [
-                {
-                    "title": f"Asesoría con {reserva.asesor.user.first_name}",
-                    "quantity": 1,
-                    "unit_price": float(reserva.asesor.hourly_rate),
-                }
-            ],
-            "payer": {
-                "email": reserva.email_facturacion or request.user.email,
-                "name": reserva.nombre_facturacion
-            },
-            "external_reference": str(reserva.id), 
-            "back_urls": {
-                "success": request.build_absolute_uri(reverse('pago_exitoso', args=[reserva.id])),
-                "failure": request.build_absolute_uri(reverse('pago_fallido')),
-                "pending": request.build_absolute_uri(reverse('pago_fallido'))
-            },
-            "auto_return": "approved",
-        }
+    return render(request, 'core/checkout.html', {
+        'reserva': reserva,
+        'url_cancelar': f"{reverse('pago_fallido')}?external_reference={reserva.id}",
+        'clave_idempotencia': uuid.uuid4().hex,
+    })
 
-        try:
-            preference_response = sdk.preference().create(preference_data)
-            if "response" in preference_response and "init_point" in preference_response["response"]:
-                url_pago = preference_response["response"]["init_point"]
-                return redirect(url_pago)
-            else:
-                return render(request, 'core/error.html', {'mensaje': 'Error MP.'})
-        except Exception as e:
-            return render(request, 'core/error.html', {'mensaje': str(e)})
+def _pagar_con_mercado_pago(request, reserva):
+    # --- 1. CAPTURAR Y GUARDAR DATOS SEGÚN TIPO ---
+    tipo_doc = request.POST.get('tipo_documento') # 'BOLETA' o 'FACTURA'
+    
+    reserva.tipo_documento = tipo_doc
+    reserva.rut_facturacion = request.POST.get('rut')
+    reserva.telefono_facturacion = request.POST.get('telefono')
+    reserva.email_facturacion = request.POST.get('email')
+    
+    # Dirección Fiscal Común
+    reserva.client_address = request.POST.get('direccion')
+    reserva.client_city = request.POST.get('ciudad')
+    reserva.comuna_facturacion = request.POST.get('comuna') # Nuevo campo
+
+    if tipo_doc == 'BOLETA':
+         # En boleta usamos el nombre personal
+        reserva.nombre_facturacion = request.POST.get('nombre_boleta')
+    else:
+        # En factura usamos la Razón Social y el Giro
+        reserva.nombre_facturacion = request.POST.get('razon_social')
+        reserva.giro_facturacion = request.POST.get('giro')
+
+    # Congelamos el precio: lo que se cobra es la tarifa de HOY, aunque el asesor la cambie después
+    reserva.price_amount = reserva.asesor.hourly_rate
+
+    reserva.save() # ¡Guardamos todo!
+    
+    # --- 2. INTEGRACIÓN MERCADO PAGO (cliente compartido con timeouts y circuit breaker) ---
+    preference_data = {
+        "items": [
+            {
+                "title": f"Asesoría con {reserva.asesor.user.first_name}",
+                "quantity": 1,
+                "unit_price": float(reserva.price_amount),
+            }
+        ],
+        "payer": {
+            "email": reserva.email_facturacion or request.user.email,
+            "name": reserva.nombre_facturacion
+        },
+        "external_reference": str(reserva.id), 
+        "notification_url": request.build_absolute_uri(reverse('webhook_mercadopago')),
+        "back_urls": {
+            "success": request.build_absolute_uri(reverse('pago_exitoso', args=[reserva.id])),
+            "failure": request.build_absolute_uri(reverse('pago_fallido')),
+            "pending": request.build_absolute_uri(reverse('pago_fallido'))
+        },
+        "auto_return": "approved",
+    }
 
-    return render(request, 'core/checkout.html', {'reserva': reserva})
+    # Si nada cambió (precio, datos del pagador, URLs) reutilizamos la preferencia ya creada
+    huella = hashlib.sha256(json.dumps(preference_data, sort_keys=True).encode()).hexdigest()
+    if reserva.mp_init_point and reserva.mp_preference_hash == huella:
+        return redirect(reserva.mp_init_point)
+
+    try:
+        preferencia = cliente_mp().crear_preferencia(preference_data)
+    except MercadoPagoNoDisponible:
+        return render(request, 'core/error.html', {'mensaje': 'Mercado Pago no está respondiendo. Intenta de nuevo en unos minutos.'})
+    except ErrorMercadoPago as e:
+        return render(request, 'core/error.html', {'mensaje': str(e)})
+
+    if "init_point" in preferencia:
+        Appointment.objects.filter(id=reserva.id).update(
+            mp_preference_id=str(preferencia.get("id", ""))[:100],
+            mp_init_point=preferencia["init_point"][:500],
+            mp_preference_hash=huella,
+        )
+        return redirect(preferencia["init_point"])
+    return render(request, 'core/error.html', {'mensaje': 'Error MP.'})
 
 @login_required
 def pago_exitoso(request, reserva_id):
@@ -246,107 +429,38 @@ def pago_exitoso(request, reserva_id):
         messages.info(request, "Esta reserva ya estaba confirmada.")
         return redirect('mis_reservas')
 
-    # C) VERIFICACIÓN REAL
-    # Solo entramos si la URL dice 'approved' Y tenemos un ID de pago
+    # C) TODAVÍA NO CONFIRMADA: la confirma el worker (`procesar_pagos`) cuando MercadoPago
+    # avisa por el webhook. Aquí no se llama a la API: a lo más dejamos el pago en la cola
+    # por si la notificación se atrasa.
     if status_url == 'approved' and payment_id:
-        try:
-            # 1. Conectamos con MP
-            sdk = mercadopago.SDK(settings.MERCADO_PAGO_TOKEN)
-            
-            # 2. Preguntamos por el estado REAL de ese pago a la API
-            payment_info = sdk.payment().get(payment_id)
-            payment_data = payment_info.get("response", {})
-            
-            # 3. Obtenemos el status real desde la base de datos de MP
-            estatus_real = payment_data.get("status")
-            
-            # 4. COMPARACIÓN DE VERDAD (Aquí atrapamos al hacker)
-            if estatus_real == 'approved':
-                # ¡AHORA SÍ ES SEGURO! Procedemos a confirmar
-                
-                # Guardamos el ID de transacción y cambiamos estado
-                reserva.payment_token = payment_id 
-                reserva.status = 'CONFIRMADA'
-                reserva.save()
-                
-                # --- AQUÍ ESTÁ TU LÓGICA DE CORREOS ORIGINAL (INTACTA) ---
-                fecha_local = timezone.localtime(reserva.start_datetime)
-                link_reunion = reserva.asesor.meeting_link
-                if not link_reunion:
-                    link_reunion = "El asesor te enviará el enlace pronto."
-
-                # CORREO 1: AL CLIENTE
-                asunto_cliente = f"✅ Reserva Confirmada con {reserva.asesor.user.first_name}"
-                mensaje_cliente = f"""
-                Hola {reserva.client.first_name},
-
-                ¡Todo listo! Tu cita ha sido pagada y validada exitosamente.
-
-                ----------------------------------------
-                📅 Fecha: {fecha_local.strftime("%d/%m/%Y")}
-                ⏰ Hora: {fecha_local.strftime("%H:%M")} hrs
-                
-                🔗 ENLACE DE VIDEOLLAMADA:
-                {link_reunion}
-                ----------------------------------------
-
-                ¡Te esperamos!
-                """
-
-                # CORREO 2: AL ASESOR
-                asunto_asesor = "💰 ¡Nueva Venta! Tienes una nueva reserva"
-                mensaje_asesor = f"""
-                Hola {reserva.asesor.user.first_name},
-                
-                ¡Buenas noticias! {reserva.client.first_name} {reserva.client.last_name} ha reservado contigo.
-                
-                📅 Fecha: {fecha_local.strftime("%d/%m/%Y")}
-                ⏰ Hora: {fecha_local.strftime("%H:%M")}
-                👤 Cliente: {reserva.client.email}
-                
-                Por favor asegúrate de estar puntual.
-                """
-
-                try:
-                    # Enviar Correo al Cliente
-                    send_mail(
-                        asunto_cliente, 
-                        mensaje_cliente, 
-                        settings.EMAIL_HOST_USER, 
-                        [reserva.client.email], 
-                        fail_silently=False
-                    )
-                    
-                    # Enviar Correo al Asesor
-                    send_mail(
-                        asunto_asesor, 
-                        mensaje_asesor, 
-                        settings.EMAIL_HOST_USER, 
-                        [reserva.asesor.user.email], 
-                        fail_silently=False
-                    )
-                    print("📧 Correos enviados exitosamente.")
-                except Exception as e:
-                    print(f"⚠️ Error enviando correos: {e}")
-
-                # REDIRECCIÓN FINAL EXITOSA
-                messages.success(request, f"¡Pago validado y exitoso! Tu cita está confirmada.")
-                return redirect('mis_reservas')
-            
-            else:
-                # El hacker puso ?status=approved pero MP dice que NO está pagado
-                messages.error(request, "Error de seguridad: El pago no figura como aprobado en Mercado Pago.")
-                return redirect('inicio')
-
-        except Exception as e:
-            print(f"Error consultando API MP: {e}")
-            messages.error(request, "Hubo un error validando el pago con el banco.")
-            return redirect('inicio')
-
+        encolar_notificacion(payment_id)
+        messages.info(request, "Estamos confirmando tu pago. Te avisaremos por correo apenas esté listo.")
+        return redirect('mis_reservas')
     else:
         # Si no trae payment_id o no dice approved
         return render(request, 'core/error.html', {'mensaje': 'El pago no fue procesado correctamente.'})
 
+@csrf_exempt
+@require_POST
+def webhook_mercadopago(request):
+    """
+    Notificaciones de MercadoPago: valida la firma y deja el pago en la cola. Nada más,
+    para responder en milisegundos (MercadoPago reintenta si tardamos o fallamos).
+    """
+    try:
+        cuerpo = json.loads(request.body or b'{}')
+    except ValueError:
+        cuerpo = {}
+    topic = request.GET.get('type') or request.GET.get('topic') or cuerpo.get('type') or cuerpo.get('topic')
+    data_id = request.GET.get('data.id') or request.GET.get('id') or (cuerpo.get('data') or {}).get('id')
+
+    if not firma_valida(request.headers.get('x-signature'), request.headers.get('x-request-id'), data_id):
+        return HttpResponse(status=401)
+
+    if topic == 'payment' and data_id:
+        encolar_notificacion(data_id, topic)
+    return HttpResponse(status=200)
+
 @login_required
 def mis_reservas(request):
     # Traer reservas
@@ -405,10 +519,9 @@ def panel_asesor(request):
     except:
         ventas = []
 
-    # 4. CÁLCULO DE INGRESOS (CORREGIDO ✅)
+    # 4. CÁLCULO DE INGRESOS (suma del libro de movimientos: montos realmente cobrados)
     try:
-        resultado = Appointment.objects.filter(asesor=asesor, status='CONFIRMADA').aggregate(Sum('asesor__hourly_rate'))
-        ingresos = resultado['asesor__hourly_rate__sum'] or 0
+        ingresos = ingresos_netos(asesor=asesor)
     except Exception as e:
         print(f"Error calculando ingresos: {e}")
         ingresos = 0
@@ -620,44 +733,11 @@ def gestionar_horarios(request):
         return redirect('solicitud_asesor')
         
     hoy = date.today()
-    limite_60_dias = hoy + timedelta(days=60)
-
-    # --- 🤖 AUTOMATIZACIÓN (CORREGIDO: Solo se ejecuta si NO estamos enviando datos) ---
-    if request.method == 'GET': # <--- ¡ESTE ES EL CAMBIO CLAVE!
-        if asesor.auto_schedule and asesor.active_days and asesor.active_hours:
-            dias_guardados = [int(d) for d in asesor.active_days.split(',') if d]
-            horas_guardadas = asesor.active_hours.split(',')
-            duracion = asesor.session_duration
-            
-            ultima_disponibilidad = Availability.objects.filter(asesor=asesor).order_by('-date').first()
-            
-            if ultima_disponibilidad:
-                fecha_inicio_auto = ultima_disponibilidad.date + timedelta(days=1)
-            else:
-                fecha_inicio_auto = hoy
-
-            # Si falta agenda para llegar a los 60 días, rellenamos
-            if fecha_inicio_auto <= limite_60_dias:
-                fecha_actual = fecha_inicio_auto
-                nuevos_bloques = 0
-                
-                while fecha_actual <= limite_60_dias:
-                    if fecha_actual.weekday() in dias_guardados:
-                        for hora_str in horas_guardadas:
-                            hora_obj = datetime.strptime(hora_str, "%H:%M").time()
-                            start_dt = datetime.combine(fecha_actual, hora_obj)
-                            end_dt = start_dt + timedelta(minutes=duracion)
-                            
-                            if not Availability.objects.filter(asesor=asesor, date=fecha_actual, start_time=hora_obj).exists():
-                                Availability.objects.create(
-                                    asesor=asesor, date=fecha_actual, start_time=hora_obj, end_time=end_dt.time()
-                                )
-                                nuevos_bloques += 1
-                    fecha_actual += timedelta(days=1)
-                
-                if nuevos_bloques > 0:
-                    messages.info(request, f"🔄 Agenda actualizada automáticamente: Se agregaron {nuevos_bloques} bloques nuevos.")
+    limite_60_dias = hoy + timedelta(days=DIAS_VISIBLES)
 
+    # --- 🤖 AUTOMATIZACIÓN ---
+    # El Modo Automático guarda reglas semanales (AvailabilityRule): sus bloques se calculan
+    # al vuelo para la ventana que se mira, no hace falta "rellenar" la agenda al entrar.
 
     # --- PROCESAR FORMULARIO MANUAL (POST) ---
     if request.method == 'POST':
@@ -681,13 +761,16 @@ def gestionar_horarios(request):
             # GUARDAR PREFERENCIA
             if es_indefinido:
                 asesor.auto_schedule = True
-                asesor.active_days = ",".join(dias_elegidos)
-                asesor.active_hours = ",".join(horas_elegidas)
                 asesor.save()
-                
-                fecha_fin_dt = fecha_inicio_dt + timedelta(days=60)
-                messages.success(request, "✅ Modo Indefinido ACTIVADO. Agenda configurada por 60 días desde la fecha elegida.")
+
+                # Reglas semanales: no se crean filas, los bloques se generan al mirar el calendario
+                guardar_reglas(asesor, fecha_inicio_dt, dias_elegidos, horas_elegidas)
+                messages.success(request, "✅ Modo Indefinido ACTIVADO. Tu agenda se repetirá cada semana desde la fecha elegida.")
+                return redirect('gestionar_horarios')
             else:
+                if asesor.auto_schedule:
+                    # Las reglas dejan de generar bloques más allá de lo que ya estaba visible
+                    cerrar_reglas(asesor, limite_60_dias)
                 asesor.auto_schedule = False
                 asesor.save()
                 
@@ -700,25 +783,8 @@ def gestionar_horarios(request):
                  messages.error(request, "Fecha fin errónea.")
                  return redirect('gestionar_horarios')
 
-            # GENERACIÓN
-            duracion = asesor.session_duration
-            fecha_actual = fecha_inicio_dt # <--- AHORA SÍ RESPETARÁ ESTA FECHA
-            creados = 0
-            dias_ints = [int(d) for d in dias_elegidos]
-
-            while fecha_actual <= fecha_fin_dt:
-                if fecha_actual.weekday() in dias_ints:
-                    for hora_str in horas_elegidas:
-                        hora_obj = datetime.strptime(hora_str, "%H:%M").time()
-                        start_dt = datetime.combine(fecha_actual, hora_obj)
-                        end_dt = start_dt + timedelta(minutes=duracion)
-                        
-                        if not Availability.objects.filter(asesor=asesor, date=fecha_actual, start_time=hora_obj).exists():
-                            Availability.objects.create(
-                                asesor=asesor, date=fecha_actual, start_time=hora_obj, end_time=end_dt.time()
-                            )
-                            creados += 1
-                fecha_actual += timedelta(days=1)
+            # GENERACIÓN (en bloque: cantidad fija de consultas)
+            creados = generar_bloques(asesor, fecha_inicio_dt, fecha_fin_dt, dias_elegidos, horas_elegidas)
 
             if creados > 0:
                 messages.success(request, f"Se crearon {creados} bloques nuevos desde el {fecha_inicio_str}.")
@@ -731,12 +797,8 @@ def gestionar_horarios(request):
         return redirect('gestionar_horarios')
 
     # --- VISTA GET ---
-    bloques = Availability.objects.filter(
-        asesor=asesor,
-        date__gte=hoy,
-        date__lte=limite_60_dias,
-        is_booked=False
-    ).order_by('date', 'start_time')
+    # Bloques libres (de reglas y manuales) de los próximos 60 días
+    bloques = [b for b in bloques_en_ventana(asesor.id, hoy, limite_60_dias) if not b.is_booked]
     
     lista_horas = [f"{h:02d}:00" for h in range(24)]
 
@@ -765,38 +827,13 @@ def registrar_vacaciones(request):
             inicio = datetime.strptime(inicio_str, '%Y-%m-%d').date()
             fin = datetime.strptime(fin_str, '%Y-%m-%d').date()
             
-            # 1. BORRAR horarios libres en ese rango
+            # 1. BORRAR horarios libres en ese rango (los del Modo Automático los oculta el registro de vacaciones)
+            Vacation.objects.create(asesor=asesor, start_date=inicio, end_date=fin)
             Availability.objects.filter(asesor=asesor, date__range=[inicio, fin], is_booked=False).delete()
             
-            # 2. CANCELAR CITAS CONFIRMADAS y AVISAR
-            citas_afectadas = Appointment.objects.filter(
-                asesor=asesor, 
-                start_datetime__date__range=[inicio, fin],
-                status='CONFIRMADA'
-            )
-            
-            canceladas = 0
-            email_origen = settings.DEFAULT_FROM_EMAIL
-            
-            for cita in citas_afectadas:
-                cita.status = 'CANCELADA'
-                cita.save()
-                canceladas += 1
-                
-                # Correo al cliente
-                try:
-                    asunto = f"⚠️ Cita Cancelada: {asesor.user.first_name} estará ausente"
-                    mensaje = f"""
-                    Hola {cita.client.first_name},
-                    
-                    Lamentamos informarte que tu cita programada para el {cita.start_datetime.strftime('%d/%m/%Y')} ha sido cancelada.
-                    El motivo es que el asesor estará fuera por vacaciones o motivos personales en esas fechas.
-                    
-                    Por favor contáctanos para reagendar o solicitar reembolso.
-                    """
-                    send_mail(asunto, mensaje, email_origen, [cita.client.email], fail_silently=True)
-                except:
-                    pass
+            # 2. CANCELAR CITAS CONFIRMADAS y AVISAR (un UPDATE; los correos salen por el outbox)
+            canceladas = len(cancelar_por_vacaciones(asesor, inicio, fin))
+            agenda_modificada(asesor.id)
 
             messages.warning(request, f"🌴 Vacaciones activadas. Se eliminaron horarios y se cancelaron {canceladas} citas (clientes notificados).")
             
@@ -808,10 +845,25 @@ def borrar_horario(request, horario_id):
     horario = get_object_or_404(Availability, id=horario_id)
     # Seguridad: Solo el dueño puede borrarlo
     if horario.asesor.user == request.user:
-        horario.delete()
+        quitar_bloque(horario.asesor, horario.date, horario.start_time)
         messages.success(request, "Horario eliminado correctamente.")
     return redirect('gestionar_horarios')
 
+# Borrar un bloque del Modo Automático (no tiene fila: queda como excepción de la regla)
+@login_required
+def borrar_bloque(request, fecha, hora):
+    asesor = get_object_or_404(AsesorProfile, user=request.user)
+    try:
+        fecha_dt = datetime.strptime(fecha, "%Y-%m-%d").date()
+        hora_dt = datetime.strptime(hora, "%H:%M").time()
+    except ValueError:
+        messages.error(request, "Horario inválido.")
+        return redirect('gestionar_horarios')
+
+    quitar_bloque(asesor, fecha_dt, hora_dt)
+    messages.success(request, "Horario eliminado correctamente.")
+    return redirect('gestionar_horarios')
+
 @user_passes_test(lambda u: u.is_superuser)
 def admin_editar_precio(request, asesor_id):
     asesor = get_object_or_404(AsesorProfile, id=asesor_id)
@@ -842,6 +894,7 @@ def dejar_resena(request, appointment_id):
             resena.client = request.user
             resena.appointment = cita
             resena.save()
+            registrar_resena(cita.asesor_id, resena.rating)
             return redirect('mis_reservas')
     else:
         form = ReviewForm()
@@ -885,20 +938,16 @@ def anular_reserva(request, reserva_id):
         messages.error(request, "No puedes anular una reunión que ya pasó.")
         return redirect('mis_reservas')
 
-    # --- CORRECCIÓN IMPORTANTE: Convertir a hora local ---
-    fecha_hora_local = timezone.localtime(reserva.start_datetime)
+    # Liberamos el bloque reservado directo por su id
+    if reserva.availability_id:
+        Availability.objects.filter(id=reserva.availability_id).update(is_booked=False)
 
-    horario = Availability.objects.filter(
-        asesor=reserva.asesor,
-        date=fecha_hora_local.date(),       # Busca la fecha local
-        start_time=fecha_hora_local.time()  # Busca la hora local
-    ).first()
-    
-    if horario:
-        horario.is_booked = False 
-        horario.save()
+    if reserva.status == 'CONFIRMADA':
+        sumar_ventas(reserva.asesor_id, -1)
+        registrar_anulaciones([reserva])
     
     reserva.delete()
+    agenda_modificada(reserva.asesor_id)
     
     messages.success(request, "Tu reserva ha sido anulada y el horario liberado.")
     return redirect('mis_reservas')
@@ -917,36 +966,28 @@ def dashboard_financiero(request):
     mes_seleccionado = int(request.GET.get('mes', hoy.month))
     anio_seleccionado = int(request.GET.get('anio', anio_por_defecto))
 
-    # 2. Rango de Años (2026 al 2050)
-    anios = list(range(2026, 2051))
+    # 2. Años con movimientos en el resumen mensual (más el actual y el elegido)
+    anios = sorted(set(anios_con_movimientos()) | {hoy.year, anio_seleccionado})
 
-    # 3. Consulta Base: Solo citas CONFIRMADAS (Pagadas)
-    ventas_historicas = Appointment.objects.filter(status='CONFIRMADA')
-    
+    # 3. Todo sale de MonthlyRevenue: una fila por asesor y mes, sin recorrer las citas
     # 4. Totales Históricos (Tarjeta Verde)
-    ingresos_totales = ventas_historicas.aggregate(Sum('asesor__hourly_rate'))['asesor__hourly_rate__sum'] or 0
-    ventas_totales = ventas_historicas.count()
-    
-    # 5. Totales del Mes Elegido (Tarjeta Azul)
-    ventas_del_mes = ventas_historicas.filter(
-        start_datetime__year=anio_seleccionado, 
-        start_datetime__month=mes_seleccionado
-    )
-    
-    total_ingresos = ventas_del_mes.aggregate(Sum('asesor__hourly_rate'))['asesor__hourly_rate__sum'] or 0
-    cantidad_ventas = ventas_del_mes.count()
+    historico = resumen_ingresos()
+    ingresos_totales = historico['ingresos']
+    ventas_totales = historico['ventas']
 
-    # 6. Ranking de Asesores (CORREGIDO 🛠️)
-    # Usamos 'asesor_appointments' que es como se llama en tu sistema
-    try:
-        top_asesores = AsesorProfile.objects.annotate(
-            total_ventas=Count('asesor_appointments', filter=Q(asesor_appointments__status='CONFIRMADA'))
-        ).order_by('-total_ventas')[:5]
-    except:
-        # Si falla por nombre, intentamos con el genérico 'appointment_set'
-        top_asesores = AsesorProfile.objects.annotate(
-            total_ventas=Count('appointment', filter=Q(appointment__status='CONFIRMADA'))
-        ).order_by('-total_ventas')[:5]
+    # 5. Totales del Mes Elegido (Tarjeta Azul)
+    del_mes = resumen_ingresos(anio=anio_seleccionado, mes=mes_seleccionado)
+    total_ingresos = del_mes['ingresos']
+    cantidad_ventas = del_mes['ventas']
+
+    # 6. Ranking de Asesores por ventas netas
+    ranking = ranking_asesores(5)
+    perfiles = AsesorProfile.objects.select_related('user').in_bulk([asesor_id for asesor_id, _ in ranking])
+    top_asesores = []
+    for asesor_id, total in ranking:
+        asesor = perfiles[asesor_id]
+        asesor.total_ventas = total
+        top_asesores.append(asesor)
 
     # 7. Lista bonita de meses
     nombres_meses = [
@@ -1043,6 +1084,9 @@ def resolver_reclamo(request, reserva_id, accion):
     reserva = get_object_or_404(Appointment, id=reserva_id)
     
     if accion == 'aprobar':
+        if reserva.status == 'CONFIRMADA':
+            sumar_ventas(reserva.asesor_id, -1)
+            registrar_reembolso(reserva)
         reserva.estado_reclamo = 'APROBADO'
         reserva.status = 'REEMBOLSADO' # Cambiamos el estado general
         reserva.save()
@@ -1067,11 +1111,13 @@ def admin_enviar_observacion(request, asesor_id):
         texto_mensaje = request.POST.get('mensaje')
         if texto_mensaje:
             # --- CORRECCIÓN: Usamos ChatMessage (el nuevo sistema) ---
-            ChatMessage.objects.create(
-                sender=request.user,       # El admin que envía (Tú)
-                recipient=asesor.user,     # El asesor que recibe
-                mensaje=texto_mensaje
-            )
+            # El mensaje y su Conversation se escriben juntos (el signal corre dentro del atomic)
+            with transaction.atomic():
+                ChatMessage.objects.create(
+                    sender=request.user,       # El admin que envía (Tú)
+                    recipient=asesor.user,     # El asesor que recibe
+                    mensaje=texto_mensaje
+                )
             messages.success(request, f"Mensaje enviado al chat de {asesor.user.first_name}.")
             return redirect('panel_administracion')
 
@@ -1128,19 +1174,14 @@ def pago_fallido(request):
             cita.status = 'CANCELADA'
             cita.save()
             
-            # 2. Convertimos a hora local para encontrar el bloque en Availability
-            fecha_local = localtime(cita.start_datetime)
-
-            # 3. Liberamos la hora inmediatamente
-            Availability.objects.filter(
-                asesor=cita.asesor,
-                date=fecha_local.date(),
-                start_time=fecha_local.time()
-            ).update(is_booked=False)
+            # 2. Liberamos la hora inmediatamente (por el id del bloque reservado)
+            if cita.availability_id:
+                Availability.objects.filter(id=cita.availability_id).update(is_booked=False)
+            agenda_modificada(cita.asesor_id)
             
             messages.warning(request, "Reserva cancelada y hora liberada. Puedes intentar agendar nuevamente.")
             
-            # 4. Redirigimos al calendario del asesor (para intentar de nuevo)
+            # 3. Redirigimos al calendario del asesor (para intentar de nuevo)
             return redirect('detalle_asesor', asesor_id=cita.asesor.id)
 
     # Si no encuentra reserva o falla algo más, al inicio
@@ -1156,11 +1197,12 @@ def asesor_enviar_mensaje(request):
         admin_user = User.objects.filter(is_superuser=True).first()
         
         if mensaje and admin_user:
-            ChatMessage.objects.create(
-                sender=request.user,
-                recipient=admin_user,
-                mensaje=mensaje
-            )
+            with transaction.atomic():
+                ChatMessage.objects.create(
+                    sender=request.user,
+                    recipient=admin_user,
+                    mensaje=mensaje
+                )
             # No enviamos 'messages.success' para que no moleste la alerta verde, 
             # el mensaje aparecerá en el chat automáticamente.
         
@@ -1168,62 +1210,19 @@ def asesor_enviar_mensaje(request):
 
 @staff_member_required
 def admin_chat_dashboard(request):
-    """Vista del Centro de Mensajes para el Jefe (MODIFICADA CON BUSCADOR Y ORDEN)"""
-    
-    # 1. CAPTURAR BÚSQUEDA (NUEVO)
-    busqueda = request.GET.get('q')
+    """Vista del Centro de Mensajes para el Jefe (con buscador, ordenada por el último mensaje)"""
+    # Todas las conversaciones con el staff, paginadas; el último mensaje y los no leídos (del
+    # lado del equipo) vienen de Conversation, sin contar mensajes
+    filas, siguiente = bandeja(request.user, request.GET.get('q'), request.GET.get('cursor'))
 
-    # 2. Obtenemos todos los mensajes (TU CÓDIGO)
-    mensajes = ChatMessage.objects.all()
-    
-    ids_usuarios = set()
-    for m in mensajes:
-        if not m.sender.is_superuser: ids_usuarios.add(m.sender.id)
-        if not m.recipient.is_superuser: ids_usuarios.add(m.recipient.id)
-    
-    asesores_objs = User.objects.filter(id__in=ids_usuarios)
-
-    # 3. APLICAR FILTRO DE BÚSQUEDA SI EXISTE (NUEVO)
-    if busqueda:
-        asesores_objs = asesores_objs.filter(
-            Q(first_name__icontains=busqueda) | 
-            Q(last_name__icontains=busqueda) |
-            Q(email__icontains=busqueda)
-        )
-    
-    # 4. CONSTRUIMOS LA LISTA (TU CÓDIGO MEJORADO)
-    lista_chats = []
-    
-    for asesor in asesores_objs:
-        # Tu conteo original
-        no_leidos = ChatMessage.objects.filter(
-            sender=asesor, 
-            recipient=request.user, 
-            leido=False
-        ).count()
-        
-        # (NUEVO) Buscamos el último mensaje para poder ordenar por fecha real
-        ultimo_msg = ChatMessage.objects.filter(
-            Q(sender=request.user, recipient=asesor) | 
-            Q(sender=asesor, recipient=request.user)
-        ).order_by('-fecha').first()
-        
-        # Usamos la fecha del último mensaje, o una fecha muy vieja si no hay
-        fecha_orden = ultimo_msg.fecha if ultimo_msg else None
-
-        lista_chats.append({
-            'usuario': asesor,
-            'no_leidos': no_leidos,
-            'fecha_orden': fecha_orden, # Guardamos esto para ordenar
-            'ultimo_mensaje': ultimo_msg # Opcional: para mostrar un preview
-        })
-    
-    # 5. ORDENAR (MODIFICADO)
-    # Antes ordenabas por 'no_leidos', ahora ordenamos por 'fecha_orden' (como WhatsApp)
-    # Si prefieres tu orden anterior, no cambies esta línea.
-    lista_chats.sort(key=lambda x: x['fecha_orden'] or "", reverse=True)
-    
-    return render(request, 'core/admin_chat_list.html', {'lista_chats': lista_chats})
+    lista_chats = [{
+        'usuario': usuario,
+        'no_leidos': conversacion.no_leidos(conversacion.otro(usuario)),
+        'fecha_orden': conversacion.last_message_at,
+        'ultimo_mensaje': conversacion.last_message,
+    } for usuario, conversacion in filas]
+
+    return render(request, 'core/admin_chat_list.html', {'lista_chats': lista_chats, 'siguiente': siguiente})
 
 @staff_member_required
 def admin_chat_detail(request, usuario_id):
@@ -1234,38 +1233,44 @@ def admin_chat_detail(request, usuario_id):
     if request.method == 'POST':
         texto = request.POST.get('mensaje')
         if texto:
-            ChatMessage.objects.create(
-                sender=request.user,
-                recipient=otro_usuario,
-                mensaje=texto
-            )
+            with transaction.atomic():
+                ChatMessage.objects.create(
+                    sender=request.user,
+                    recipient=otro_usuario,
+                    mensaje=texto
+                )
             return redirect('admin_chat_detail', usuario_id=usuario_id)
 
     # 2. MARCAR COMO LEÍDOS AL ENTRAR
-    ChatMessage.objects.filter(
-        sender=otro_usuario, 
-        recipient=request.user, 
-        leido=False
-    ).update(leido=True)
+    marcar_leidos(request.user, otro_usuario)
 
     # 3. CARGAR HISTORIAL (¡IMPORTANTE! Para que no salga en blanco)
-    historial = ChatMessage.objects.filter(
-        Q(sender=request.user, recipient=otro_usuario) | 
-        Q(sender=otro_usuario, recipient=request.user)
-    ).order_by('fecha')
+    historial = list(ChatMessage.objects.filter(_conversacion(request.user, otro_usuario)).order_by('id'))
 
     return render(request, 'core/admin_chat_detail.html', {
         'otro_usuario': otro_usuario,
-        'historial': historial # Enviamos los mensajes para pintarlos de inmediato
+        'historial': historial, # Enviamos los mensajes para pintarlos de inmediato
+        'ultimo_id': historial[-1].id if historial else 0, # Desde aquí sigue el polling
     })
     
+def _conversacion(usuario, otro):
+    return Q(sender=usuario, recipient=otro) | Q(sender=otro, recipient=usuario)
+
 @login_required
 def api_obtener_mensajes(request, usuario_id=None):
     """
     Devuelve los mensajes en formato JSON para que JavaScript los lea.
     Si es Asesor: Habla con el Admin (usuario_id=None).
     Si es Admin: Habla con el usuario_id especificado.
+
+    Con ?after_id=N solo vienen los mensajes posteriores a N (el polling manda el último id que
+    ya pintó): si no hay nada nuevo es una consulta vacía sobre el índice, no todo el historial.
     """
+    try:
+        despues_de = int(request.GET.get('after_id') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'after_id debe ser numérico.'}, status=400)
+
     if request.user.is_superuser:
         otro_usuario = get_object_or_404(User, id=usuario_id)
     else:
@@ -1273,27 +1278,56 @@ def api_obtener_mensajes(request, usuario_id=None):
         otro_usuario = User.objects.filter(is_superuser=True).first()
 
     if not otro_usuario:
-        return JsonResponse({'mensajes': []})
+        return JsonResponse({'mensajes': [], 'ultimo_id': despues_de, 'no_leidos': 0})
+
+    mensajes = ChatMessage.objects.filter(_conversacion(request.user, otro_usuario))
+    if despues_de:
+        mensajes = list(mensajes.filter(id__gt=despues_de).order_by('id')[:LIMITE_MENSAJES_CHAT])
+    else:
+        # Primera carga: los últimos mensajes, en orden
+        mensajes = list(mensajes.order_by('-id')[:LIMITE_MENSAJES_CHAT])[::-1]
+
+    lista_mensajes = [{
+        'id': m.id,
+        'es_mio': m.sender_id == request.user.id,
+        'mensaje': m.mensaje,
+        # Convertimos UTC -> Hora Local (Chile), solo para los mensajes nuevos
+        'hora': localtime(m.fecha).strftime("%H:%M"),
+    } for m in mensajes]
+
+    return JsonResponse({
+        'mensajes': lista_mensajes,
+        'ultimo_id': mensajes[-1].id if mensajes else despues_de,
+        'no_leidos': no_leidos(request.user, otro_usuario),
+    })
 
-    # Buscar conversación
-    mensajes = ChatMessage.objects.filter(
-        Q(sender=request.user, recipient=otro_usuario) | 
-        Q(sender=otro_usuario, recipient=request.user)
-    ).order_by('fecha')
+async def stream_mensajes(request, usuario_id=None):
+    """
+    Mensajes nuevos de la conversación por Server-Sent Events (vista async: una conexión
+    abierta no ocupa un thread). Mismo interlocutor que `api_obtener_mensajes`; el cursor
+    viene en Last-Event-ID (reconexión automática del navegador) o en ?after_id=N.
+    """
+    usuario = await request.auser()
+    if not usuario.is_authenticated:
+        return JsonResponse({'error': 'No autenticado.'}, status=401)
 
-    lista_mensajes = []
-    for m in mensajes:
-        # 2. LA CORRECCIÓN MÁGICA: Convertimos UTC -> Hora Local (Chile)
-        fecha_chilena = localtime(m.fecha) 
+    if usuario.is_superuser:
+        otro_usuario = await User.objects.filter(id=usuario_id).afirst()
+    else:
+        otro_usuario = await User.objects.filter(is_superuser=True).afirst()
+    if not otro_usuario:
+        return JsonResponse({'error': 'Conversación no encontrada.'}, status=404)
 
-        lista_mensajes.append({
-            'es_mio': m.sender == request.user,
-            'mensaje': m.mensaje,
-            # 3. Usamos la variable convertida, no la original
-            'hora': fecha_chilena.strftime("%H:%M") 
-        })
+    try:
+        despues_de = int(request.headers.get('Last-Event-ID') or request.GET.get('after_id') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'after_id debe ser numérico.'}, status=400)
 
-    return JsonResponse({'mensajes': lista_mensajes})
+    respuesta = StreamingHttpResponse(eventos_chat(usuario.id, otro_usuario.id, despues_de),
+                                      content_type='text/event-stream')
+    respuesta['Cache-Control'] = 'no-cache'
+    respuesta['X-Accel-Buffering'] = 'no'  # Que nginx/heroku no acumulen el stream
+    return respuesta
 
 @login_required
 def api_marcar_leido(request, usuario_id=None):
@@ -1305,7 +1339,8 @@ def api_marcar_leido(request, usuario_id=None):
             otro_usuario = User.objects.filter(is_superuser=True).first()
         
         # Marcar como leídos los que recibí de esa persona
-        ChatMessage.objects.filter(sender=otro_usuario, recipient=request.user).update(leido=True)
+        if otro_usuario:
+            marcar_leidos(request.user, otro_usuario)
         
         return JsonResponse({'status': 'ok'})
     return JsonResponse({'status': 'error'})
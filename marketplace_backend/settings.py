@@ -5,6 +5,7 @@ Django settings for marketplace_backend project.
 from pathlib import Path
 import os
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 import dj_database_url 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -121,6 +122,36 @@ DATABASES = {
 }
 
 
+# --- CACHÉ ---
+# Las versiones del catálogo, de la disponibilidad y de las series contables se invalidan
+# desde otros procesos (workers web, reaper, pagos, correos): el caché tiene que ser
+# compartido (REDIS_URL). La memoria del proceso solo sirve en desarrollo con un único
+# proceso (runserver sin los workers del Procfile).
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+    # Mensajes del chat en tiempo real entre todos los procesos (core/tiempo_real.py)
+    CHAT_PUBSUB = 'core.tiempo_real.PubSubRedis'
+elif not DEBUG:
+    raise ImproperlyConfigured(
+        "Falta REDIS_URL: con varios procesos el caché tiene que ser compartido "
+        "(en memoria cada worker vería versiones distintas del catálogo)."
+    )
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'marketplace',
+        }
+    }
+
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     { 'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator', },
@@ -181,3 +212,11 @@ DEFAULT_FROM_EMAIL = 'Marketplace Asesores <darbybenjamin000@gmail.com>'
 # Leemos el token del archivo .env.
 MERCADO_PAGO_TOKEN = config('MP_ACCESS_TOKEN')
 
+# URL base de la API (en desarrollo se puede apuntar al servidor falso: manage.py mercadopago_falso)
+MERCADO_PAGO_API_URL = config('MP_API_URL', default='https://api.mercadopago.com')
+# Clave secreta de las notificaciones (webhooks) para validar la cabecera x-signature
+MERCADO_PAGO_WEBHOOK_SECRET = config('MP_WEBHOOK_SECRET', default='')
+# Cliente HTTP (core/cliente_pagos.py): segundos de timeout y reintentos por llamada
+MERCADO_PAGO_TIMEOUT_CONEXION = config('MP_TIMEOUT_CONEXION', default=3, cast=float)
+MERCADO_PAGO_TIMEOUT_LECTURA = config('MP_TIMEOUT_LECTURA', default=10, cast=float)
+MERCADO_PAGO_REINTENTOS = config('MP_REINTENTOS', default=2, cast=int)
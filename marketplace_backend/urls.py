@@ -32,15 +32,21 @@ urlpatterns = [
     path('solicitud-asesor/', views.solicitud_asesor, name='solicitud_asesor'),
     path('mis-horarios/', views.gestionar_horarios, name='gestionar_horarios'),
     path('borrar-horario/<int:horario_id>/', views.borrar_horario, name='borrar_horario'),
+    path('borrar-bloque/<str:fecha>/<str:hora>/', views.borrar_bloque, name='borrar_bloque'),
     path('panel-asesor/editar/', views.editar_perfil_asesor, name='editar_perfil_asesor'),
     path('registrar-vacaciones/', views.registrar_vacaciones, name='registrar_vacaciones'),
     
     # --- 4. FLUJO DE RESERVA Y PAGO ---
     path('asesor/<int:asesor_id>/', views.detalle_asesor, name='detalle_asesor'),
+    path('api/asesor/<int:asesor_id>/disponibilidad/', views.api_disponibilidad, name='api_disponibilidad'),
     path('reservar-cita/<int:cita_id>/', views.reservar_hora, name='reservar_hora'),
+    path('reservar-bloque/<int:asesor_id>/<str:fecha>/<str:hora>/', views.reservar_bloque, name='reservar_bloque'),
     path('checkout/<int:reserva_id>/', views.checkout, name='checkout'),
+    path('checkout/r/<str:token>/', views.checkout_retencion, name='checkout_retencion'),
+    path('checkout/r/<str:token>/cancelar/', views.cancelar_retencion, name='cancelar_retencion'),
     path('pago-exitoso/<int:reserva_id>/', views.pago_exitoso, name='pago_exitoso'),
     path('pago-fallido/', views.pago_fallido, name='pago_fallido'),
+    path('webhooks/mercadopago/', views.webhook_mercadopago, name='webhook_mercadopago'),
     
     # --- 5. PANEL DE CLIENTE (Mis Reservas y Reseñas) ---
     path('mis-reservas/', views.mis_reservas, name='mis_reservas'),
@@ -49,6 +55,9 @@ urlpatterns = [
     path('solicitar-reembolso/<int:reserva_id>/', views.solicitar_reembolso, name='solicitar_reembolso'),
     path('solicitar-cambio/<int:reserva_id>/', views.solicitar_cambio_hora, name='solicitar_cambio_hora'),
     path('lista-asesores/', views.lista_asesores, name='lista_asesores'),
+    path('api/catalogo/cache/', views.api_cache_catalogo, name='api_cache_catalogo'),
+    path('api/pagos/metricas/', views.api_metricas_pagos, name='api_metricas_pagos'),
+    path('api/finanzas/serie/', views.api_serie_ingresos, name='api_serie_ingresos'),
     path('soporte/', views.enviar_soporte, name='enviar_soporte'),
 
     # --- 6. ADMINISTRACIÓN WEB (Para tu jefe) ---
@@ -69,6 +78,8 @@ urlpatterns = [
     
     path('api/chat/get/<int:usuario_id>/', views.api_obtener_mensajes, name='api_obtener_mensajes_admin'),
     path('api/chat/get/', views.api_obtener_mensajes, name='api_obtener_mensajes_asesor'),
+    path('api/chat/stream/<int:usuario_id>/', views.stream_mensajes, name='stream_mensajes_admin'),
+    path('api/chat/stream/', views.stream_mensajes, name='stream_mensajes_asesor'),
     
     path('api/chat/read/<int:usuario_id>/', views.api_marcar_leido, name='api_marcar_leido_admin'),
     path('api/chat/read/', views.api_marcar_leido, name='api_marcar_leido_asesor'),